@@ -1,4 +1,3 @@
-from collections import defaultdict
 from avalanche_rl.evaluation.metric_definitions import RLPluginMetric
 from avalanche.evaluation.metric_definitions import MetricValue
 from avalanche.evaluation.metric_results import MetricResult
@@ -98,21 +97,23 @@ class ReturnPluginMetric(MovingWindowedStat):
         self._last_returns_len = 0
 
     def update(self, strategy):
-        rewards = strategy.eval_rewards \
-                if self._mode == 'eval' \
-                else strategy.rewards 
-        # for efficiency, only loop through last *not seen* `window_size
-        # returns (full episodes) 
-        new_returns = self._moving_window.window_size
-        if self._mode == 'train':
-            new_returns = len(rewards['past_returns'])-self._last_returns_len
+        if self._mode == 'eval':
+            returns = strategy.eval_rewards['past_returns'][
+                -self._moving_window.window_size:]
+        else:
+            # for efficiency, only read last *not seen* `window_size`
+            # returns (full episodes) from the episode records ring
+            episodes = strategy.episodes
+            new_returns = episodes.n_records - self._last_returns_len
             if new_returns == 0:
                 # no episode finished since last update
                 return
-            new_returns = min(new_returns, self._moving_window.window_size)
-            self._last_returns_len = len(rewards['past_returns'])
+            self._last_returns_len = episodes.n_records
+            returns = episodes.last(
+                min(new_returns, self._moving_window.window_size),
+                'returns')
 
-        for return_ in rewards['past_returns'][-new_returns:]:
+        for return_ in returns:
             self._moving_window.update(return_)
 
     # Train
@@ -143,26 +144,27 @@ class EpLengthPluginMetric(MovingWindowedStat):
     def __init__(self, window_size: int, stat: str = 'mean',
                  name: str = 'episodelength', mode='train'):
         super().__init__(window_size, stat=stat, name=name, mode=mode)
-        self._actor_ep_lengths = defaultdict(lambda: 0)
+        self._last_lengths_len = 0
 
     def update(self, strategy):
-        lengths = strategy.eval_ep_lengths \
-                if self._mode == 'eval' \
-                else strategy.ep_lengths 
-        new_ep_lengths = self._moving_window.window_size
-        # iterate over parallel envs episodes (actor_id->ep_lengths)
-        for actor_id, actor_ep_lengths in lengths.items():
-            if self._mode == 'train':
-                new_ep_lengths = len(
-                    actor_ep_lengths)-self._actor_ep_lengths[actor_id]
-                if new_ep_lengths == 0:
-                    continue
-                new_ep_lengths = min(
-                    new_ep_lengths, self._moving_window.window_size)
-                self._actor_ep_lengths[actor_id] = len(actor_ep_lengths)
-
-            for ep_len in actor_ep_lengths[-new_ep_lengths:]: 
-                self._moving_window.update(ep_len)
+        if self._mode == 'eval':
+            # iterate over parallel envs episodes (actor_id->ep_lengths)
+            for actor_ep_lengths in strategy.eval_ep_lengths.values():
+                for ep_len in actor_ep_lengths[
+                        -self._moving_window.window_size:]:
+                    self._moving_window.update(ep_len)
+            return
+
+        # episodes of all parallel envs are read from the records ring
+        episodes = strategy.episodes
+        new_ep_lengths = episodes.n_records - self._last_lengths_len
+        if new_ep_lengths == 0:
+            return
+        self._last_lengths_len = episodes.n_records
+        for ep_len in episodes.last(
+                min(new_ep_lengths, self._moving_window.window_size),
+                'lengths'):
+            self._moving_window.update(ep_len)
 
     # TODO:
     # we could use same system GenericFloatMetricto specify reset callbacks
@@ -172,7 +174,7 @@ class EpLengthPluginMetric(MovingWindowedStat):
         if self._mode == 'train':
             # reset on new experience
             self.reset()
-            self._actor_ep_lengths = defaultdict(lambda: 0)
+            self._last_lengths_len = 0
 
     def after_rollout(self, strategy) -> None:
         if self._mode == 'train':
@@ -53,7 +53,12 @@ class TqdmWriteInteractiveLogger(InteractiveLogger, RLStrategyLogger):
                     metric_values: List['MetricValue'], **kwargs):
         # print("before_eval")
         self.metric_vals = {}
-        tqdm.write('\n-- >> Start of eval phase << --', file=self.file)
+        train_step = getattr(strategy, 'eval_train_step', None)
+        if train_step is not None:
+            tqdm.write(f'\n-- >> Start of eval phase (training step '
+                       f'{train_step}) << --', file=self.file)
+        else:
+            tqdm.write('\n-- >> Start of eval phase << --', file=self.file)
 
     def before_eval_exp(self, strategy: 'BaseTemplate',
                         metric_values: List['MetricValue'], **kwargs):
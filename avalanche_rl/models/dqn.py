@@ -79,6 +79,9 @@ class EWCConvDeepQN(DQNModel):
     """Model used in the original EWC paper https://arxiv.org/abs/1612.00796.
         It is a variant of the original DQN with added task-specific biases
         and gains. 
+        Forward accepts either a single task label or a tensor of per-sample
+        task labels, so that batches mixing tasks are processed by a single
+        forward.
     """
     def __init__(self, input_channels, image_shape, n_actions, n_tasks,
                  bias=False):
@@ -111,15 +114,26 @@ class EWCConvDeepQN(DQNModel):
                 setattr(self, f'gain_l{layer}_{task}', nn.parameter.Parameter(
                     torch.ones(fc_sizes[layer-1])))
 
+    def _task_params(self, name: str, task_label, ndim: int):
+        """ Select task-specific parameters `name` broadcastable to
+        activations of `ndim` dimensions, given a single or per-sample task
+        labels. Parameters are stacked only for tasks in the batch, other
+        tasks parameters get no gradient and are skipped by optimizers. """
+        if isinstance(task_label, torch.Tensor) and task_label.ndim > 0:
+            tasks, inverse = task_label.unique(return_inverse=True)
+            param = torch.stack([getattr(self, f'{name}_{task}')
+                                 for task in tasks.tolist()])[inverse]
+            # batch x 1 (channels) x ...
+            return param.view(param.shape[0], *[1] * (ndim - param.ndim),
+                              *param.shape[1:])
+        return getattr(self, f'{name}_{int(task_label)}')
+
     def forward(self, x: torch.Tensor, task_label=None) -> torch.Tensor:
         # biases and gains are game-specific: select them using task label
         for i in range(1, 4):
             x = getattr(self, f'conv{i}')(x)
-            task_bias = getattr(self, f'bias{i}_{task_label}')
-            gain = getattr(self, f'gain{i}_{task_label}')
-            # print('conv shape', x.shape, task_bias.shape)
-            x += task_bias
-            x *= gain
+            x += self._task_params(f'bias{i}', task_label, x.ndim)
+            x *= self._task_params(f'gain{i}', task_label, x.ndim)
             # torch.add(x, bias, alpha=gains)?
             x = F.relu(x)
 
@@ -127,13 +141,13 @@ class EWCConvDeepQN(DQNModel):
         x = x.flatten(1)
 
         x = self.l1(x)
-        x += getattr(self, f'bias_l1_{task_label}')
-        x *= getattr(self, f'gain_l1_{task_label}')
+        x += self._task_params('bias_l1', task_label, x.ndim)
+        x *= self._task_params('gain_l1', task_label, x.ndim)
         x = F.relu(x)
 
         x = self.l2(x)
-        x += getattr(self, f'bias_l2_{task_label}')
-        x *= getattr(self, f'gain_l2_{task_label}')
+        x += self._task_params('bias_l2', task_label, x.ndim)
+        x *= self._task_params('gain_l2', task_label, x.ndim)
 
         return x
 
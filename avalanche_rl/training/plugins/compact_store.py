@@ -0,0 +1,174 @@
+import os
+import tempfile
+import numpy as np
+import torch
+from dataclasses import dataclass
+from torch import Tensor
+from typing import Dict, Optional, Union
+
+
+@dataclass
+class _Entry:
+    """ A flat tensor stored in compact form. """
+    # dense values, or non-zero values if `indices` is set; either a tensor
+    # or a memory mapped array once spilled to disk
+    values: Union[Tensor, np.memmap]
+    indices: Optional[Union[Tensor, np.memmap]]
+    numel: int
+    dtype: torch.dtype
+    device: torch.device
+
+    @property
+    def on_disk(self) -> bool:
+        return isinstance(self.values, np.memmap)
+
+    @property
+    def nbytes(self) -> int:
+        nbytes = self.values.nbytes if self.on_disk else \
+            self.values.numel() * self.values.element_size()
+        if self.indices is not None:
+            nbytes += self.indices.nbytes if self.on_disk else \
+                self.indices.numel() * self.indices.element_size()
+        return nbytes
+
+
+class CompactTensorStore:
+    """
+    Dict-like store of flat tensors indexed by experience, keeping them in
+    compact form: values are cast to a lower precision `dtype`, tensors with
+    mostly zero values are stored as (indices, values) pairs and all but the
+    `max_in_memory` most recent entries are spilled to memory mapped files,
+    in a temporary directory deleted by `close`.
+    Tensors are returned dense, with their original dtype and device.
+    """
+    def __init__(self, dtype: torch.dtype = None,
+                 max_in_memory: int = None, spill_dir: str = None):
+        """
+        Args:
+            dtype (torch.dtype, optional): Storage dtype of values, e.g.
+                    `torch.float16` or `torch.bfloat16`. Defaults to None
+                    (original dtype).
+            max_in_memory (int, optional): Max number of entries kept in
+                    memory, older ones are spilled to disk. Defaults to None
+                    (everything kept in memory).
+            spill_dir (str, optional): Directory in which a temporary
+                    directory holding spilled entries is created. Defaults to
+                    the system temporary directory.
+        """
+        assert max_in_memory is None or max_in_memory >= 0, \
+            "Number of in-memory entries can't be negative"
+        self.dtype = dtype
+        self.max_in_memory = max_in_memory
+        self.spill_dir = spill_dir
+        self._spill_path: tempfile.TemporaryDirectory = None
+        self._entries: Dict[int, _Entry] = {}
+
+    def __setitem__(self, key: int, tensor: Tensor):
+        if key in self._entries:
+            del self[key]
+        tensor = tensor.detach().view(-1)
+        dtype = self.dtype if self.dtype is not None else tensor.dtype
+        indices = None
+        nnz = int(torch.count_nonzero(tensor))
+        # store sparse only if it actually saves memory (empty arrays can't
+        # be memory mapped)
+        element_size = torch.empty(0, dtype=dtype).element_size()
+        if 0 < nnz and \
+                nnz * (element_size + 4) < tensor.numel() * element_size:
+            indices = tensor.nonzero().view(-1)
+            values = tensor[indices]
+            indices = indices.int()
+        else:
+            values = tensor
+        self._entries[key] = _Entry(
+            values.to(dtype, copy=True), indices, tensor.numel(),
+            tensor.dtype, tensor.device)
+        self._spill()
+
+    def __getitem__(self, key: int) -> Tensor:
+        entry = self._entries[key]
+        values, indices = entry.values, entry.indices
+        if entry.on_disk:
+            values = _from_memmap(values, self.dtype or entry.dtype)
+            indices = _from_memmap(indices, torch.int32) \
+                if indices is not None else None
+        values = values.to(entry.device, entry.dtype)
+        if indices is None:
+            return values
+        dense = torch.zeros(entry.numel, dtype=entry.dtype,
+                            device=entry.device)
+        dense[indices.to(entry.device).long()] = values
+        return dense
+
+    def __delitem__(self, key: int):
+        entry = self._entries.pop(key)
+        if entry.on_disk:
+            for array in [entry.values, entry.indices]:
+                if array is not None:
+                    os.remove(array.filename)
+
+    def close(self):
+        """ Drop all entries, deleting the ones spilled to disk. """
+        self._entries.clear()
+        if self._spill_path is not None:
+            self._spill_path.cleanup()
+            self._spill_path = None
+
+    def __del__(self):
+        # `__init__` may have failed
+        if hasattr(self, '_entries'):
+            self.close()
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def memory_bytes(self, key: int) -> int:
+        """ Bytes retained in memory by entry `key`. """
+        entry = self._entries[key]
+        return 0 if entry.on_disk else entry.nbytes
+
+    def disk_bytes(self, key: int) -> int:
+        """ Bytes spilled to disk by entry `key`. """
+        entry = self._entries[key]
+        return entry.nbytes if entry.on_disk else 0
+
+    def _spill(self):
+        if self.max_in_memory is None:
+            return
+        in_memory = sorted(
+            k for k, e in self._entries.items() if not e.on_disk)
+        for key in in_memory[:max(len(in_memory) - self.max_in_memory, 0)]:
+            # several stores may share the same `spill_dir`
+            if self._spill_path is None:
+                self._spill_path = tempfile.TemporaryDirectory(
+                    prefix='avl_rl_store_', dir=self.spill_dir)
+            path = self._spill_path.name
+            entry = self._entries[key]
+            entry.values = _to_memmap(
+                entry.values, os.path.join(path, f'{key}.values'))
+            if entry.indices is not None:
+                entry.indices = _to_memmap(
+                    entry.indices, os.path.join(path, f'{key}.indices'))
+
+
+def _to_memmap(tensor: Tensor, filename: str) -> np.memmap:
+    tensor = tensor.cpu()
+    # numpy has no bfloat16, store raw bits
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.view(torch.int16)
+    array = np.memmap(filename, dtype=tensor.numpy().dtype, mode='w+',
+                      shape=tuple(tensor.shape))
+    array[:] = tensor.numpy()
+    array.flush()
+    return array
+
+
+def _from_memmap(array: np.memmap, dtype: torch.dtype) -> Tensor:
+    tensor = torch.from_numpy(np.array(array))
+    return tensor.view(torch.bfloat16) if dtype == torch.bfloat16 else tensor
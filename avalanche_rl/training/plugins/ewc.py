@@ -1,10 +1,16 @@
+import copy
+import time
+import torch
+import torch.nn as nn
 from avalanche.training.plugins.ewc import EWCPlugin
-from avalanche.training.utils import copy_params_dict, zerolike_params_dict
+from torch.nn.utils import parameters_to_vector
 from avalanche_rl.training.plugins.rl_plugins import RLStrategyPlugin
-from avalanche_rl.training.strategies.buffers import ReplayMemory
+from avalanche_rl.training.plugins.compact_store import CompactTensorStore
+from avalanche_rl.training.strategies.buffers import ReplayMemory, Rollout
 from avalanche_rl.training.strategies import RLBaseStrategy
 from torch import Tensor
-from typing import Dict, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Tuple, List
 
 
 class EWCRL(EWCPlugin, RLStrategyPlugin):
@@ -15,13 +21,23 @@ class EWCRL(EWCPlugin, RLStrategyPlugin):
     As opposed to the non-rl version, importances are computed by sampling from
     a  ReplayMemory a pre-defined number of times and then running those
     batches through the network. 
+    Parameter values and importances of each experience are stored as flat
+    vectors, so that the penalty is computed with a few vector ops regardless
+    of the number of parameter tensors.
     """
     def __init__(
             self, ewc_lambda, replay_memory: 'ReplayMemory',
             mode='separate', fisher_update_steps: int = 10,
             batch_size: int = 32, start_ewc_after_steps: int = 0,
             start_ewc_after_experience: int = 1,
-            decay_factor=None, keep_importance_data=False):
+            decay_factor=None, keep_importance_data=False,
+            fisher: str = 'batch', fisher_chunk_size: int = 256,
+            async_importances: bool = False,
+            importances_barrier: str = 'wait',
+            storage_dtype: torch.dtype = None,
+            importances_topk: float = None,
+            importances_threshold: float = None,
+            max_in_memory_experiences: int = None, spill_dir: str = None):
         """
             :param ewc_lambda: hyperparameter to weigh the penalty inside the
                     total loss. The larger the lambda, the larger the
@@ -45,50 +61,271 @@ class EWCRL(EWCPlugin, RLStrategyPlugin):
             :param keep_importance_data: if True, keep in memory both parameter
                     values and importances for all previous task, for all modes.
                     If False, keep only last parameter values and importances.
-                    If mode is `separate`, the value of `keep_importance_data`
-                    is set to be True.
+                    Past penalties are folded into accumulators (see
+                    `_fold_penalty`), so they're not needed in `separate`
+                    mode either.
+            :param fisher: how importances are computed. `batch` squares
+                    the gradient of the loss of each sampled batch, `per_sample`
+                    squares the gradient of the loss of each sample
+                    (empirical Fisher), computing per-sample gradients of
+                    `fisher_update_steps` * `batch_size` samples with
+                    `torch.func` in a few vectorized calls.
+                    Defaults to `batch`.
+            :param fisher_chunk_size: number of per-sample gradients computed
+                    at once with `fisher='per_sample'`, to bound memory.
+                    Defaults to 256.
+            :param async_importances: if True, importances are computed in a
+                    background thread at the end of each experience, on a
+                    snapshot of the model and of replay samples, while the
+                    next experience starts. The penalty of the experience is
+                    installed as soon as importances are ready.
+                    Defaults to False.
+            :param importances_barrier: what happens if the first update of
+                    the next experience arrives before importances are
+                    ready: `wait` blocks until they are, `skip` runs updates
+                    without the pending penalty until it's installed.
+                    Only used with `async_importances`. Defaults to `wait`.
+            :param storage_dtype: dtype of saved parameters and importances
+                    kept for each experience, e.g. `torch.float16` or
+                    `torch.bfloat16`. The penalty is always computed from
+                    full precision accumulators. Defaults to None (float32).
+            :param importances_topk: if set, only this fraction of the
+                    largest importances of each experience is kept, the
+                    others are zeroed (and don't contribute to the penalty).
+                    Sparse importances are stored as (index, value) pairs.
+                    Defaults to None.
+            :param importances_threshold: if set, importances smaller than
+                    this value are zeroed. Defaults to None.
+            :param max_in_memory_experiences: max number of experiences
+                    whose saved parameters and importances are kept in
+                    memory, older ones are spilled to memory mapped files in
+                    `spill_dir` (a temporary directory by default).
+                    Defaults to None (all kept in memory).
         """
         super().__init__(ewc_lambda, mode=mode, decay_factor=decay_factor,
                          keep_importance_data=keep_importance_data)
+        # `EWCPlugin` keeps all data in `separate` mode
+        self.keep_importance_data = keep_importance_data
         self.fisher_updates_per_step = fisher_update_steps
         self.ewc_start_timestep = start_ewc_after_steps
         self.ewc_start_exp = start_ewc_after_experience
         self.memory = replay_memory
         self.batch_size = batch_size
+        assert fisher in ['batch', 'per_sample'], \
+            f"Unknown fisher computation {fisher}"
+        self.fisher = fisher
+        self.fisher_chunk_size = fisher_chunk_size
+        assert importances_barrier in ['wait', 'skip'], \
+            f"Unknown importances barrier {importances_barrier}"
+        self.async_importances = async_importances
+        self.importances_barrier = importances_barrier
+        self._importances_executor: ThreadPoolExecutor = None
+        # (experience, parameters, importances future) being computed
+        self._pending_importances: Tuple[int, Tensor, Future] = None
+        assert importances_topk is None or 0. < importances_topk <= 1., \
+            "importances_topk must be a fraction in (0, 1]"
+        self.importances_topk = importances_topk
+        self.importances_threshold = importances_threshold
+        # flat vectors, in `model.parameters()` order
+        self.saved_params = CompactTensorStore(
+            storage_dtype, max_in_memory_experiences, spill_dir)
+        self.importances = CompactTensorStore(
+            storage_dtype, max_in_memory_experiences, spill_dir)
+        # the penalty is computed from dense accumulators only: in
+        # `separate` mode, penalties of all past experiences are folded
+        # into a single quadratic form (see `_fold_penalty`), in `online`
+        # mode they hold the last importances and parameters
+        self._fisher_sum: Tensor = None
+        self._weighted_params_sum: Tensor = None
+        self._weighted_sq_params_sum: float = 0.
+        self._fisher_mean: Tensor = None
+        self._penalty_offset: float = 0.
+        # total time spent computing penalties and number of evaluations
+        self._penalty_time: float = 0.
+        self._penalty_evals: int = 0
 
     def after_training_exp(self, strategy: 'RLBaseStrategy', **kwargs):
         """
         Compute importances of parameters after each experience.
         """
+        exp_counter = strategy.training_exp_counter
+        params = parameters_to_vector(strategy.model.parameters()).detach()
+        if self.async_importances:
+            # previous importances must be installed first
+            self._install_importances(wait=True)
+            if self._importances_executor is None:
+                self._importances_executor = ThreadPoolExecutor(1)
+            snapshot = _snapshot_strategy(strategy)
+            future = self._importances_executor.submit(
+                self._importances_from_batches, snapshot.model, snapshot,
+                self._sample_fisher_batches(strategy))
+            self._pending_importances = (exp_counter, params, future)
+            return
+
         # compute fisher information on task switch
         importances = self.compute_importances(strategy.model,
                                                strategy,
                                                strategy.optimizer,
                                                )
+        self._store_importances(exp_counter, importances, params)
 
-        self.update_importances(importances, strategy.training_exp_counter)
+    def _store_importances(self, exp_counter: int, importances: Tensor,
+                           params: Tensor):
+        importances = self.update_importances(
+            self._sparsify(importances), exp_counter)
 
-        self.saved_params[strategy.training_exp_counter] = copy_params_dict(
-            strategy.model)
+        self.saved_params[exp_counter] = params
+        if self.mode == 'separate':
+            self._fold_penalty(importances, params)
+        else:
+            self._fisher_sum, self._fisher_mean = importances, params
         # clear previuos parameter values
-        if strategy.training_exp_counter > 0 and \
-                (not self.keep_importance_data):
-            del self.saved_params[strategy.training_exp_counter - 1]
+        if not self.keep_importance_data and \
+                exp_counter - 1 in self.saved_params:
+            del self.saved_params[exp_counter - 1]
+
+    def _install_importances(self, wait: bool):
+        """ Install importances being computed asynchronously, if ready or
+        waiting for them if `wait` is set. """
+        if self._pending_importances is None:
+            return
+        exp_counter, params, future = self._pending_importances
+        if wait or future.done():
+            self._pending_importances = None
+            self._store_importances(exp_counter, future.result(), params)
+
+    def after_training(self, strategy: 'RLBaseStrategy', **kwargs):
+        """
+        Install importances of the last experience, if being computed
+        asynchronously, and stop the background thread.
+        """
+        self.join_importances()
+
+    def close(self):
+        """ Stop computing importances and delete parameters and importances
+        spilled to disk. """
+        self.join_importances()
+        self.saved_params.close()
+        self.importances.close()
+
+    def join_importances(self):
+        """ Wait for importances being computed asynchronously, installing
+        them, and stop the background thread (e.g. before forking). """
+        self._install_importances(wait=True)
+        if self._importances_executor is not None:
+            self._importances_executor.shutdown()
+            self._importances_executor = None
 
     def before_backward(self, strategy: 'RLBaseStrategy', **kwargs):
+        self._install_importances(wait=self.importances_barrier == 'wait')
         # add fisher penalty only after X steps
         if strategy.timestep >= self.ewc_start_timestep and \
                 strategy.training_exp_counter >= self.ewc_start_exp:
-            return super().before_backward(strategy, **kwargs)
+            exp_counter = strategy.training_exp_counter
+            if exp_counter == 0:
+                return
+            # penalties still being computed are skipped
+            if self._fisher_sum is None:
+                return
+            start = time.perf_counter()
+            params = parameters_to_vector(strategy.model.parameters())
+            # constant cost regardless of the number of past experiences
+            penalty = torch.dot(
+                self._fisher_sum, (params - self._fisher_mean).pow(2)) + \
+                self._penalty_offset
+            strategy.loss += self.ewc_lambda * penalty
+            self._penalty_time += time.perf_counter() - start
+            self._penalty_evals += 1
+
+    def _sparsify(self, importances: Tensor) -> Tensor:
+        if self.importances_threshold is not None:
+            importances = importances.masked_fill(
+                importances < self.importances_threshold, 0.)
+        if self.importances_topk is not None:
+            k = max(int(self.importances_topk * importances.numel()), 1)
+            values, indices = importances.topk(k)
+            importances = torch.zeros_like(importances).scatter_(
+                0, indices, values)
+        return importances
+
+    def storage_report(self) -> Dict:
+        """
+        Report memory retained by saved parameters and importances of each
+        experience, together with the cost of penalty evaluations.
+
+        Returns:
+            Dict: `experiences` maps each experience to bytes retained in
+                memory and spilled to disk, `penalty_bytes` are the bytes
+                read by each penalty evaluation and `penalty_seconds` its
+                average wall-clock time.
+        """
+        experiences = {}
+        for exp in sorted(set(self.saved_params.keys()) |
+                          set(self.importances.keys())):
+            stores = [s for s in [self.saved_params, self.importances]
+                      if exp in s]
+            experiences[exp] = {
+                'memory_bytes': sum(s.memory_bytes(exp) for s in stores),
+                'disk_bytes': sum(s.disk_bytes(exp) for s in stores)}
+        penalty_bytes = 0
+        if self._fisher_sum is not None:
+            penalty_bytes = 2 * self._fisher_sum.numel() * \
+                self._fisher_sum.element_size()
+        return {
+            'experiences': experiences,
+            'penalty_bytes': penalty_bytes,
+            'penalty_seconds': self._penalty_time / self._penalty_evals
+            if self._penalty_evals else 0.}
+
+    def _fold_penalty(self, importances: Tensor, params: Tensor):
+        """
+        Fold the penalty of a new experience into the accumulated one.
+        The sum of quadratic penalties of past experiences k is kept as
+        `sum_k F_k (theta - theta_k)^2 = F (theta - mu)^2 + c`, with
+        `F = sum_k F_k`, `mu = sum_k F_k theta_k / F` and constant `c`, so
+        that a single quadratic form is computed at each backward.
+        """
+        if self._fisher_sum is None:
+            self._fisher_sum = torch.zeros_like(importances)
+            self._weighted_params_sum = torch.zeros_like(importances)
+        self._fisher_sum += importances
+        self._weighted_params_sum += importances * params
+        # parameters with no importance don't contribute to the penalty
+        self._fisher_mean = torch.where(
+            self._fisher_sum > 0,
+            self._weighted_params_sum / self._fisher_sum,
+            torch.zeros_like(self._fisher_sum))
+        # c = sum_k F_k theta_k^2 - F mu^2, in double precision to limit
+        # cancellation errors
+        self._weighted_sq_params_sum += torch.dot(
+            importances.double(), params.double().pow(2)).item()
+        self._penalty_offset = max(
+            self._weighted_sq_params_sum - torch.dot(
+                self._fisher_sum.double(),
+                self._fisher_mean.double().pow(2)).item(), 0.)
+
+    def update_importances(self, importances: Tensor, t: int) -> Tensor:
+        """
+        Update importance for each parameter based on the currently computed
+        importances, returning the updated importances of experience `t`.
+        """
+        if self.mode == 'online' and self._fisher_sum is not None:
+            # accumulators hold the importances of the previous experience
+            importances = self.decay_factor * self._fisher_sum + importances
+        if not self.keep_importance_data and t - 1 in self.importances:
+            del self.importances[t - 1]
+        self.importances[t] = importances
+        return importances
 
     def compute_importances(self, model, strategy: 'RLBaseStrategy', optimizer):
-        
-        print("Computing Importances")
+        if self.fisher == 'per_sample':
+            return self._per_sample_importances(model, strategy)
 
         # compute importances sampling minibatches from a replay memory/buffer
         model.train()
 
-        importances = zerolike_params_dict(model)
+        importances = torch.zeros_like(
+            parameters_to_vector(model.parameters()))
         from avalanche_rl.training.strategies.dqn import DQNStrategy
         for _ in range(self.fisher_updates_per_step):
             if isinstance(strategy, DQNStrategy):
@@ -103,22 +340,107 @@ class EWCRL(EWCPlugin, RLStrategyPlugin):
             optimizer.zero_grad()
             strategy.loss.backward()
 
-            # print(model.named_parameters(), importances)
-            for (k1, p), (k2, imp) in zip(model.named_parameters(),
-                                          importances.items()):
-                assert (k1 == k2)
-                if p.grad is not None:
-                    imp.data += p.grad.data.clone().pow(2)
+            importances += parameters_to_vector(
+                p.grad if p.grad is not None else torch.zeros_like(p)
+                for p in model.parameters()).pow(2)
 
         # average over number of batches 
-        for _, imp in importances.items():
-            imp.data /= float(self.fisher_updates_per_step)
+        importances /= float(self.fisher_updates_per_step)
 
         return importances
     
+    def _sample_fisher_batches(self, strategy: 'RLBaseStrategy') \
+            -> List[Rollout]:
+        """ Replay batches used to compute importances. """
+        if self.fisher == 'per_sample':
+            return [self.memory.sample_batch(
+                self.fisher_updates_per_step * self.batch_size,
+                strategy.device)]
+        return [self.memory.sample_batch(self.batch_size, strategy.device)
+                for _ in range(self.fisher_updates_per_step)]
+
+    def _importances_from_batches(
+            self, model, strategy: 'RLBaseStrategy', batches: List[Rollout]):
+        """ Compute importances on given replay batches, through
+        `strategy.batch_loss`. """
+        if self.fisher == 'per_sample':
+            return self._per_sample_importances(model, strategy, batches[0])
+        model.train()
+        importances = torch.zeros_like(
+            parameters_to_vector(model.parameters()))
+        for batch in batches:
+            model.zero_grad()
+            strategy.batch_loss(batch).backward()
+            importances += parameters_to_vector(
+                p.grad if p.grad is not None else torch.zeros_like(p)
+                for p in model.parameters()).pow(2)
+        return importances / float(len(batches))
+
+    def _per_sample_importances(self, model, strategy: 'RLBaseStrategy',
+                                batch: Rollout = None):
+        """
+        Empirical Fisher importances, averaging squared per-sample gradients
+        of the strategy loss (`strategy.batch_loss`) over replay samples.
+        """
+        from torch.func import functional_call, grad, vmap
+        model.train()
+        if batch is None:
+            batch = self._sample_fisher_batches(strategy)[0]
+        n_samples = len(batch)
+        samples = [getattr(batch, '_'+attr) for attr in _ROLLOUT_ATTRS]
+        params = {k: p.detach() for k, p in model.named_parameters()}
+        buffers = {k: b.detach() for k, b in model.named_buffers()}
+
+        def sample_loss(params, buffers, *sample):
+            # strategy loss on a batch made of a single sample, computed
+            # with `params` in place of the model parameters
+            single = Rollout([0], n_envs=1, _unraveled=True, _shuffle=False)
+            for attr, value in zip(_ROLLOUT_ATTRS, sample):
+                setattr(single, '_'+attr, value.unsqueeze(0))
+            return functional_call(
+                _StrategyLoss(strategy), {'model.'+k: v for k, v in {
+                    **params, **buffers}.items()}, (single,))
+
+        per_sample_grads = vmap(grad(sample_loss), in_dims=(
+            None, None, *[0]*len(samples)), randomness='different')
+        importances = torch.zeros_like(parameters_to_vector(params.values()))
+        # bound memory to `fisher_chunk_size` per-sample gradients
+        for i in range(0, n_samples, self.fisher_chunk_size):
+            grads = per_sample_grads(params, buffers, *[
+                s[i:i+self.fisher_chunk_size] for s in samples])
+            importances += torch.cat([
+                grads[k].pow(2).sum(0).view(-1) for k in params])
+
+        return importances / n_samples
+
     def before_rollout(self, *args):
         pass
 
 
+def _snapshot_strategy(strategy: 'RLBaseStrategy') -> 'RLBaseStrategy':
+    """ Shallow copy of a strategy with copies of its modules (e.g. model
+    and target network) and no plugins, so that its loss can be computed
+    while the original strategy keeps training. """
+    snapshot = copy.copy(strategy)
+    for k, v in vars(strategy).items():
+        if isinstance(v, nn.Module):
+            setattr(snapshot, k, copy.deepcopy(v))
+    snapshot.plugins = []
+    return snapshot
+
+
+class _StrategyLoss(nn.Module):
+    """ Loss of a strategy on a batch, as the forward of a module owning the
+    strategy model, so that it can be called with `functional_call`. """
+    def __init__(self, strategy: 'RLBaseStrategy'):
+        super().__init__()
+        self.model = strategy.model
+        self.strategy = strategy
+
+    def forward(self, batch: Rollout):
+        return self.strategy.batch_loss(batch)
+
+
+_ROLLOUT_ATTRS = ['states', 'actions', 'rewards', 'dones', 'next_states']
 ParamDict = Dict[str, Tensor]
 EwcDataType = Tuple[ParamDict, ParamDict]
@@ -0,0 +1,150 @@
+import time
+import torch
+from avalanche_rl.training.plugins.rl_plugins import RLStrategyPlugin
+from typing import Dict, List, Optional
+
+
+class ReplayRatioScheduler(RLStrategyPlugin):
+    """
+    Adjusts `strategy.updates_per_step` at runtime, before the update steps
+    of each training iteration, to target either:
+        - a replay ratio, i.e. a number of gradient updates per env
+          transition (`replay_ratio`). Fractional updates are carried over
+          to the next iterations, so that the ratio is matched on average
+          even when it's below one update per rollout;
+        - a wall-clock split between data collection and learning
+          (`learning_fraction`, share of training time spent updating).
+          Rollout and update durations are measured on every iteration and
+          smoothed with an exponential moving average, the number of updates
+          is the one whose expected duration matches the target share.
+    The chosen number of updates is clipped to [`min_updates`,
+    `max_updates`] and stored in `strategy.updates_per_step`, so that it can
+    be logged with
+    `GenericFloatMetric('updates_per_step', 'Updates Per Step')`; a record
+    of each choice is also kept in `history`.
+    Only meant for strategies in which `updates_per_step` is the number of
+    gradient steps on a single rollout (e.g. `DQNStrategy`). The configured
+    `updates_per_step` is restored at the end of each experience.
+    With a `distributed` strategy, the number of updates chosen by rank 0 is
+    broadcast to all replicas, which must run the same number of gradient
+    all-reduces.
+    """
+    def __init__(self, replay_ratio: Optional[float] = None,
+                 learning_fraction: Optional[float] = None,
+                 min_updates: int = 0, max_updates: Optional[int] = None,
+                 smoothing: float = 0.9):
+        """
+        Args:
+            replay_ratio (Optional[float], optional): Target number of
+                    gradient updates per env transition. Defaults to None.
+            learning_fraction (Optional[float], optional): Target fraction
+                    of wall-clock time spent in update steps, in (0, 1).
+                    Defaults to None.
+            min_updates (int, optional): Min number of updates per
+                    iteration. Defaults to 0.
+            max_updates (Optional[int], optional): Max number of updates per
+                    iteration, unbounded if None. Defaults to None.
+            smoothing (float, optional): Smoothing factor of the moving
+                    average of measured timings. Defaults to 0.9.
+        """
+        super().__init__()
+        assert (replay_ratio is None) != (learning_fraction is None), \
+            "Exactly one of `replay_ratio` and `learning_fraction` " \
+            "must be specified"
+        assert replay_ratio is None or replay_ratio > 0, \
+            "Replay ratio must be positive"
+        assert learning_fraction is None or 0 < learning_fraction < 1, \
+            "Learning fraction must be in (0, 1)"
+        assert min_updates >= 0, "Min number of updates can't be negative"
+        assert max_updates is None or max_updates >= max(min_updates, 1), \
+            "Max number of updates must be positive and >= `min_updates`"
+        assert 0 <= smoothing < 1, "Smoothing factor must be in [0, 1)"
+        self.replay_ratio = replay_ratio
+        self.learning_fraction = learning_fraction
+        self.min_updates = min_updates
+        self.max_updates = max_updates
+        self.smoothing = smoothing
+        # updates owed by the replay ratio and not performed yet
+        self._credit = 0.
+        # `updates_per_step` of the strategy, restored after each experience
+        self._configured_updates: int = None
+        self.rollout_time: float = None
+        self.update_time: float = None
+        self._rollout_start: float = None
+        self._rollout_steps: int = 0
+        self._learning_start: float = None
+        self._n_updates: int = 0
+        self.transitions = 0
+        self.updates = 0
+        # one record per training iteration
+        self.history: List[Dict[str, float]] = []
+
+    def _smooth(self, average: Optional[float], value: float) -> float:
+        if average is None:
+            return value
+        return self.smoothing * average + (1. - self.smoothing) * value
+
+    def before_training_exp(self, strategy, **kwargs):
+        self._credit = 0.
+        self._configured_updates = strategy.updates_per_step
+
+    def after_training_exp(self, strategy, **kwargs):
+        strategy.updates_per_step = self._configured_updates
+
+    def before_rollout(self, strategy, **kwargs):
+        self._rollout_steps = strategy.rollout_steps
+        self._rollout_start = time.perf_counter()
+
+    def after_rollout(self, strategy, **kwargs):
+        self.rollout_time = self._smooth(
+            self.rollout_time, time.perf_counter() - self._rollout_start)
+        # `rollout_steps` counts steps of the vectorized env
+        transitions = (strategy.rollout_steps - self._rollout_steps) * \
+            strategy.n_envs
+        self.transitions += transitions
+
+        if self.replay_ratio is not None:
+            self._credit += self.replay_ratio * transitions
+            n_updates = int(self._credit)
+        elif self.update_time is None:
+            # no timings yet, keep the configured number of updates
+            n_updates = strategy.updates_per_step
+        else:
+            f = self.learning_fraction
+            n_updates = round(
+                self.rollout_time * f / (1. - f) / self.update_time)
+
+        n_updates = max(n_updates, self.min_updates)
+        if self.max_updates is not None:
+            n_updates = min(n_updates, self.max_updates)
+        if strategy.distributed:
+            # timings (and thus choices) differ across processes
+            n_updates_t = torch.tensor([n_updates], device=strategy.device)
+            torch.distributed.broadcast(n_updates_t, 0)
+            n_updates = int(n_updates_t.item())
+        if self.replay_ratio is not None:
+            self._credit -= n_updates
+        strategy.updates_per_step = n_updates
+        self.history.append({
+            'timestep': strategy.timestep, 'updates': n_updates,
+            'transitions': transitions, 'rollout_time': self.rollout_time,
+            'update_time': self.update_time})
+
+        self._n_updates = n_updates
+        self._learning_start = time.perf_counter()
+
+    def after_training_iteration(self, strategy, **kwargs):
+        if self._learning_start is None:
+            return
+        self.updates += self._n_updates
+        if self._n_updates > 0:
+            self.update_time = self._smooth(
+                self.update_time,
+                (time.perf_counter() - self._learning_start) /
+                self._n_updates)
+        self._learning_start = None
+
+    @property
+    def achieved_replay_ratio(self) -> float:
+        """ Updates performed per env transition collected so far. """
+        return self.updates / max(self.transitions, 1)
@@ -1,5 +1,8 @@
 from .rl_base_strategy import RLBaseStrategy
 from .dqn import DQNStrategy
 from .actor_critic import A2CStrategy
+from .ppo import PPOStrategy
+from .a3c import A3CStrategy
 
-__all__ = ['RLBaseStrategy', 'A2CStrategy', 'DQNStrategy']
+__all__ = ['RLBaseStrategy', 'A2CStrategy', 'DQNStrategy', 'PPOStrategy',
+           'A3CStrategy']
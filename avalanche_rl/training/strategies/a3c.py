@@ -0,0 +1,246 @@
+import copy
+import queue
+import threading
+import numpy as np
+import ray
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from .rl_base_strategy import Timestep
+from .actor_critic import A2CStrategy
+from .buffers import EpisodeRecords
+from avalanche.core import BasePlugin
+from avalanche.benchmarks.scenarios.rl_scenario import RLExperience
+from avalanche_rl.training import default_rl_logger
+from avalanche_rl.models.actor_critic import A2CModel
+from torch.optim import Optimizer
+from tqdm import tqdm
+from typing import Union, Optional, Sequence, List
+
+
+class A3CStrategy(A2CStrategy):
+    def __init__(
+            self, model: A2CModel, optimizer: Optimizer,
+            per_experience_steps: Union[int, Timestep, List[Timestep]],
+            n_workers: int = 4,
+            max_steps_per_rollout: int = 5,
+            value_criterion=nn.MSELoss(),
+            plugins: Optional[Sequence[BasePlugin]] = [],
+            eval_every: int = -1, eval_episodes: int = 1,
+            policy_loss_weight: float = 0.5,
+            value_loss_weight: float = 0.5,
+            evaluator=default_rl_logger, **kwargs):
+        """
+            Asynchronous Advantage Actor-Critic (A3C), as presented in
+            "Asynchronous Methods for Deep Reinforcement Learning".
+            The model and optimizer state are moved to shared memory and
+            `n_workers` worker processes, each owning a copy of the
+            experience env, repeatedly sync a local copy of the model,
+            gather a rollout, compute gradients of the A2C loss on it and
+            apply them to the shared model with the shared optimizer,
+            without any locking (Hogwild!).
+            `per_experience_steps` counts updates across all workers. The
+            main process only does bookkeeping: training iteration and
+            rollout callbacks, episode records and periodic evaluation run
+            once for every update completed by a worker, while forward and
+            backward callbacks aren't triggered since they happen inside
+            workers. Only supported on cpu. Workers are forked from the
+            learner process, which must not be running other threads:
+            concurrent or async evaluation, actor inference and inference
+            server aren't supported, the tqdm monitor thread and
+            asynchronous EWC importances are stopped before forking.
+
+        Args:
+            :param n_workers (int, optional): Number of worker processes.
+                    Defaults to 4.
+        Other arguments are the same as `A2CStrategy`.
+        """
+        assert n_workers > 0, "Number of workers must be positive"
+        super().__init__(
+            model, optimizer, per_experience_steps=per_experience_steps,
+            max_steps_per_rollout=max_steps_per_rollout,
+            value_criterion=value_criterion, device='cpu', plugins=plugins,
+            eval_every=eval_every, eval_episodes=eval_episodes,
+            policy_loss_weight=policy_loss_weight,
+            value_loss_weight=value_loss_weight, evaluator=evaluator,
+            **kwargs)
+        # workers are forked from the learner, which must not run other
+        # threads or hold Ray actors
+        assert self.eval_executor is None and not self.actor_inference \
+            and not self.use_inference_server, \
+            "A3C doesn't support concurrent or async evaluation, actor " \
+            "inference or inference server"
+        self.n_workers = n_workers
+
+    def _share_memory(self):
+        """ Move model parameters and optimizer state to shared memory,
+        initializing the optimizer state first so that it's shared too. """
+        self.model.share_memory()
+        # a step with zero learning rate and gradients creates the state
+        # without changing parameters
+        lrs = [group['lr'] for group in self.optimizer.param_groups]
+        for group in self.optimizer.param_groups:
+            group['lr'] = 0.
+        for p in self.model.parameters():
+            p.grad = torch.zeros_like(p)
+        self.optimizer.step()
+        self.optimizer.zero_grad(set_to_none=True)
+        for group, lr in zip(self.optimizer.param_groups, lrs):
+            group['lr'] = lr
+        for state in self.optimizer.state.values():
+            # the warm-up step doesn't count, e.g. for Adam bias correction
+            if 'step' in state:
+                if isinstance(state['step'], torch.Tensor):
+                    state['step'].zero_()
+                else:
+                    state['step'] = 0
+            for v in state.values():
+                if isinstance(v, torch.Tensor):
+                    v.share_memory_()
+
+    def _stop_threads(self):
+        """ Stop threads known to run in the learner process before forking
+        workers, failing if others are running. """
+        # no tqdm monitor is started until `monitor_interval` is restored
+        tqdm.monitor_interval = 0
+        if tqdm.monitor is not None:
+            tqdm.monitor.exit()
+        for plugin in self.plugins:
+            if hasattr(plugin, 'join_importances'):
+                plugin.join_importances()
+        assert not ray.is_initialized(), \
+            "A3C workers are forked, Ray can't be running in the learner " \
+            "process"
+        threads = [t for t in threading.enumerate()
+                   if t is not threading.main_thread() and not t.daemon]
+        assert not threads, \
+            "A3C workers are forked, no other thread can be running in " \
+            f"the learner process, found {threads}"
+
+    def train_exp(self, experience: RLExperience, eval_streams, **kwargs):
+        self.environment = experience.environment
+        self.n_envs = experience.n_envs
+        self.rollout_steps = 0
+        self.episodes = EpisodeRecords(self.episode_records_size)
+        self.make_optimizer()
+        self._share_memory()
+
+        self._before_training_exp(**kwargs)
+
+        # workers are forked so that they inherit the strategy, shared
+        # tensors included, without pickling it. Forking a process running
+        # other threads (e.g. executors of plugins or Ray) can deadlock
+        # workers on locks held by those threads
+        ctx = mp.get_context('fork')
+        n_updates = self.current_experience_steps.value
+        counter = ctx.Value('l', 0)
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=_a3c_worker,
+                        args=(self, rank, counter, n_updates, results))
+            for rank in range(self.n_workers)]
+        monitor_interval = tqdm.monitor_interval
+        try:
+            self._stop_threads()
+            for worker in workers:
+                worker.start()
+        finally:
+            tqdm.monitor_interval = monitor_interval
+
+        try:
+            # one result is sent by workers for each update
+            for self.timestep in range(n_updates):
+                rank, env_steps, returns, lengths = \
+                    _next_result(results, workers)
+                self._before_training_iteration(**kwargs)
+                # worker rollout is replayed here, so that train metrics
+                # read its episodes on `after_rollout`
+                self.before_rollout(**kwargs)
+                self.rollout_steps += env_steps
+                self.episodes.add(
+                    returns, lengths, np.full((len(returns),), rank),
+                    self.rollout_steps)
+                self.after_rollout(**kwargs)
+                self.total_updates += 1
+                self._after_training_iteration(**kwargs)
+                # periodic evaluation, on the weights being trained
+                self._periodic_eval(eval_streams, do_final=False)
+        finally:
+            for worker in workers:
+                worker.join()
+
+        self.total_steps += self.rollout_steps
+        # Final evaluation
+        self._periodic_eval(eval_streams, do_final=(
+            self.timestep % self.eval_every != 0))
+        self._after_training_exp(**kwargs)
+
+
+def _next_result(results, workers: List[mp.Process]):
+    """ Wait for the next worker result, failing if a worker died. """
+    while True:
+        try:
+            return results.get(timeout=1.)
+        except queue.Empty:
+            if any(w.exitcode not in (None, 0) for w in workers):
+                raise RuntimeError("A3C worker process failed")
+
+
+def _a3c_worker(strategy: A3CStrategy, rank: int, counter, n_updates: int,
+                results):
+    """
+    A3C worker loop: until `n_updates` updates are claimed from `counter`,
+    sync the local model with the shared one, gather a rollout on the
+    worker env, backpropagate the A2C loss and apply the gradients to the
+    shared model with the shared optimizer.
+    """
+    # workers share the node cpus, don't oversubscribe them
+    torch.set_num_threads(1)
+    seed = (torch.initial_seed() + 1000 * strategy.training_exp_counter +
+            rank) % 2**32
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    # worker view of the strategy, with a local model and a single env
+    worker = copy.copy(strategy)
+    worker.plugins = []
+    worker.model = copy.deepcopy(strategy.model)
+    worker.n_envs = 1
+    worker.rollout_steps = 0
+    worker._obs = None
+    worker._curr_returns = np.zeros((1,), dtype=np.float32)
+    worker._curr_lengths = np.zeros((1,), dtype=np.int64)
+    worker.episodes = EpisodeRecords(strategy.episode_records_size)
+    env = worker.make_train_env()
+    env.seed(seed)
+
+    shared_params = list(strategy.model.parameters())
+    local_params = list(worker.model.parameters())
+    while True:
+        with counter.get_lock():
+            if counter.value >= n_updates:
+                break
+            counter.value += 1
+
+        worker.model.load_state_dict(strategy.model.state_dict())
+        n_records, n_steps = worker.episodes.n_records, worker.rollout_steps
+        rollouts = worker.rollout(
+            env=env, n_rollouts=worker.rollouts_per_step,
+            max_steps=worker.max_steps_per_rollout)
+        worker.update(rollouts)
+
+        worker.model.zero_grad()
+        worker.loss.backward()
+        if worker.max_grad_norm is not None:
+            torch.nn.utils.clip_grad_norm_(
+                local_params, worker.max_grad_norm)
+        # gradients are only set on this process view of shared parameters
+        for shared_p, local_p in zip(shared_params, local_params):
+            shared_p.grad = local_p.grad
+        strategy.optimizer.step()
+
+        n_episodes = worker.episodes.n_records - n_records
+        results.put((rank, worker.rollout_steps - n_steps,
+                     worker.episodes.last(n_episodes),
+                     worker.episodes.last(n_episodes, 'lengths')))
+    env.close()
@@ -1,7 +1,10 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from .rl_base_strategy import RLBaseStrategy, Timestep, TimestepUnit
 from .buffers import Rollout
+from .advantages import generalized_advantages
+from .policy_export import CategoricalPolicy
 from avalanche.core import BasePlugin
 from avalanche_rl.training import default_rl_logger
 from avalanche_rl.models.actor_critic import A2CModel
@@ -22,6 +25,7 @@ class A2CStrategy(RLBaseStrategy):
             eval_every: int = -1, eval_episodes: int = 1, 
             policy_loss_weight: float = 0.5,
             value_loss_weight: float = 0.5,
+            gae_lambda: float = 0.,
             evaluator=default_rl_logger, **kwargs):
         # multiple steps per rollout are supported through time dimension
         # flattening e.g. working with tensors of shape
@@ -43,8 +47,15 @@ class A2CStrategy(RLBaseStrategy):
         self.value_criterion = value_criterion
         self.ac_w = policy_loss_weight
         self.cr_w = value_loss_weight
+        # GAE(lambda) advantages over time-ordered rollout steps:
+        # 0 gives 1-step TD advantages, 1 gives n-step returns with
+        # n = `max_steps_per_rollout`
+        assert 0. <= gae_lambda <= 1., "gae_lambda must be in [0, 1]"
+        self.gae_lambda = gae_lambda
+        self.shuffle_rollouts = False
 
-    def sample_rollout_action(self, observations: torch.Tensor):
+    def sample_rollout_action(self, observations: torch.Tensor,
+                              env_ids=None):
         """
             This will process a batch of observations and produce a batch
             of actions to better leverage GPU as in 'batched' A2C, as in
@@ -56,48 +67,107 @@ class A2CStrategy(RLBaseStrategy):
             [type]: [description]
         """
         # sample action from policy network
+        if self.traced_policy:
+            self._before_forward()
+            actions = self._policy_actions(observations, self.rollout_model)
+            self._after_forward()
+            return actions.cpu().numpy()
         with torch.no_grad():
             _, policy_logits = self._model_forward(
-                self.model, observations, compute_value=False)
+                self.rollout_model, observations, compute_value=False)
         # (alternative np.random.choice(num_outputs, p=np.squeeze(dist)))
         return Categorical(logits=policy_logits).sample().cpu().numpy()
 
+    def make_policy(self, task_label: Optional[int] = None,
+                    model: nn.Module = None) -> nn.Module:
+        return CategoricalPolicy(
+            self.model if model is None else model, task_label)
+
     def update(self, rollouts: List[Rollout]):
-        # perform gradient step(s) over gathered rollouts
-        self.loss = 0.
+        # all rollouts are processed in a single forward/backward; rollout
+        # tensors are time-major, of shape `timesteps`*`n_envs`xD
+        rollouts = [rollout.to(self.device) for rollout in rollouts]
+        observations = torch.cat([r.observations for r in rollouts])
+        actions = torch.cat([r.actions for r in rollouts])
+        rewards = torch.cat([r.rewards for r in rollouts])
+        dones = torch.cat([r.dones for r in rollouts])
+
+        # single forward over current and next observations
+        n_obs = observations.shape[0]
+        values, policy_logits = self._model_forward(
+            self.model, torch.cat(
+                [observations] + [r.next_observations for r in rollouts]))
+        # next states values are only used as (bootstrapped) targets
+        values, next_values = values[:n_obs], values[n_obs:].detach()
+        policy_logits, next_policy_logits = \
+            policy_logits[:n_obs], policy_logits[n_obs:].detach()
+        # ~log(softmax(taken_action_logits)), without data-dependent
+        # argument checks which can't be vmapped (see `EWCRL`)
+        log_prob = Categorical(
+            logits=policy_logits, validate_args=False).log_prob(
+            actions.view(-1,))
+        # mask terminal states values (not in-place, `next_values`
+        # shares its version counter with `values`)
+        next_values = next_values.masked_fill(dones.view(-1, 1), 0.)
+
+        advantages, value_targets = self._rollout_advantages(
+            rollouts, actions, rewards, dones, values.detach(), next_values,
+            next_policy_logits)
+
+        # Actor/Policy Loss Term in A2C:
+        # A(s_t, a_t) * grad log (pi(a_t|s_t))
+        policy_loss = -(advantages.view(-1) * log_prob).mean()
+
+        # Value Loss Term: (G_t - V(S_t))^2
+        value_loss = self.value_criterion(value_targets, values)
+
+        self.loss = self.ac_w * policy_loss + self.cr_w * value_loss
+
+    @torch.no_grad()
+    def _rollout_advantages(
+            self, rollouts: List[Rollout], actions: torch.Tensor,
+            rewards: torch.Tensor, dones: torch.Tensor, values: torch.Tensor,
+            next_values: torch.Tensor, next_policy_logits: torch.Tensor):
+        """
+        Compute advantages of taken actions and value targets from the
+        time-major tensors of `rollouts`, concatenated in order.
+        Temporal differences are chained through the values of the actions
+        taken at the next step, Q(s_{t+1}, a_{t+1}), while the last step of
+        each rollout, whose next action isn't known, is bootstrapped from
+        the expected value of its next state under the policy.
+        `next_values` must already be masked on terminal states.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: GAE(lambda) advantages of
+                taken actions and value targets of all actions, which are
+                lambda-returns for taken actions and 1-step bootstrapped
+                returns R_t + gamma * V(S_{t+1}) for the others.
+        """
+        taken_values = values.gather(dim=1, index=actions)
+        expected_next_values = (F.softmax(next_policy_logits, dim=-1) *
+                                next_values).sum(dim=-1, keepdim=True)
+        # advantages and returns of taken actions a_t, computed backwards
+        # over time for all envs at once within each rollout
+        advantages, returns = [], []
+        offset = 0
         for rollout in rollouts:
-            # move samples to device for processing and expect tensor of shape
-            # `timesteps`x`n_envs`xD`
-            rollout = rollout.to(self.device)
-            # print("Rollout Observation shape", rollout.observations.shape)
-            values, policy_logits = self._model_forward(
-                self.model, rollout.observations)
-            # ~log(softmax(taken_action_logits))
-            # print("Rollout Actions shape", rollout.actions.shape)
-            # FIXME: remove view
-            log_prob = Categorical(
-                logits=policy_logits).log_prob(
-                rollout.actions.view(-1,))
-            # compute next states values
-            next_values, _ = self._model_forward(
-                self.model, rollout.next_observations, compute_policy=False)
-            # mask terminal states values
-            next_values[rollout.dones.view(-1,)] = 0.
-
-            # Actor/Policy Loss Term in A2C:
-            # A(s_t, a_t) * grad log (pi(a_t|s_t))
-            boostrapped_returns = rollout.rewards + self.gamma * next_values
-            advantages = boostrapped_returns - values 
-            # get advantages of taken actions a_t
-            # FIXME: this whill need view(-1,1)
-            advantages = advantages.gather(dim=1, index=rollout.actions)
-            # print("Rollout adv shape", advantages.shape, log_prob.shape, 
-            #      policy_logits.shape)
-            policy_loss = -(advantages * log_prob).mean()
-
-            # Value Loss Term: (R_t + gamma * V(S_{t+1}) - V(S_t))^2
-            # value_loss = advantages.pow(2)
-            value_loss = self.value_criterion(boostrapped_returns, values)
-
-            # accumulate gradients for multi-rollout case
-            self.loss += self.ac_w * policy_loss + self.cr_w * value_loss
+            n = len(rollout) * rollout.n_envs
+            step_rewards, step_values, step_expected_next_values, \
+                step_dones = (
+                    x[offset:offset+n].view(len(rollout), rollout.n_envs, -1)
+                    for x in [rewards, taken_values, expected_next_values,
+                              dones])
+            taken_next_values = torch.cat(
+                [step_values[1:], step_expected_next_values[-1:]]
+            ).masked_fill(step_dones, 0.)
+            adv, ret = generalized_advantages(
+                step_rewards, step_values, taken_next_values, step_dones,
+                gamma=self.gamma, gae_lambda=self.gae_lambda)
+            advantages.append(adv.view(n, -1))
+            returns.append(ret.view(n, -1))
+            offset += n
+        advantages, returns = torch.cat(advantages), torch.cat(returns)
+
+        boostrapped_returns = rewards + self.gamma * next_values
+        value_targets = boostrapped_returns.scatter(1, actions, returns)
+        return advantages, value_targets
@@ -0,0 +1,57 @@
+import torch
+from typing import Tuple
+
+
+def discounted_cumsum(values: torch.Tensor, dones: torch.Tensor,
+                      discount: float) -> torch.Tensor:
+    """
+    Discounted sum of `values` backwards over time, `x_t + discount * x_{t+1}
+    + ...`, restarting at every terminal step. Time-major tensors of shape
+    `timesteps` x `n_envs` x D are expected, all envs being processed at once
+    at each timestep.
+
+    Args:
+        values (torch.Tensor): values to be summed.
+        dones (torch.Tensor): terminal flag of each step, broadcastable to
+            `values`.
+        discount (float): discount factor applied at each step back in time.
+
+    Returns:
+        torch.Tensor: discounted sums, same shape as `values`.
+    """
+    not_dones = (~dones).to(values.dtype)
+    sums = torch.empty_like(values)
+    running = torch.zeros_like(values[0])
+    for t in reversed(range(values.shape[0])):
+        running = values[t] + discount * not_dones[t] * running
+        sums[t] = running
+    return sums
+
+
+@torch.no_grad()
+def generalized_advantages(
+        rewards: torch.Tensor, values: torch.Tensor,
+        next_values: torch.Tensor, dones: torch.Tensor, gamma: float,
+        gae_lambda: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Compute Generalized Advantage Estimates (GAE) and lambda-returns of a
+    rollout as in "High-Dimensional Continuous Control Using Generalized
+    Advantage Estimation", in a single backward pass over time.
+    Tensors are time-major, of shape `timesteps` x `n_envs` x D.
+    `next_values` are the values of next observations, which must already be
+    masked on terminal steps; the last step of the rollout is bootstrapped
+    from them.
+    `gae_lambda`=0 gives 1-step TD advantages, while `gae_lambda`=1 gives
+    n-step returns bootstrapped at the end of the rollout (n being the number
+    of remaining steps in the rollout).
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: advantages and returns (targets of
+            the value function).
+    """
+    td_errors = rewards + gamma * next_values - values
+    if gae_lambda == 0.:
+        advantages = td_errors
+    else:
+        advantages = discounted_cumsum(td_errors, dones, gamma * gae_lambda)
+    return advantages, advantages + values
@@ -357,3 +357,66 @@ class ReplayMemory:
     @property
     def next_states(self):
         return self.next_observations
+
+
+class EpisodeRecords:
+    """
+        Fixed-size ring of finished episodes records, each one made of
+        (return, length, env id, step at which the episode ended).
+        Records are written in batch with vectorized operations so that
+        bookkeeping during rollouts doesn't require looping over parallel
+        environments; metrics read the most recent records directly from
+        the ring.
+    """
+    _fields = ['returns', 'lengths', 'env_ids', 'steps']
+
+    def __init__(self, capacity: int = 1000):
+        assert capacity > 0, "Capacity of episode records must be positive"
+        self.capacity = capacity
+        self.returns = np.zeros((capacity,), dtype=np.float32)
+        self.lengths = np.zeros((capacity,), dtype=np.int64)
+        self.env_ids = np.zeros((capacity,), dtype=np.int64)
+        self.steps = np.zeros((capacity,), dtype=np.int64)
+        # total number of records ever written, used by readers to tell
+        # which records they haven't seen yet
+        self.n_records = 0
+
+    def add(self, returns: np.ndarray, lengths: np.ndarray,
+            env_ids: np.ndarray, step: int):
+        """
+            Record a batch of finished episodes, overwriting the oldest
+            records once capacity is reached.
+
+        Args:
+            returns (np.ndarray): returns of finished episodes.
+            lengths (np.ndarray): lengths of finished episodes.
+            env_ids (np.ndarray): ids of the envs which finished an episode.
+            step (int): step at which episodes ended.
+        """
+        n = len(returns)
+        if not n:
+            return
+        # only the last `capacity` records would survive anyway
+        skip = max(n - self.capacity, 0)
+        idxs = (self.n_records + np.arange(skip, n)) % self.capacity
+        self.returns[idxs] = returns[skip:]
+        self.lengths[idxs] = lengths[skip:]
+        self.env_ids[idxs] = env_ids[skip:]
+        self.steps[idxs] = step
+        self.n_records += n
+
+    def last(self, n: int, field: str = 'returns') -> np.ndarray:
+        """
+            Returns the `n` most recent values of `field`, from the oldest to
+            the newest one.
+        """
+        assert field in self._fields, f"Unknown episode record field {field}"
+        n = min(n, len(self))
+        idxs = (self.n_records - n + np.arange(n)) % self.capacity
+        return getattr(self, field)[idxs]
+
+    def reset(self):
+        self.n_records = 0
+
+    def __len__(self):
+        return min(self.n_records, self.capacity)
@@ -2,17 +2,19 @@ import torch
 import torch.nn as nn
 import numpy as np
 import copy
-import random
 from .rl_base_strategy import RLBaseStrategy, Timestep
 from .buffers import Rollout, ReplayMemory
+from .policy_export import GreedyPolicy, EpsilonGreedyPolicy
+from .exploration import EpsilonGreedyExploration, apex_epsilons
 from avalanche.core import BasePlugin
 from avalanche_rl.training import default_rl_logger
 from avalanche_rl.evaluation.metrics.reward import GenericFloatMetric
 from avalanche_rl.training.plugins.rl_plugins import RLEvaluationPlugin
 from avalanche_rl.models.dqn import DQNModel
+from avalanche_rl.training.utils import flatten_parameters, flat_parameters
 from torch.optim.optimizer import Optimizer
 from torch.optim import Optimizer
-from typing import Union, Optional, Sequence, List
+from typing import Union, Optional, Sequence, List, Tuple
 
 default_dqn_logger = RLEvaluationPlugin(
     *default_rl_logger.metrics,
@@ -49,6 +51,10 @@ class DQNStrategy(RLBaseStrategy):
             eval_every = -1,
             eval_episodes = 1,
             max_grad_norm = None,
+            # (base epsilon, alpha) of Ape-X per-env exploration rates,
+            # replacing the linear decay of `initial_epsilon`
+            epsilon_ladder: Optional[Tuple[float, float]] = None,
+            exploration_seed: int = None,
             **kwargs):
         super().__init__(
             model, optimizer, per_experience_steps, criterion=criterion,
@@ -84,11 +90,22 @@ class DQNStrategy(RLBaseStrategy):
         self.eps = initial_epsilon
         self.final_eps = final_epsilon
         self.expl_fr = exploration_fraction
+        assert epsilon_ladder is None or not self.actor_inference, \
+            "Per-env exploration rates aren't supported by actor policies"
+        self.epsilon_ladder = epsilon_ladder
+        # per-env exploration rates, defined by the experience if
+        # `epsilon_ladder` is set
+        self.env_epsilons: np.ndarray = None
+        self.exploration = EpsilonGreedyExploration(exploration_seed)
 
         # initialize target network
         self.target_net = copy.deepcopy(self.model)
         self.target_net = self.target_net.to(self.device)
 
+    def replicated_modules(self) -> List[nn.Module]:
+        # replicas must also bootstrap from the same target net
+        return [self.model, self.target_net]
+
     def _update_epsilon(self, experience_timestep: int):
         """
             Linearly decrease exploration rate `self.eps` up to `self.final_eps`
@@ -97,21 +114,29 @@ class DQNStrategy(RLBaseStrategy):
         """
         new_value = self._init_eps - experience_timestep * self.eps_decay
         self.eps = new_value if new_value > self.final_eps else self.final_eps
+        # actors get the new value with the next weights broadcast
+        if self._actor_policy is not None:
+            self._actor_policy.eps.fill_(self.eps)
 
     def _update_target_network(self, timestep: int):
         # copy over network parameter to fixed target net
         if timestep > 0 and timestep % self.target_net_update_interval.value:
             # from stable baseline 3 enhancement
             # https://github.com/DLR-RM/stable-baselines3/issues/93
+            tau = self.polyak_update_tau
             with torch.no_grad():
-                # all done in-place for efficiency
-                for param, target_param in zip(
-                        self.model.parameters(),
-                        self.target_net.parameters()):
-                    target_param.data.mul_(1-self.polyak_update_tau)
-                    torch.add(target_param.data, param.data,
-                              alpha=self.polyak_update_tau,
-                              out=target_param.data)
+                # all done in-place for efficiency, as a single vector op
+                # if both networks are flattened
+                params = flat_parameters(self.model)
+                target_params = flat_parameters(self.target_net)
+                if params is not None and target_params is not None:
+                    target_params.mul_(1-tau).add_(params, alpha=tau)
+                else:
+                    params = [p.data for p in self.model.parameters()]
+                    target_params = [p.data
+                                     for p in self.target_net.parameters()]
+                    torch._foreach_mul_(target_params, 1-tau)
+                    torch._foreach_add_(target_params, params, alpha=tau)
 
     def _before_training_exp(self, **kwargs):
         # compute linear decay rate from specified fraction and specified
@@ -120,6 +145,10 @@ class DQNStrategy(RLBaseStrategy):
         self.eps_decay = (self._init_eps - self.final_eps) / (
             self.expl_fr * self.current_experience_steps.value)
 
+        if self.epsilon_ladder is not None:
+            self.env_epsilons = apex_epsilons(
+                self.n_envs, *self.epsilon_ladder)
+
         # initialize replay memory with collected data before first experience,
         # taking into account multiple workers
         rollouts = self.rollout(
@@ -136,6 +165,8 @@ class DQNStrategy(RLBaseStrategy):
         # adjust number of rollouts per step in order to assign equal load to
         # each parallel actor
         self.rollouts_per_step = self.rollouts_per_step // self.n_envs
+        if self.flat_params and flat_parameters(self.target_net) is None:
+            flatten_parameters(self.target_net)
         return super()._before_training_exp(**kwargs)
 
     def before_rollout(self, **kwargs):
@@ -151,35 +182,61 @@ class DQNStrategy(RLBaseStrategy):
         self.replay_memory.add_rollouts(self.rollouts)
         return super().after_rollout(**kwargs)
 
-    def sample_rollout_action(self, observations: torch.Tensor):
+    def sample_rollout_action(self, observations: torch.Tensor,
+                              env_ids: Union[slice, np.ndarray] = None):
         """
-            Generate action following epsilon-greedy strategy in which we
-            either sample a random action with probability epsilon or
-            we exploit current Q-value derived policy by taking the action
-            with greatest Q-value.
+            Generate action following epsilon-greedy strategy in which each
+            env either samples a random action with probability epsilon or
+            exploits current Q-value derived policy by taking the action
+            with greatest Q-value. Only observations of exploiting envs are
+            fed to the model.
 
         Args:
             observations (torch.Tensor): Observation coming from Env on
                 previous step, of shape `self.n_envs` x obs_shape.
-        """ 
-        # all actors interacting with environment either exploit or explore
-        if random.random() > self.eps:
-            # exploitation
-            with torch.no_grad():
-                q_values = self._model_forward(self.model, observations)
-                actions = torch.argmax(
-                    q_values, dim=1).cpu().type(
-                    torch.int64).numpy()
-        else:
-            actions = [
-                self.environment.action_space.sample()
-                for _ in range(self.n_envs)]
-            actions = np.asarray(actions, dtype=np.int64)
+            env_ids (Union[slice, np.ndarray], optional): Envs the
+                observations belong to (e.g. in pipelined rollouts).
+                Defaults to None (all envs).
+        """
+        epsilon = self.eps
+        if self.env_epsilons is not None:
+            epsilon = self.env_epsilons[
+                env_ids if env_ids is not None else slice(None)]
+
+        def greedy_actions(exploit: np.ndarray) -> np.ndarray:
+            obs = observations if exploit.all() else observations[
+                torch.from_numpy(exploit).to(observations.device)]
+            if self.traced_policy:
+                self._before_forward()
+                actions = self._policy_actions(obs, self.rollout_model)
+                self._after_forward()
+            else:
+                with torch.no_grad():
+                    q_values = self._model_forward(self.rollout_model, obs)
+                    actions = torch.argmax(q_values, dim=1)
+            return actions.cpu().numpy()
+
         # actors run on cpu, return numpy array
-        return actions
+        return self.exploration.select(
+            epsilon, self.environment.action_space.n, observations.shape[0],
+            greedy_actions)
+
+    def make_policy(self, task_label: Optional[int] = None,
+                    model: nn.Module = None) -> nn.Module:
+        # exploration is applied on top of the greedy policy
+        return GreedyPolicy(
+            self.model if model is None else model, task_label)
+
+    def make_actor_policy(self, task_label: Optional[int] = None) \
+            -> nn.Module:
+        # actors explore on their own, one env each
+        return EpsilonGreedyPolicy(
+            self.make_policy(task_label), self.environment.action_space.n,
+            self.eps)
 
     @torch.no_grad()
-    def _compute_next_q_values(self, batch: Rollout):
+    def _compute_next_q_values(self, batch: Rollout,
+                               next_online_q_values: torch.Tensor = None):
         # Compute next state q values using fixed target net
         next_q_values = self._model_forward(
             self.target_net, batch.next_observations)
@@ -188,8 +245,10 @@ class DQNStrategy(RLBaseStrategy):
             # Q'(s', argmax_a' Q(s', a') ):
             # use model to select the action with maximal value
             # (follow greedy policy with current weights)
-            max_actions = torch.argmax(self._model_forward(
-                self.model, batch.next_observations), dim=1)
+            if next_online_q_values is None:
+                next_online_q_values = self._model_forward(
+                    self.model, batch.next_observations)
+            max_actions = torch.argmax(next_online_q_values, dim=1)
             # evaluate q value of that action using fixed target network
             # select max actions, one per batch element
             next_q_values = next_q_values[torch.arange(
@@ -205,9 +264,22 @@ class DQNStrategy(RLBaseStrategy):
     def update(self, rollouts: List[Rollout]):
         # sample batch of steps/experiences from memory
         batch = self.replay_memory.sample_batch(self.batch_dim, self.device)
+        self.loss = self.batch_loss(batch)
 
+    def batch_loss(self, batch: Rollout) -> torch.Tensor:
         # compute q values prediction for whole batch: Q(s, a)
-        q_pred = self._model_forward(self.model, batch.observations)
+        next_online_q_values = None
+        if self.double_dqn:
+            # model is used on both observations and next observations
+            # (for action selection), run a single forward on both
+            q_values = self._model_forward(
+                self.model, torch.cat(
+                    [batch.observations, batch.next_observations]))
+            q_pred, next_online_q_values = q_values.split(
+                batch.observations.shape[0])
+            next_online_q_values = next_online_q_values.detach()
+        else:
+            q_pred = self._model_forward(self.model, batch.observations)
         # print('obs shape', batch.observations.shape, 'act',
         #       batch.actions.shape, 'q pred', q_pred.shape)
 
@@ -216,7 +288,8 @@ class DQNStrategy(RLBaseStrategy):
             q_pred, dim=1, index=batch.actions)
 
         # compute target Q value: Q*(s, a) = R_t + gamma * max_{a'} Q(s', a') 
-        next_q_values = self._compute_next_q_values(batch)
+        next_q_values = self._compute_next_q_values(
+            batch, next_online_q_values)
         # print('q next', next_q_values.shape, batch.rewards.shape,
         #       batch.dones.shape, 'q pred', q_pred.shape)
 
@@ -224,4 +297,4 @@ class DQNStrategy(RLBaseStrategy):
         q_target = batch.rewards + self.gamma * \
             (1 - batch.dones.int()) * next_q_values.unsqueeze(-1)
 
-        self.loss = self._criterion(q_pred, q_target)
+        return self._criterion(q_pred, q_target)
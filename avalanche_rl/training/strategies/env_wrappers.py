@@ -3,7 +3,7 @@ import gym
 import torch
 import cv2
 from gym import Wrapper, ObservationWrapper
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Union
 
 # Env wrappers adapted from pytorch lighting bolts
 
@@ -71,14 +71,28 @@ class FrameStackingWrapper(ObservationWrapper):
 
 
 class Array2Tensor(ObservationWrapper):
-    """ Convert observation from numpy array to torch tensors. """
-    def __init__(self, env):
+    """ Convert observation from numpy array to torch tensors.
+        If `to_float` is False, the returned tensor shares memory with the
+        observation array and keeps its dtype, so env must return a new array
+        at each step. """
+    def __init__(self, env, to_float: bool = True):
         super(Array2Tensor, self).__init__(env)
+        self.to_float = to_float
 
     def observation(self, observation):
-        t = torch.from_numpy(observation).float()
+        t = torch.from_numpy(observation)
+        if self.to_float:
+            t = t.float()
         return t
 
+    def step_async(self, actions: np.ndarray,
+                   env_ids: Union[slice, np.ndarray] = slice(None)):
+        return self.env.step_async(actions, env_ids)
+
+    def step_wait(self, env_ids: Union[slice, np.ndarray] = slice(None)):
+        obs, reward, done, info = self.env.step_wait(env_ids)
+        return self.observation(obs), reward, done, info
+
 
 class FireResetWrapper(gym.Wrapper):
     """
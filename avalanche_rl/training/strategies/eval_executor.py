@@ -0,0 +1,136 @@
+import copy
+import multiprocessing
+import torch
+import torch.nn as nn
+from concurrent.futures import Future, ProcessPoolExecutor
+from gym import Env
+from itertools import count
+from typing import Callable, List, Optional, Tuple
+from avalanche.benchmarks.scenarios.rl_scenario import RLExperience
+from avalanche_rl.training.strategies.env_wrappers import Array2Tensor
+from avalanche_rl.training.strategies.policy_export import trace_policy
+
+EpisodesResult = Tuple[List[float], List[int]]
+
+
+@torch.no_grad()
+def evaluate_episodes(model: nn.Module, env: Env, task_label: int,
+                      n_episodes: int, device='cpu', precision: str = 'fp32',
+                      policy: Optional[nn.Module] = None,
+                      seed: Optional[int] = None) -> EpisodesResult:
+    """
+    Run `n_episodes` evaluation episodes with `model` on `env`, one after
+    another, as done by `RLBaseStrategy.evaluate_exp` with `eval_n_envs`=1.
+    Actions are computed by `model.get_action` under the autocast of
+    `precision` ('fp32', 'bf16' or 'fp16'), or by a trace of `policy` if
+    given (see `RLBaseStrategy.traced_policy`). If `seed` is set, `env` is
+    seeded with it before running episodes, as with `eval_seed`.
+
+    Returns:
+        EpisodesResult: return and length of each episode.
+    """
+    model = model.to(device)
+    model.eval()
+    if seed is not None:
+        env.seed(seed)
+    env = Array2Tensor(env)
+    traced = None
+    returns, lengths = [], []
+    for _ in range(n_episodes):
+        obs = env.reset()
+        ep_return = 0.
+        for t in count(start=1):
+            obs = obs.unsqueeze(0).to(device)
+            if policy is not None:
+                if traced is None:
+                    traced = trace_policy(policy, obs.float())
+                action = traced(obs.float())
+            else:
+                with torch.autocast(
+                        torch.device(device).type,
+                        dtype=torch.float16 if precision == 'fp16'
+                        else torch.bfloat16,
+                        enabled=precision != 'fp32'):
+                    action = model.get_action(obs, task_label=task_label)
+            if isinstance(action, torch.Tensor):
+                action = action.cpu().numpy()
+            obs, reward, done, _ = env.step(action.item())
+            ep_return += reward
+            if done:
+                break
+        returns.append(ep_return)
+        lengths.append(t)
+
+    env.close()
+    return returns, lengths
+
+
+class EvalExecutor:
+    """
+    Evaluates a snapshot of a model on several experiences concurrently,
+    each experience being evaluated in one of `n_workers` worker processes.
+    Only episode returns and lengths are computed by workers, metrics are
+    then computed on the main process by the strategy.
+    """
+    def __init__(self, n_workers: int = multiprocessing.cpu_count(),
+                 threads_per_worker: int = 1, device='cpu'):
+        """
+        Args:
+            n_workers (int, optional): Number of worker processes.
+                    Defaults to number of cpus.
+            threads_per_worker (int, optional): Number of torch threads used
+                    by each worker, to avoid over-subscribing cores.
+                    Defaults to 1.
+            device (optional): Device used by workers. Defaults to 'cpu'.
+        """
+        assert n_workers > 0, "Number of workers must be positive"
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self.device = device
+        self._pool: ProcessPoolExecutor = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # workers are started lazily and re-used across evaluations;
+        # we spawn processes as forking doesn't play well with torch and ray
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.n_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=torch.set_num_threads,
+                initargs=(self.threads_per_worker,))
+        return self._pool
+
+    def submit(self, model: nn.Module, experiences: List[RLExperience],
+               n_episodes: int, precision: str = 'fp32',
+               make_policy: Optional[
+                   Callable[[int, nn.Module], nn.Module]] = None,
+               seed: Optional[int] = None) \
+            -> List['Future[EpisodesResult]']:
+        """
+        Snapshot `model` weights and schedule the evaluation of each
+        experience, without waiting for results. If `make_policy` is given,
+        workers act with a trace of `make_policy(task_label, snapshot)`
+        (see `evaluate_episodes`). Experience envs are seeded with `seed`
+        if set.
+        """
+        # arguments are pickled lazily by the pool, make sure later updates
+        # of the model don't leak into the evaluation
+        snapshot = copy.deepcopy(model).cpu()
+        pool = self._get_pool()
+        return [pool.submit(
+                    evaluate_episodes, snapshot, exp.environment,
+                    exp.task_label, n_episodes, self.device, precision,
+                    make_policy(exp.task_label, snapshot)
+                    if make_policy is not None else None, seed)
+                for exp in experiences]
+
+    def evaluate(self, model: nn.Module, experiences: List[RLExperience],
+                 n_episodes: int, **kwargs) -> List[EpisodesResult]:
+        """ Evaluate all experiences concurrently and wait for results. """
+        return [f.result()
+                for f in self.submit(model, experiences, n_episodes, **kwargs)]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,51 @@
+import numpy as np
+from typing import Callable, Union
+
+
+def apex_epsilons(n_envs: int, base_epsilon: float = 0.4,
+                  alpha: float = 7.) -> np.ndarray:
+    """
+    Per-env exploration rates of the ladder used in "Distributed
+    Prioritized Experience Replay" (Ape-X), in which env `i` of `n_envs`
+    explores with `base_epsilon ** (1 + alpha * i / (n_envs - 1))`.
+    """
+    if n_envs == 1:
+        return np.asarray([base_epsilon])
+    return base_epsilon ** (1. + alpha * np.arange(n_envs) / (n_envs - 1))
+
+
+class EpsilonGreedyExploration:
+    """
+    Batched epsilon-greedy action selection over parallel envs, each env
+    exploring independently with its own exploration rate.
+    A single call to the random generator per step decides which envs
+    explore and which random action they take, greedy actions are only
+    computed for envs which exploit.
+    """
+    def __init__(self, seed: int = None):
+        self.rng = np.random.default_rng(seed)
+
+    def select(self, epsilon: Union[float, np.ndarray], n_actions: int,
+               n_envs: int,
+               greedy_actions: Callable[[np.ndarray], np.ndarray]) \
+            -> np.ndarray:
+        """
+        Args:
+            epsilon (Union[float, np.ndarray]): Exploration rate, either
+                    shared or one per env.
+            n_actions (int): Number of discrete actions.
+            n_envs (int): Number of envs to select actions for.
+            greedy_actions (Callable[[np.ndarray], np.ndarray]): Computes
+                    greedy actions of the envs selected by a boolean mask,
+                    only called if at least one env exploits.
+
+        Returns:
+            np.ndarray: actions of all envs, as int64.
+        """
+        # explore/exploit coin and random action from the same draw
+        draws = self.rng.random((2, n_envs))
+        actions = (draws[1] * n_actions).astype(np.int64)
+        exploit = draws[0] >= epsilon
+        if exploit.any():
+            actions[exploit] = greedy_actions(exploit)
+        return actions
@@ -0,0 +1,248 @@
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+import ray
+from concurrent.futures import Future
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class InferenceServer:
+    """
+    Batched inference service: callers submit single observations to a
+    shared request queue, an inference thread batches whatever requests are
+    pending, up to `max_batch` of them or waiting at most `max_wait` seconds
+    after the first one, runs the policy once on the batch and writes each
+    action back to its caller.
+    Batch sizes and request latencies (from submission to action) are
+    recorded in histograms.
+    See `RemoteInferenceServer` for requests submitted by env processes.
+    """
+    # latency histogram bin edges in seconds, from 10us to 1s
+    LATENCY_BINS = np.logspace(-5, 0, 26)
+
+    def __init__(self,
+                 policy: Callable[[np.ndarray, np.ndarray], np.ndarray],
+                 max_batch: int, max_wait: float = 1e-3):
+        """
+        Args:
+            policy (Callable[[np.ndarray, np.ndarray], np.ndarray]): Maps
+                    a batch of observations and the ids of the envs they
+                    come from to a batch of actions.
+            max_batch (int): Max number of requests served in one batch.
+            max_wait (float, optional): Max time in seconds a batch waits
+                    for more requests after the first one is received.
+                    Defaults to 1e-3.
+        """
+        assert max_batch > 0, "Max batch size must be positive"
+        assert max_wait >= 0, "Max wait time can't be negative"
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests: queue.Queue = queue.Queue()
+        self._thread: threading.Thread = None
+        # number of batches served for each batch size
+        self.batch_size_counts = np.zeros((max_batch + 1,), dtype=np.int64)
+        # number of requests in each latency bin, with under/overflow bins
+        self.latency_counts = np.zeros(
+            (len(self.LATENCY_BINS) + 1,), dtype=np.int64)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+
+    def submit(self, observation: np.ndarray, env_id: int = None) \
+            -> 'Future[np.ndarray]':
+        """ Submit a single observation of env `env_id`, returning a future
+        of its action. """
+        future = Future()
+        self._requests.put(
+            (observation, env_id, time.perf_counter(), future))
+        return future
+
+    def shutdown(self):
+        """ Stop the inference thread once pending requests are served. """
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def histograms(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns:
+            Dict[str, Tuple[np.ndarray, np.ndarray]]: (counts, bins) of batch
+                sizes and of request latencies, latency bins being bin edges
+                in seconds (first and last counts are under/overflow).
+        """
+        return {
+            'batch_size': (self.batch_size_counts.copy(),
+                           np.arange(self.max_batch + 1)),
+            'latency': (self.latency_counts.copy(), self.LATENCY_BINS)}
+
+    def _next_batch(self):
+        """ Block for a request, then gather pending ones until the batch is
+        full or `max_wait` is elapsed. A None request stops the server.
+        Requests are (observation, env id, submission time, reply) tuples,
+        replies being futures of the actions. """
+        request = self._requests.get()
+        if request is None:
+            return None, True
+        batch = [request]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._requests.get(timeout=timeout) \
+                    if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _serve(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch is None:
+                break
+            observations, env_ids, submitted, replies = zip(*batch)
+            try:
+                actions = self.policy(
+                    np.stack(observations), np.asarray(env_ids))
+            except BaseException as e:
+                self._reply_error(replies, e)
+                continue
+            now = time.perf_counter()
+            self._reply(replies, actions)
+
+            self.batch_size_counts[len(batch)] += 1
+            latencies = now - np.asarray(submitted)
+            np.add.at(self.latency_counts, np.searchsorted(
+                self.LATENCY_BINS, latencies, side='right'), 1)
+
+    def _reply(self, replies: Tuple[Future, ...], actions: np.ndarray):
+        for future, action in zip(replies, actions):
+            future.set_result(action)
+
+    def _reply_error(self, replies: Tuple[Future, ...], error: BaseException):
+        for future in replies:
+            future.set_exception(error)
+
+
+@ray.remote
+class InferenceChannel:
+    """
+    Request queue living in its own (async) Ray actor, between env actors
+    and a `RemoteInferenceServer` on the learner: env actors submit their
+    observations and wait for their action, while the server pulls batches
+    of pending requests and sends actions back, so that env steps don't
+    need a round-trip to the learner.
+    """
+    def __init__(self):
+        self._requests: asyncio.Queue = None
+        # replies awaited by env actors, by request id
+        self._replies: Dict[int, asyncio.Future] = {}
+        self._ids = count()
+
+    def _queue(self) -> asyncio.Queue:
+        # created lazily, on the actor event loop
+        if self._requests is None:
+            self._requests = asyncio.Queue()
+        return self._requests
+
+    async def submit(self, observation: np.ndarray, env_id: int = None):
+        """ Submit a single observation of env `env_id` and wait for its
+        action. """
+        request_id = next(self._ids)
+        reply = asyncio.get_running_loop().create_future()
+        self._replies[request_id] = reply
+        # monotonic clock shared by processes of the same node
+        self._queue().put_nowait(
+            (observation, env_id, time.perf_counter(), request_id))
+        return await reply
+
+    async def next_batch(self, max_batch: int, max_wait: float) \
+            -> Optional[List[Tuple]]:
+        """ Wait for a request, then gather pending ones until the batch is
+        full or `max_wait` is elapsed. Returns None once closed. """
+        requests = self._queue()
+        request = await requests.get()
+        if request is None:
+            return None
+        batch = [request]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        while len(batch) < max_batch:
+            timeout = deadline - loop.time()
+            try:
+                request = await asyncio.wait_for(requests.get(), timeout) \
+                    if timeout > 0 else requests.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if request is None:
+                # serve this batch, stop on next call
+                requests.put_nowait(None)
+                break
+            batch.append(request)
+        return batch
+
+    async def reply(self, request_ids: List[int], actions: List[Any]):
+        for request_id, action in zip(request_ids, actions):
+            self._replies.pop(request_id).set_result(action)
+
+    async def fail(self, request_ids: List[int], error: str):
+        for request_id in request_ids:
+            self._replies.pop(request_id).set_exception(RuntimeError(error))
+
+    async def close(self):
+        self._queue().put_nowait(None)
+
+
+class RemoteInferenceServer(InferenceServer):
+    """
+    `InferenceServer` whose requests are submitted by env actors, in other
+    processes, to its `InferenceChannel` (`channel`): in the style of SEED
+    RL, each env process steps its env with the actions it gets back while
+    the inference thread only pulls batches of requests and pushes actions,
+    without waiting for them to be received.
+    Latencies are measured from the arrival of requests on the channel,
+    which must run on the same node as the server.
+    """
+    def __init__(self,
+                 policy: Callable[[np.ndarray, np.ndarray], np.ndarray],
+                 max_batch: int, max_wait: float = 1e-3):
+        super().__init__(policy, max_batch, max_wait)
+        self.channel = InferenceChannel.remote()
+
+    def submit(self, observation: np.ndarray, env_id: int = None) \
+            -> 'Future[np.ndarray]':
+        """ Submit a single observation through the channel, as env actors
+        do, returning a future of its action. """
+        return self.channel.submit.remote(observation, env_id).future()
+
+    def shutdown(self):
+        """ Stop the inference thread once pending requests are served. """
+        if self._thread is not None:
+            self.channel.close.remote()
+            self._thread.join()
+            self._thread = None
+
+    def _next_batch(self):
+        batch = ray.get(
+            self.channel.next_batch.remote(self.max_batch, self.max_wait))
+        return batch, batch is None
+
+    def _reply(self, replies: Tuple[int, ...], actions: np.ndarray):
+        self.channel.reply.remote(list(replies), list(actions))
+
+    def _reply_error(self, replies: Tuple[int, ...], error: BaseException):
+        self.channel.fail.remote(list(replies), repr(error))
@@ -0,0 +1,93 @@
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Optional, Tuple
+
+
+class GreedyPolicy(nn.Module):
+    """
+    Policy taking the action with greatest value, e.g. the greedy policy
+    of a DQN model. Exploration (e.g. epsilon-greedy) is left to the caller.
+    """
+    def __init__(self, model: nn.Module, task_label: Optional[int] = None):
+        super().__init__()
+        self.model = model
+        self.task_label = task_label
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        q_values = self.model(observations, task_label=self.task_label)
+        return torch.argmax(q_values, dim=1)
+
+
+class EpsilonGreedyPolicy(nn.Module):
+    """
+    Wraps a greedy `policy`, replacing its action with a random one with
+    probability `eps`, independently for each observation. `eps` is a
+    buffer so that it's part of the policy state dict.
+    """
+    def __init__(self, policy: nn.Module, n_actions: int, eps: float = 0.):
+        super().__init__()
+        self.policy = policy
+        self.n_actions = n_actions
+        self.register_buffer('eps', torch.tensor(float(eps)))
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        actions = self.policy(observations)
+        n = observations.shape[0]
+        explore = torch.rand(n, device=actions.device) < self.eps
+        return torch.where(explore, torch.randint(
+            self.n_actions, (n,), device=actions.device), actions)
+
+
+class CategoricalPolicy(nn.Module):
+    """
+    Policy sampling actions from the categorical distribution defined by
+    the policy logits of an actor-critic model.
+    """
+    def __init__(self, model: nn.Module, task_label: Optional[int] = None):
+        super().__init__()
+        self.model = model
+        self.task_label = task_label
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        _, policy_logits = self.model(
+            observations, compute_value=False, task_label=self.task_label)
+        # same as `Categorical(logits=..).sample()`, which can't be traced
+        return torch.multinomial(
+            F.softmax(policy_logits, dim=-1), 1).squeeze(-1)
+
+
+def trace_policy(policy: nn.Module, example_observations: torch.Tensor) \
+        -> torch.jit.ScriptModule:
+    """
+    Trace `policy` into a TorchScript module mapping a batch of observations
+    to a batch of actions, removing python overhead from the forward.
+    The traced module shares parameters with `policy`, so in-place updates
+    of the weights (e.g. optimizer steps) are picked up without re-tracing;
+    it must be traced again if parameters are re-allocated.
+    The batch size of `example_observations` is not fixed in the trace.
+    """
+    with torch.no_grad():
+        # sampling policies aren't deterministic, skip trace check
+        return torch.jit.trace(
+            policy, example_observations, check_trace=False)
+
+
+def quantize_policy(model: nn.Module) -> nn.Module:
+    """
+    Dynamically quantized int8 copy of `model` for cpu inference: weights of
+    linear layers are quantized ahead of time and activations on the fly,
+    other layers (e.g. convolutions) are kept in float. The copy is detached
+    from `model` and must be quantized again to follow weight updates.
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+
+def parameters_key(model: nn.Module) -> Tuple:
+    """ Key identifying the storage of the weights of `model` and its mode,
+    changing whenever a traced policy must be traced again. """
+    return (model.training, *(
+        t.data_ptr() for t in
+        list(model.parameters()) + list(model.buffers())))
@@ -0,0 +1,167 @@
+import torch
+import torch.nn as nn
+from .rl_base_strategy import Timestep
+from .actor_critic import A2CStrategy
+from .buffers import Rollout
+from avalanche.core import BasePlugin
+from avalanche_rl.training import default_rl_logger
+from avalanche_rl.models.actor_critic import A2CModel
+from torch.optim import Optimizer
+from torch.distributions import Categorical
+from typing import Union, Optional, Sequence, List, Dict
+
+
+class PPOStrategy(A2CStrategy):
+    def __init__(
+            self, model: A2CModel, optimizer: Optimizer,
+            per_experience_steps: Union[int, Timestep, List[Timestep]],
+            max_steps_per_rollout: int = 128,
+            ppo_epochs: int = 4,
+            n_minibatches: int = 4,
+            clip_eps: float = 0.2,
+            entropy_weight: float = 0.01,
+            normalize_advantages: bool = True,
+            value_criterion=nn.MSELoss(),
+            device='cpu',
+            plugins: Optional[Sequence[BasePlugin]] = [],
+            eval_every: int = -1, eval_episodes: int = 1,
+            policy_loss_weight: float = 1.,
+            value_loss_weight: float = 0.5,
+            gae_lambda: float = 0.95,
+            evaluator=default_rl_logger, **kwargs):
+        """
+            Proximal Policy Optimization (PPO) with clipped surrogate
+            objective, as presented in "Proximal Policy Optimization
+            Algorithms".
+            A rollout of `max_steps_per_rollout` steps is gathered from all
+            parallel envs at each step, then re-used for `ppo_epochs` epochs
+            of `n_minibatches` shuffled minibatches, each minibatch being a
+            separate optimizer step, so `updates_per_step` is
+            `ppo_epochs` * `n_minibatches`.
+            Rollout tensors, old log-probabilities and GAE advantages are
+            computed once per rollout into a preallocated buffer, minibatches
+            are then gathered by index.
+
+        Args:
+            :param ppo_epochs (int, optional): Number of epochs over each
+                    rollout. Defaults to 4.
+            :param n_minibatches (int, optional): Number of minibatches each
+                    rollout is split into at every epoch. Defaults to 4.
+            :param clip_eps (float, optional): Clipping range of the
+                    probability ratio in the surrogate objective.
+                    Defaults to 0.2.
+            :param entropy_weight (float, optional): Weight of the entropy
+                    bonus. Defaults to 0.01.
+            :param normalize_advantages (bool, optional): Whether to
+                    normalize advantages over each rollout.
+                    Defaults to True.
+            :param gae_lambda (float, optional): Lambda of GAE advantages.
+                    Defaults to 0.95.
+        Other arguments are the same as `A2CStrategy`.
+        """
+        assert ppo_epochs > 0 and n_minibatches > 0, \
+            "Number of epochs and minibatches must be positive"
+        # an update is a minibatch optimizer step
+        updates_per_step = kwargs.pop(
+            'updates_per_step', ppo_epochs * n_minibatches)
+        assert updates_per_step == ppo_epochs * n_minibatches, \
+            "PPO updates per step must be `ppo_epochs` * `n_minibatches`"
+        super().__init__(
+            model, optimizer, per_experience_steps=per_experience_steps,
+            max_steps_per_rollout=max_steps_per_rollout,
+            value_criterion=value_criterion, device=device, plugins=plugins,
+            eval_every=eval_every, eval_episodes=eval_episodes,
+            policy_loss_weight=policy_loss_weight,
+            value_loss_weight=value_loss_weight, gae_lambda=gae_lambda,
+            evaluator=evaluator, updates_per_step=updates_per_step,
+            **kwargs)
+        self.ppo_epochs = ppo_epochs
+        self.n_minibatches = n_minibatches
+        self.clip_eps = clip_eps
+        self.entropy_weight = entropy_weight
+        self.normalize_advantages = normalize_advantages
+        # rollout data re-used across epochs, allocated on first rollout
+        self._buffer: Dict[str, torch.Tensor] = {}
+        self._perm: torch.Tensor = None
+
+    def _to_buffer(self, name: str, tensors: List[torch.Tensor]):
+        """ Concatenate `tensors` into preallocated buffer `name`,
+        (re-)allocating it only if its shape or dtype changed. """
+        shape = (sum(t.shape[0] for t in tensors), *tensors[0].shape[1:])
+        buffer = self._buffer.get(name)
+        if buffer is None or buffer.shape != shape or \
+                buffer.dtype != tensors[0].dtype:
+            buffer = torch.empty(
+                shape, dtype=tensors[0].dtype, device=self.device)
+            self._buffer[name] = buffer
+        return torch.cat(tensors, out=buffer)
+
+    def after_rollout(self, **kwargs):
+        # compute old log-probs, advantages and value targets once per
+        # rollout, before any update
+        rollouts = [rollout.to(self.device) for rollout in self.rollouts]
+        observations = self._to_buffer(
+            'observations', [r.observations for r in rollouts])
+        actions = self._to_buffer('actions', [r.actions for r in rollouts])
+        rewards = torch.cat([r.rewards for r in rollouts])
+        dones = torch.cat([r.dones for r in rollouts])
+
+        with torch.no_grad():
+            n_obs = observations.shape[0]
+            values, policy_logits = self._model_forward(
+                self.model, torch.cat(
+                    [observations] + [r.next_observations for r in rollouts]))
+            values, next_values = values[:n_obs], values[n_obs:]
+            next_values = next_values.masked_fill(dones.view(-1, 1), 0.)
+            log_probs = Categorical(
+                logits=policy_logits[:n_obs]).log_prob(actions.view(-1,))
+            advantages, value_targets = self._rollout_advantages(
+                rollouts, actions, rewards, dones, values, next_values,
+                policy_logits[n_obs:])
+            advantages = advantages.view(-1)
+            # a single advantage has no std
+            if self.normalize_advantages and advantages.numel() > 1:
+                advantages = (advantages - advantages.mean()) / \
+                    (advantages.std() + 1e-8)
+
+        self._to_buffer('log_probs', [log_probs])
+        self._to_buffer('advantages', [advantages])
+        self._to_buffer('value_targets', [value_targets])
+        return super().after_rollout(**kwargs)
+
+    def update(self, rollouts: List[Rollout]):
+        # minibatches are gathered from the rollout buffer by index,
+        # reshuffling indices at the start of each epoch
+        minibatch = self.update_step % self.n_minibatches
+        n_samples = self._buffer['observations'].shape[0]
+        if minibatch == 0:
+            self._perm = torch.randperm(n_samples, device=self.device)
+        minibatch_size = -(-n_samples // self.n_minibatches)
+        idxs = self._perm[minibatch *
+                          minibatch_size:(minibatch+1)*minibatch_size]
+
+        values, policy_logits = self._model_forward(
+            self.model, self._buffer['observations'][idxs])
+        dist = Categorical(logits=policy_logits)
+        log_probs = dist.log_prob(self._buffer['actions'][idxs].view(-1,))
+
+        # clipped surrogate objective
+        ratio = torch.exp(log_probs - self._buffer['log_probs'][idxs])
+        advantages = self._buffer['advantages'][idxs]
+        policy_loss = -torch.min(
+            ratio * advantages,
+            ratio.clamp(1 - self.clip_eps, 1 + self.clip_eps) * advantages
+        ).mean()
+
+        value_loss = self.value_criterion(
+            self._buffer['value_targets'][idxs], values)
+
+        self.loss = self.ac_w * policy_loss + self.cr_w * value_loss - \
+            self.entropy_weight * dist.entropy().mean()
+
+    def batch_loss(self, batch: Rollout) -> torch.Tensor:
+        # `update` works on the rollout buffer, use the A2C loss instead
+        loss = getattr(self, 'loss', None)
+        A2CStrategy.update(self, [batch])
+        batch_loss, self.loss = self.loss, loss
+        return batch_loss
@@ -11,11 +11,19 @@ from avalanche.models.dynamic_optimizers import reset_optimizer
 from avalanche.training.utils import trigger_plugins
 from avalanche_rl.training.strategies.env_wrappers import *
 from avalanche_rl.training import default_rl_logger
+from avalanche_rl.training.utils import model_fingerprint, \
+    flatten_parameters, flat_parameters, broadcast_parameters, \
+    average_gradients
 from avalanche_rl.training.strategies.vectorized_env \
     import VectorizedEnvironment
-from .buffers import Rollout, Step
-from collections import defaultdict
-from typing import Union, Optional, Sequence, List
+from .buffers import Rollout, Step, EpisodeRecords
+from .eval_executor import EvalExecutor, EpisodesResult
+from .inference_server import RemoteInferenceServer
+from .policy_export import trace_policy, quantize_policy, \
+    parameters_key
+from collections import deque
+from concurrent.futures import Future
+from typing import Union, Optional, Sequence, List, Deque, Tuple, Dict
 from dataclasses import dataclass
 from torch.optim.optimizer import Optimizer
 from gym import Env
@@ -33,6 +41,25 @@ class Timestep:
     unit: TimestepUnit = TimestepUnit.STEPS
 
 
+def _to_float32(output):
+    """ Cast (possibly nested) low precision model outputs to float32. """
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, (tuple, list)):
+        return type(output)(_to_float32(o) for o in output)
+    return output
+
+
+def _to_model_dtype(model: nn.Module,
+                    observations: torch.Tensor) -> torch.Tensor:
+    """ Cast observations to the floating point dtype of `model` parameters
+    (float32 for models without floating point parameters, e.g. int8). """
+    dtype = next((p.dtype for p in model.parameters()
+                  if p.is_floating_point()), torch.float32)
+    return observations if observations.dtype == dtype else \
+        observations.to(dtype)
+
+
 class RLBaseStrategy(BaseTemplate):
     def __init__(
             self, model: nn.Module, optimizer: Optimizer,
@@ -42,7 +69,20 @@ class RLBaseStrategy(BaseTemplate):
             updates_per_step: int = 1, device='cpu', max_grad_norm=None,
             plugins: List[BasePlugin] = [],
             discount_factor: float = 0.99, evaluator=default_rl_logger,
-            eval_every=-1, eval_episodes: int = 1):
+            eval_every=-1, eval_episodes: int = 1,
+            episode_records_size: int = 1000, pipeline_groups: int = 1,
+            eval_n_envs: int = 1, eval_workers: int = 0,
+            async_eval: bool = False, max_inflight_evals: int = 2,
+            eval_cache: Optional[str] = None, eval_seed: int = None,
+            obs_staging: bool = False, precision: str = 'fp32',
+            flat_params: bool = False, traced_policy: bool = False,
+            quantized_policy_interval: int = None,
+            actor_inference: bool = False,
+            weights_broadcast_interval: int = 1,
+            inference_server: bool = False,
+            inference_max_batch: int = None,
+            inference_max_wait: float = 1e-3,
+            distributed: bool = False):
         """
             RLBaseStrategy specializes BaseTemplate to handle Reinforcement
             Learning tasks in the continual learning setting and should be
@@ -75,7 +115,8 @@ class RLBaseStrategy(BaseTemplate):
                 eval
                     eval_exp  # for each experience
                         make_eval_env
-                        evaluate_experience  # for `eval_episodes` episodes
+                        evaluate_exp  # for `eval_episodes` episodes,
+                                      # on `eval_n_envs` envs at once
                             # get action `a ~ model.get_action(..)`
                             # step environment simulator `env.step(a)`
                             # record reward and episode length
@@ -121,6 +162,136 @@ class RLBaseStrategy(BaseTemplate):
                         end of all the epochs for a single experience.
             :param eval_episodes (int, optional): Number of episodes to run
                     during evaluation. Defaults to 1.
+            :param episode_records_size (int, optional): Number of finished
+                    training episodes (return, length, env id, step) kept in
+                    the ring read by metrics. Defaults to 1000.
+            :param pipeline_groups (int, optional): Number of groups the
+                    parallel environments are split into for pipelined
+                    rollouts: inference for one group runs while the steps
+                    of the other groups are in flight. Per-env trajectories
+                    are unchanged, but the first action of each rollout is
+                    sampled before the preceding update. Only used with
+                    `n_envs` > 1. Defaults to 1 (no pipelining).
+            :param eval_n_envs (int, optional): Number of parallel
+                    environments used to run evaluation episodes. If > 1,
+                    episodes are run at once on a vectorized environment
+                    batching the policy forward over the still active envs.
+                    Defaults to 1 (episodes are run one after another).
+            :param eval_workers (int, optional): Number of worker processes
+                    used to evaluate all the experiences of the eval streams
+                    concurrently during periodic evaluation, on a snapshot
+                    of the current weights. Workers act as `evaluate_exp`
+                    does, with the same precision and traced policy, but
+                    run on cpu with episodes one after another: `eval_n_envs`
+                    > 1 and 'fp16' precision aren't supported. Defaults to 0
+                    (experiences are evaluated one after another on the main
+                    process).
+            :param async_eval (bool, optional): If True, periodic evaluation
+                    runs in worker processes on a versioned snapshot of the
+                    weights while training continues. Results are reported
+                    to the evaluator as soon as they're ready, with
+                    `eval_train_step` set to the training step of the
+                    snapshot. Same restrictions as `eval_workers` apply.
+                    Defaults to False.
+            :param max_inflight_evals (int, optional): Max number of
+                    asynchronous evaluations running at once; training waits
+                    for the oldest one to complete before starting a new
+                    one. Only used if `async_eval` is set. Defaults to 2.
+            :param eval_cache (str, optional): Enables caching of evaluation
+                    results in `eval`, keyed by a fingerprint of the model
+                    weights together with experience, env id and eval
+                    settings (`eval_seed`, `eval_n_envs`, `precision`,
+                    `traced_policy`). Either 'version' (cheap, uses parameters
+                    in-place version counters) or 'content' (hashes weight
+                    values). Only meant for deterministic policies and envs.
+                    Use `invalidate_eval_cache` if weights are changed
+                    without the fingerprint noticing (e.g. through
+                    `.data`). Defaults to None (no caching).
+            :param eval_seed (int, optional): If set, evaluation envs are
+                    seeded with this value before running episodes, on
+                    the main process as well as on eval workers.
+                    Defaults to None.
+            :param obs_staging (bool, optional): If True, training
+                    observations are kept in their raw dtype (e.g. uint8
+                    frames) in rollouts and replay memory, and converted to
+                    float in place into a preallocated staging tensor
+                    (pinned if `device` is a GPU) before the policy forward,
+                    so that each step performs at most one copy.
+                    Observations in updates are converted to float right
+                    before the forward. Defaults to False.
+            :param precision (str, optional): Precision of model forwards
+                    during rollouts, updates and evaluation. 'bf16' runs
+                    forwards under bfloat16 autocast (on cpu or gpu), 'fp16'
+                    under float16 autocast with gradient scaling (gpu only).
+                    Model outputs are cast back to float32 so that losses
+                    and targets are computed in full precision.
+                    Defaults to 'fp32'.
+            :param flat_params (bool, optional): If True, model parameters
+                    are re-allocated into a single contiguous tensor once
+                    the model is on `device` (see `flatten_parameters`), so
+                    that operations over all parameters (e.g. target
+                    network updates, EWC penalties) run as one vector op.
+                    Defaults to False.
+            :param traced_policy (bool, optional): If True, rollout and
+                    evaluation actions are computed by a TorchScript trace of
+                    the strategy policy (see `export_policy`), sharing the
+                    model weights and bypassing python overhead of the
+                    forward. The policy is traced again whenever parameters
+                    are re-allocated, the model mode or the task label
+                    change. Only supported with 'fp32' precision.
+                    Defaults to False.
+            :param quantized_policy_interval (int, optional): If set,
+                    rollout actions are computed by a dynamically quantized
+                    int8 copy of the model (see `quantize_policy`),
+                    re-quantized from the training weights every
+                    `quantized_policy_interval` updates, so that acting
+                    takes less cpu time away from the learner. Updates and
+                    evaluation use the float model. Only supported on cpu
+                    with 'fp32' precision. Defaults to None (rollouts use
+                    the float model).
+            :param actor_inference (bool, optional): If True and `n_envs`
+                    > 1, each env actor holds a local copy of the strategy
+                    policy (see `make_actor_policy`) and steps its env for a
+                    whole rollout of `max_steps_per_rollout` steps before
+                    returning the transitions, instead of receiving actions
+                    from the main process at every step. Rollouts then
+                    always have exactly `max_steps_per_rollout` steps,
+                    `rollouts_per_step` being ignored. Actors act with the
+                    float policy, so `quantized_policy_interval` isn't
+                    supported. Defaults to False.
+            :param weights_broadcast_interval (int, optional): Number of
+                    updates between broadcasts of the model weights to the
+                    actors policy copies when `actor_inference` is set.
+                    Each broadcast increases `policy_version`.
+                    Defaults to 1 (broadcast before every rollout).
+            :param inference_server (bool, optional): If True and `n_envs`
+                    > 1, rollouts of `max_steps_per_rollout` steps are
+                    collected by env actors stepping their env on their own,
+                    each submitting its observations to the channel of a
+                    `RemoteInferenceServer`, which batches pending requests
+                    for `sample_rollout_action` on the main process. Envs
+                    don't step in lockstep and `rollouts_per_step` is
+                    ignored. The server runs for the duration of each
+                    experience, batch size and latency histograms of the last
+                    one are kept by `self.inference_server`.
+                    Defaults to False.
+            :param inference_max_batch (int, optional): Max batch size of the
+                    inference server. Defaults to None (`n_envs`).
+            :param inference_max_wait (float, optional): Max time in seconds
+                    the inference server waits to fill a batch.
+                    Defaults to 1e-3.
+            :param distributed (bool, optional): If True, the strategy is a
+                    replica of a data-parallel learner, one per process of
+                    an already initialized `torch.distributed` process group
+                    (e.g. gloo on cpu). Each process gathers its own
+                    rollouts and samples its own replay memory, i.e. its
+                    shard of the data. Weights of `replicated_modules`
+                    (e.g. model and DQN target net) are broadcast from
+                    rank 0 when training starts and gradients are averaged
+                    across processes after each backward, so replicas stay
+                    in sync. Only rank 0 runs periodic evaluation and logs
+                    metrics. Processes should be seeded differently.
+                    Defaults to False.
         """
         super().__init__(model, device=device, plugins=plugins)
 
@@ -139,12 +310,51 @@ class RLBaseStrategy(BaseTemplate):
         self.rollouts_per_step = rollouts_per_step
         self.max_steps_per_rollout = max_steps_per_rollout
         self.updates_per_step = updates_per_step
+        # whether steps of gathered rollouts are shuffled when unraveled,
+        # strategies relying on time ordering should disable it
+        self.shuffle_rollouts = True
         self.total_steps = 0
+        self.total_updates = 0
         self._obs: torch.Tensor = None
+        self.obs_staging = obs_staging
+        # preallocated float policy input, defined by the train env
+        self._obs_staging_buffer: torch.Tensor = None
         self.gamma = discount_factor
         # defined by the experience
         self.n_envs: int = None
         self.eval_episodes = eval_episodes
+        self.episode_records_size = episode_records_size
+        self.pipeline_groups = pipeline_groups
+        self.eval_n_envs = eval_n_envs
+        self.eval_executor: EvalExecutor = EvalExecutor(eval_workers) \
+            if eval_workers > 0 else None
+        self.async_eval = async_eval
+        if async_eval and self.eval_executor is None:
+            self.eval_executor = EvalExecutor(1)
+        # eval workers run episodes one after another, on cpu
+        assert self.eval_executor is None or \
+            (eval_n_envs == 1 and precision != 'fp16'), \
+            "Concurrent and async evaluation only support `eval_n_envs`=1 " \
+            "and 'fp32' or 'bf16' precision"
+        assert max_inflight_evals > 0, \
+            "Number of in-flight evaluations must be positive"
+        self.max_inflight_evals = max_inflight_evals
+        # (version, training step, streams, futures) of async evaluations
+        self._inflight_evals: Deque[Tuple[
+            int, int, List[List[RLExperience]], List[Future]]] = deque()
+        self._eval_version = 0
+        # training step to which the evaluation being reported corresponds
+        self.eval_train_step: int = None
+        assert eval_cache in [None, 'version', 'content'], \
+            f"Unknown eval cache mode {eval_cache}"
+        self.eval_cache = eval_cache
+        self.eval_seed = eval_seed
+        # cached episode results, only valid for `_eval_cache_fingerprint`
+        self._eval_cache: Dict[Tuple, EpisodesResult] = {}
+        self._eval_cache_fingerprint = None
+        # defined by the experience if pipelining is enabled
+        self._env_groups: List[slice] = None
+        self._inflight_actions: List[np.ndarray] = None
         self.max_grad_norm = max_grad_norm
         # TODO: support Clock?
         for i in range(len(self.plugins)):
@@ -152,6 +362,55 @@ class RLBaseStrategy(BaseTemplate):
                 self.plugins.pop(i)
                 break
         
+        assert precision in ['fp32', 'bf16', 'fp16'], \
+            f"Unknown precision {precision}"
+        assert precision != 'fp16' or \
+            torch.device(device).type == 'cuda', \
+            "float16 precision is only supported on gpu, use bf16 on cpu"
+        self.precision = precision
+        self.flat_params = flat_params
+        assert not traced_policy or precision == 'fp32', \
+            "Traced policies are only supported with fp32 precision"
+        self.traced_policy = traced_policy
+        # (key, traced module) of the policy in use, see `_policy_actions`
+        self._traced: Tuple[Tuple, torch.jit.ScriptModule] = None
+        assert quantized_policy_interval is None or (
+            quantized_policy_interval > 0 and precision == 'fp32' and
+            torch.device(device).type == 'cpu'), \
+            "Quantized policies need a positive interval, fp32 precision " \
+            "and cpu device"
+        self.quantized_policy_interval = quantized_policy_interval
+        assert not (actor_inference or inference_server) or (
+            max_steps_per_rollout > 0 and pipeline_groups == 1), \
+            "Actor inference and inference server need rollouts of " \
+            "`max_steps_per_rollout` steps and no pipelining"
+        assert not (actor_inference and inference_server), \
+            "Actions are either computed by actors or by inference server"
+        assert not (actor_inference and quantized_policy_interval), \
+            "Quantized policies aren't supported with actor inference"
+        assert weights_broadcast_interval > 0, \
+            "Weights broadcast interval must be positive"
+        self.actor_inference = actor_inference
+        self.weights_broadcast_interval = weights_broadcast_interval
+        # version of the weights last sent to actors and update they were
+        # sent at; policy versions used by actors in the last rollout
+        self.policy_version = 0
+        self._broadcast_at: int = None
+        self._actor_policy: nn.Module = None
+        self.actor_policy_versions: np.ndarray = None
+        self.distributed = distributed
+        self.use_inference_server = inference_server
+        self.inference_max_batch = inference_max_batch
+        self.inference_max_wait = inference_max_wait
+        # created on first served rollout, kept across experiences
+        self.inference_server: RemoteInferenceServer = None
+        # int8 rollout copy of the model and update it was quantized at
+        self._quantized_model: nn.Module = None
+        self._quantized_at: int = None
+        # bfloat16 shares float32 exponent range, only float16 needs scaling
+        self._grad_scaler = torch.amp.GradScaler(
+            'cuda', enabled=precision == 'fp16')
+
         self.optimizer = optimizer
         self._criterion = criterion
         self.eval_every = eval_every
@@ -166,6 +425,17 @@ class RLBaseStrategy(BaseTemplate):
         """ Counts the number of training steps. +1 at the end of each 
         experience. """
 
+    def replicated_modules(self) -> List[nn.Module]:
+        """ Modules whose weights must be the same on every replica of a
+        data-parallel learner, broadcast from rank 0 before training. """
+        return [self.model]
+
+    @property
+    def is_main_process(self) -> bool:
+        """ Whether this is rank 0 of a data-parallel learner (see
+        `distributed`), or the only process. """
+        return not self.distributed or torch.distributed.get_rank() == 0
+
     @property
     def current_experience_steps(self) -> Timestep:
         """
@@ -184,7 +454,9 @@ class RLBaseStrategy(BaseTemplate):
         for p in self.plugins:
             p.after_rollout(self, **kwargs)
 
-    def sample_rollout_action(self, observations: torch.Tensor) -> np.ndarray:
+    def sample_rollout_action(
+            self, observations: torch.Tensor,
+            env_ids: Union[slice, np.ndarray] = None) -> np.ndarray:
         """
         Implements the action sampling a~Pi(s) where Pi is the parameterized
         function we're trying to learn.
@@ -194,6 +466,10 @@ class RLBaseStrategy(BaseTemplate):
         Args:
             observations (torch.Tensor): batch of observations/state at current
                 time t.
+            env_ids (Union[slice, np.ndarray], optional): envs the
+                observations belong to, when only a subset of envs is
+                stepped (e.g. pipelined rollouts). Defaults to None (all
+                envs).
 
         Returns:
             np.ndarray: batch of actions to perform during rollout of shape
@@ -202,6 +478,73 @@ class RLBaseStrategy(BaseTemplate):
         raise NotImplementedError(
             "`sample_rollout_action` must be implemented by every RL strategy")
 
+    def make_policy(self, task_label: Optional[int] = None,
+                    model: nn.Module = None) -> nn.Module:
+        """
+        Module mapping a batch of observations to the batch of actions
+        the strategy exploits (without exploration), sharing the weights of
+        `model` (`self.model` if None). Used to export a traced policy (see
+        `export_policy`).
+        """
+        raise NotImplementedError(
+            "`make_policy` must be implemented to use traced policies")
+
+    def export_policy(self, example_observations: torch.Tensor,
+                      task_label: Optional[int] = None,
+                      model: nn.Module = None) -> torch.jit.ScriptModule:
+        """
+        Export the strategy policy as a TorchScript module, traced on
+        `example_observations`. The module shares the model weights and can
+        be saved with `torch.jit.save` for standalone inference.
+        """
+        return trace_policy(
+            self.make_policy(task_label, model),
+            _to_model_dtype(self.model if model is None else model,
+                            example_observations))
+
+    def _policy_actions(self, observations: torch.Tensor,
+                        model: nn.Module = None) -> torch.Tensor:
+        """
+        Actions of the traced policy of `model` (`self.model` if None) for a
+        batch of observations on device, tracing it again if the model,
+        its weights storage or mode, the task label or observation shape
+        changed since last trace.
+        """
+        model = self.model if model is None else model
+        observations = _to_model_dtype(model, observations)
+        exp: RLExperience = getattr(self, 'experience', None)
+        task_label = exp.task_label if exp is not None else None
+        key = (id(model), task_label, observations.shape[1:],
+               observations.device, parameters_key(model))
+        if self._traced is None or self._traced[0] != key:
+            self._traced = (
+                key, self.export_policy(observations, task_label, model))
+        with torch.no_grad():
+            return self._traced[1](observations)
+
+    @property
+    def rollout_model(self) -> nn.Module:
+        """ Model used to sample rollout actions, either the int8 copy of
+        `self.model` (see `quantized_policy_interval`) or the model itself.
+        """
+        if self._quantized_model is not None:
+            return self._quantized_model
+        return self.model
+
+    def _refresh_quantized_policy(self):
+        """ Quantize the rollout copy of the model again if
+        `quantized_policy_interval` updates were performed since the last
+        quantization. """
+        if self.quantized_policy_interval is None:
+            return
+        if self._quantized_model is None or \
+                self.total_updates - self._quantized_at >= \
+                self.quantized_policy_interval:
+            self._quantized_model = quantize_policy(self.model)
+            self._quantized_at = self.total_updates
+            # the previous copy may be freed and its id re-used
+            self._traced = None
+
     def rollout(self, env: Env, n_rollouts: int, max_steps: int = -1) \
             -> List[Rollout]:
         """
@@ -223,45 +566,43 @@ class RLBaseStrategy(BaseTemplate):
                     result in returning `n_rollouts` episodes of length at most
                     `max_steps`. The number of steps performed is also always
                     returned along with the rollouts.
+                    With `actor_inference` or `inference_server` on a
+                    vectorized env, `n_rollouts` is ignored and a single
+                    rollout of exactly `max_steps` steps is returned.
         """
         # gather experience from env
         rollout_counter = 0
         rollouts = []
         step_experiences = []
 
-        # to compute timestep differences more efficiently
-        ep_len_sum = [sum(self.ep_lengths[k]) for k in range(self.n_envs)]
-
         # reset environment on first run
         if self._obs is None:
             self._obs = env.reset()
+        if isinstance(env.env, VectorizedEnvironment):
+            if self.actor_inference:
+                return self._actor_rollout(env, max_steps)
+            if self.use_inference_server:
+                return self._served_rollout(env, max_steps)
+        self._refresh_quantized_policy()
 
         for t in count(start=1):
-            # sample action(s) from policy moving observation to device;
-            # actions of shape `n_envs`xA
-            action = self.sample_rollout_action(
-                self._obs.to(self.device))
-
-            # observations returned are one for each parallel environment  
-            next_obs, rewards, dones, info = env.step(action)
+            if self._env_groups is not None:
+                action, (next_obs, rewards, dones, info) = \
+                    self._pipelined_step(env)
+            else:
+                # sample action(s) from policy moving observation to device;
+                # actions of shape `n_envs`xA
+                action = self.sample_rollout_action(
+                    self._policy_input(self._obs))
+
+                # observations returned are one for each parallel environment
+                next_obs, rewards, dones, info = env.step(action)
 
             step_experiences.append(
                 Step(self._obs, action, dones, rewards, next_obs))
             self.rollout_steps += 1
-            # keep track of all rewards for parallel environments
-            self.rewards['curr_returns'] += rewards.reshape(-1,)
-
             self._obs = next_obs
-
-            dones_idx = dones.reshape(-1, 1).nonzero()[0]
-            for env_done in dones_idx:
-                self.ep_lengths[env_done].append(
-                    self.rollout_steps-ep_len_sum[env_done])
-                ep_len_sum[env_done] += self.ep_lengths[env_done][-1]
-                # record done episode returns
-                self.rewards['past_returns'].append(
-                    self.rewards['curr_returns'][env_done])
-                self.rewards['curr_returns'][env_done] = 0.
+            self._record_episodes(rewards, dones)
 
             # Vectorized env auto resets on done by default,
             # check this flag to count episodes
@@ -271,7 +612,8 @@ class RLBaseStrategy(BaseTemplate):
                 if dones.any() or (max_steps > 0 and 
                                    len(step_experiences) >= max_steps):
                     rollouts.append(
-                        Rollout(step_experiences, n_envs=self.n_envs))
+                        Rollout(step_experiences, n_envs=self.n_envs,
+                                _shuffle=self.shuffle_rollouts))
                     step_experiences = []
                     rollout_counter += 1
                     # TODO: if not auto_reset: self._obs = env.reset
@@ -281,15 +623,182 @@ class RLBaseStrategy(BaseTemplate):
                 break
 
             if max_steps > 0 and n_rollouts <= 0 and t >= max_steps:
-                rollouts.append(Rollout(step_experiences, n_envs=self.n_envs))
+                rollouts.append(Rollout(step_experiences, n_envs=self.n_envs,
+                                        _shuffle=self.shuffle_rollouts))
                 break
 
         return rollouts
 
+    def make_actor_policy(self, task_label: Optional[int] = None) \
+            -> nn.Module:
+        """
+        Policy run by env actors with `actor_inference`, including
+        exploration, sharing `self.model` weights. Its state dict is
+        broadcast to the actors copies, so exploration parameters should be
+        buffers updated in place. Defaults to `make_policy`.
+        """
+        return self.make_policy(task_label)
+
+    def _broadcast_policy(self, env: VectorizedEnvironment):
+        """ Send the policy to actors at the start of an experience, then
+        broadcast its weights every `weights_broadcast_interval` updates. """
+        if self._actor_policy is None:
+            self._actor_policy = self.make_actor_policy(
+                self.experience.task_label)
+            env.set_policy(self._actor_policy, self.policy_version)
+            self._broadcast_at = self.total_updates
+        elif self.total_updates - self._broadcast_at >= \
+                self.weights_broadcast_interval:
+            self.policy_version += 1
+            env.broadcast_weights(
+                self._actor_policy.state_dict(), self.policy_version)
+            self._broadcast_at = self.total_updates
+
+    def _actor_rollout(self, env: Env, max_steps: int) -> List[Rollout]:
+        """ Gather a rollout of `max_steps` steps computed by env actors
+        with their local policy copy (see `actor_inference`). """
+        vec_env: VectorizedEnvironment = env.env
+        self._broadcast_policy(vec_env)
+        *chunk, self.actor_policy_versions = vec_env.rollout(max_steps)
+        return self._chunk_rollout(env, *chunk)
+
+    def _served_rollout(self, env: Env, max_steps: int) -> List[Rollout]:
+        """ Gather a rollout of `max_steps` steps, with actions computed by
+        the inference server (see `inference_server`). """
+        self._refresh_quantized_policy()
+
+        def policy(obs: np.ndarray, env_ids: np.ndarray) -> np.ndarray:
+            return self.sample_rollout_action(
+                self._policy_input(env.observation(obs)), env_ids)
+
+        if self.inference_server is None:
+            self.inference_server = RemoteInferenceServer(
+                policy, self.inference_max_batch or self.n_envs,
+                self.inference_max_wait)
+        # policy converts observations as the current env wrapper
+        self.inference_server.policy = policy
+        self.inference_server.start()
+        chunk = env.env.served_rollout(self.inference_server, max_steps)
+        return self._chunk_rollout(env, *chunk)
+
+    def _chunk_rollout(self, env: Env, obs: np.ndarray, actions: np.ndarray,
+                       rewards: np.ndarray, dones: np.ndarray,
+                       next_obs: np.ndarray) -> List[Rollout]:
+        """ Rollout from transitions of all envs collected in one chunk,
+        of shape `timesteps` x `n_envs` x D. """
+        step_experiences = []
+        for t in range(obs.shape[0]):
+            # same conversion as the env wrapper
+            step_experiences.append(Step(
+                env.observation(obs[t]), actions[t], dones[t], rewards[t],
+                env.observation(next_obs[t])))
+            self.rollout_steps += 1
+            self._record_episodes(rewards[t], dones[t])
+        self._obs = env.observation(next_obs[-1])
+        return [Rollout(step_experiences, n_envs=self.n_envs,
+                        _shuffle=self.shuffle_rollouts)]
+
+    def _policy_input(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        Move observations to device for the policy forward. With
+        `obs_staging`, raw observations are converted to float in place into
+        a preallocated (pinned) staging tensor re-used at every step.
+        """
+        if not self.obs_staging:
+            return observations.to(self.device)
+
+        n_obs = observations.shape[0]
+        staging = self._obs_staging_buffer
+        if staging is None or staging.shape[0] < n_obs or \
+                staging.shape[1:] != observations.shape[1:]:
+            staging = torch.empty(
+                observations.shape, dtype=torch.float32,
+                pin_memory=torch.device(self.device).type == 'cuda')
+            self._obs_staging_buffer = staging
+        # groups of envs in pipelined rollouts use a slice of the buffer
+        staging = staging[:n_obs]
+        staging.copy_(observations)
+        return staging.to(self.device, non_blocking=True)
+
+    def _step_group_async(self, env: Env, observations: torch.Tensor,
+                          env_ids: slice) -> np.ndarray:
+        """ Sample actions for a group of envs and send them to the envs
+        without waiting for the step to complete. """
+        action = self.sample_rollout_action(
+            self._policy_input(observations), env_ids)
+        env.step_async(action, env_ids)
+        return action
+
+    def _pipelined_step(self, env: Env):
+        """
+        Perform one step on all parallel envs, overlapping policy inference
+        for one group of envs with the steps in flight of the other groups.
+        Each group is stepped again as soon as its results are collected, so
+        one step per group is always in flight between calls.
+
+        Returns:
+            Actions performed by all envs and results of `env.step`,
+            in env order.
+        """
+        if self._inflight_actions is None:
+            # prime the pipeline
+            self._inflight_actions = [
+                self._step_group_async(env, self._obs[group], group)
+                for group in self._env_groups]
+
+        action = np.concatenate(self._inflight_actions)
+        results = []
+        for i, group in enumerate(self._env_groups):
+            next_obs, rewards, dones, info = env.step_wait(group)
+            # this group steps while following groups are collected
+            self._inflight_actions[i] = self._step_group_async(
+                env, next_obs, group)
+            results.append((next_obs, rewards, dones, info))
+
+        next_obs, rewards, dones, info = zip(*results)
+        return action, (torch.cat(next_obs), np.concatenate(rewards),
+                        np.concatenate(dones), np.concatenate(info))
+
+    def _drain_pipeline(self, env: Env):
+        """ Wait for pipelined steps still in flight, discarding results. """
+        if self._inflight_actions is not None:
+            env.step_wait()
+            self._inflight_actions = None
+
+    def _record_episodes(self, rewards: np.ndarray, dones: np.ndarray):
+        """
+        Vectorized episode bookkeeping: accumulate returns and lengths of all
+        parallel environments and record finished episodes into
+        `self.episodes` with masked operations.
+        """
+        self._curr_returns += rewards.reshape(-1,)
+        self._curr_lengths += 1
+
+        dones = dones.reshape(-1,).astype(bool)
+        if dones.any():
+            self.episodes.add(
+                self._curr_returns[dones], self._curr_lengths[dones],
+                dones.nonzero()[0], self.rollout_steps)
+            self._curr_returns[dones] = 0.
+            self._curr_lengths[dones] = 0
+
     def update(self, rollouts: List[Rollout]):
         raise NotImplementedError(
             "`update` must be implemented by every RL strategy")
 
+    def batch_loss(self, batch: Rollout) -> torch.Tensor:
+        """
+        Compute the loss of the strategy on a given batch of steps (e.g.
+        sampled from a replay memory), without side effects on the training
+        state. Defaults to running `update` on the batch, strategies which
+        don't compute their loss from the rollouts passed to `update`
+        should override it.
+        """
+        loss = getattr(self, 'loss', None)
+        self.update([batch])
+        batch_loss, self.loss = self.loss, loss
+        return batch_loss
+
     def make_train_env(self, **kwargs):
         # maintain vectorized env interface without parallel overhead
         # if `n_envs` is 1
@@ -303,11 +812,27 @@ class RLBaseStrategy(BaseTemplate):
                 wrappers_generators=None,
                 ray_kwargs={'num_cpus': cpus})
         # NOTE: `info['terminal_observation']`` is NOT converted to tensor 
-        return Array2Tensor(env)
+        # with observation staging, float conversion is done by the strategy
+        return Array2Tensor(env, to_float=not self.obs_staging)
 
     def make_eval_env(self, **kwargs):
-        # during evaluation we do not use a vectorized environment
-        return Array2Tensor(self.environment)
+        n_envs = min(self.eval_n_envs, self.eval_episodes)
+        # by default we do not use a vectorized environment during evaluation
+        if n_envs <= 1:
+            if self.eval_seed is not None:
+                self.environment.seed(self.eval_seed)
+            return Array2Tensor(self.environment)
+
+        import multiprocessing
+        cpus = min(n_envs, multiprocessing.cpu_count())
+        # episodes must end on `done`, we reset envs explicitly
+        env = VectorizedEnvironment(
+            self.environment, n_envs, auto_reset=False,
+            wrappers_generators=None, ray_kwargs={'num_cpus': cpus})
+        if self.eval_seed is not None:
+            # different seed per env or they'd all play the same episodes
+            env.seed([self.eval_seed + i for i in range(n_envs)])
+        return Array2Tensor(env)
 
     def train(self, experiences: Union[RLExperience, Sequence[RLExperience]],
               eval_streams: Optional[Sequence[Union
@@ -317,6 +842,15 @@ class RLBaseStrategy(BaseTemplate):
         self.is_training = True
         self.model.train()
         self.model.to(self.device)
+        if self.flat_params and flat_parameters(self.model) is None:
+            flatten_parameters(self.model)
+        if self.distributed:
+            assert torch.distributed.is_initialized(), \
+                "Distributed training needs an initialized process group"
+            for module in self.replicated_modules():
+                broadcast_parameters(module)
+            if not self.is_main_process:
+                self.evaluator.loggers = []
 
         # Normalize training and eval data.
         if isinstance(experiences, RLExperience):
@@ -332,7 +866,15 @@ class RLBaseStrategy(BaseTemplate):
             # make sure env is reset on new experience
             self._obs = None
             self.train_exp(self.experience, eval_streams, **kwargs)
+        if self.async_eval:
+            # report pending evaluations before ending training
+            _prev_experience = self.experience
+            self._collect_async_evals(wait=True)
+            self.experience = _prev_experience
+            self.model.train()
         self._after_training(**kwargs)
+        if self.eval_executor is not None:
+            self.eval_executor.shutdown()
 
         self.is_training = False
         res = self.evaluator.get_last_metrics()
@@ -343,16 +885,28 @@ class RLBaseStrategy(BaseTemplate):
         self.n_envs = experience.n_envs
         # TODO:  keep track in default evaluator
         self.rollout_steps = 0
-        # one per (parallel) environment
-        self.ep_lengths: Dict[int, List[float]] = defaultdict(lambda: list([0]))
-        # curr episode returns (per actor) - previous episodes returns 
-        self.rewards = {'curr_returns': np.zeros(
-                            (self.n_envs,),
-                            dtype=np.float32),
-                        'past_returns': []}
+        # curr episode returns and lengths (per actor)
+        self._curr_returns = np.zeros((self.n_envs,), dtype=np.float32)
+        self._curr_lengths = np.zeros((self.n_envs,), dtype=np.int64)
+        # finished episodes records, read by metrics
+        self.episodes = EpisodeRecords(self.episode_records_size)
 
         # Environment creation
         self.environment = self.make_train_env(**kwargs)
+        self._obs_staging_buffer = None
+        self._quantized_model = None
+        self._actor_policy = None
+        self._inflight_actions = None
+        self.inference_server = None
+        self._env_groups = None
+        if self.pipeline_groups > 1 and self.n_envs > 1:
+            # contiguous groups of envs, so that concatenating group results
+            # preserves env order
+            bounds = np.linspace(
+                0, self.n_envs, min(self.pipeline_groups, self.n_envs) + 1,
+                dtype=np.int64)
+            self._env_groups = [slice(int(start), int(stop))
+                                for start, stop in zip(bounds, bounds[1:])]
 
         # TODO
         # Model Adaptation (e.g. freeze/add new units)
@@ -378,18 +932,24 @@ class RLBaseStrategy(BaseTemplate):
                 # Backward
                 self.optimizer.zero_grad()
                 self._before_backward(**kwargs)
-                self.loss.backward()
+                # grad scaler is a no-op unless precision is 'fp16'
+                self._grad_scaler.scale(self.loss).backward()
+                if self.distributed:
+                    average_gradients(self.model)
                 self._after_backward(**kwargs)
 
                 # Gradient norm clipping
                 if self.max_grad_norm is not None:
+                    self._grad_scaler.unscale_(self.optimizer)
                     torch.nn.utils.clip_grad_norm_(
                         self.model.parameters(),
                         self.max_grad_norm)
 
                 # Optimization step
                 self._before_update(**kwargs)
-                self.optimizer.step()
+                self._grad_scaler.step(self.optimizer)
+                self._grad_scaler.update()
+                self.total_updates += 1
                 self._after_update(**kwargs)
 
             self._after_training_iteration(**kwargs)
@@ -397,6 +957,10 @@ class RLBaseStrategy(BaseTemplate):
             self._periodic_eval(eval_streams, do_final=False)
 
         self.total_steps += self.rollout_steps
+        self._drain_pipeline(self.environment)
+        # the server channel is an actor of the env Ray session
+        if self.inference_server is not None:
+            self.inference_server.shutdown()
         self.environment.close()
 
         # Final evaluation
@@ -406,6 +970,9 @@ class RLBaseStrategy(BaseTemplate):
 
     def _periodic_eval(self, eval_streams, do_final):
         """ Periodic eval controlled by `self.eval_every`. """
+        # data-parallel replicas share the weights of rank 0
+        if not self.is_main_process:
+            return
         # Since we are switching from train to eval model inside the training
         # loop, we need to save the training state, and restore it after the
         # eval is done.
@@ -418,10 +985,22 @@ class RLBaseStrategy(BaseTemplate):
 
         if (self.eval_every >= 0 and do_final) or \
            (self.eval_every > 0 and self.timestep % self.eval_every == 0):
-            for exp in eval_streams:
-                self.eval(exp)
+            if self.async_eval:
+                self._submit_async_eval(eval_streams)
+            else:
+                self.eval_train_step = self.total_steps + self.rollout_steps
+                if self.eval_executor is not None:
+                    self.eval_concurrent(eval_streams)
+                else:
+                    for exp in eval_streams:
+                        self.eval(exp)
+
+        if self.async_eval:
+            # report evaluations completed in the meantime
+            self._collect_async_evals()
 
         # restore train-state variables and training mode.
+        self.eval_train_step = None
         self.timestep, self.experience, self.environment = _prev_state[:3]
         self.n_envs, self.is_training = _prev_state[3:]
         self.model.train()
@@ -445,12 +1024,24 @@ class RLBaseStrategy(BaseTemplate):
         if isinstance(exp_list, RLExperience):
             exp_list: List[RLExperience] = [exp_list]
 
+        if self.eval_cache is not None:
+            fingerprint = model_fingerprint(self.model, mode=self.eval_cache)
+            # weights changed, cached results are stale
+            if fingerprint != self._eval_cache_fingerprint:
+                self.invalidate_eval_cache()
+                self._eval_cache_fingerprint = fingerprint
+
         self._before_eval(**kwargs)
         for self.experience in exp_list:
             self.environment = self.experience.environment
             # only single env supported during evaluation
             self.n_envs = self.experience.n_envs
 
+            cache_key = self._eval_cache_key()
+            if cache_key in self._eval_cache:
+                self._replay_eval_exp(*self._eval_cache[cache_key], **kwargs)
+                continue
+
             # Create test Environment
             self.environment = self.make_eval_env(**kwargs)
 
@@ -461,20 +1052,151 @@ class RLBaseStrategy(BaseTemplate):
             self.evaluate_exp(**kwargs)
             self._after_eval_exp(**kwargs)
 
+            if cache_key is not None:
+                self._eval_cache[cache_key] = (
+                    list(self.eval_rewards['past_returns']),
+                    [ep_len for lengths in self.eval_ep_lengths.values()
+                     for ep_len in lengths])
+
         self._after_eval(**kwargs)
 
         res = self.evaluator.get_last_metrics()
 
         return res
 
+    @torch.no_grad()
+    def eval_concurrent(
+            self, eval_streams: Sequence[Union[RLExperience,
+                                               Sequence[RLExperience]]],
+            **kwargs):
+        """
+        Evaluate a snapshot of the current model on all the experiences of
+        `eval_streams` concurrently using `self.eval_executor`.
+        Eval callbacks are then triggered for each stream as in `eval`, so that
+        metrics are computed from episode returns and lengths exactly as in
+        the serial path. Forward callbacks are not triggered as the policy
+        is run by worker processes.
+
+        :return: dictionary containing last recorded value for each metric name
+        """
+        streams = [[exp] if isinstance(exp, RLExperience) else list(exp)
+                   for exp in eval_streams]
+        results = iter(self.eval_executor.evaluate(
+            self.model, [exp for stream in streams for exp in stream],
+            self.eval_episodes, **self._executor_eval_kwargs()))
+
+        for stream in streams:
+            res = self._record_eval_results(
+                stream, [next(results) for _ in stream], **kwargs)
+        return res
+
+    def _executor_eval_kwargs(self) -> Dict:
+        """ Settings of the eval forward of `evaluate_exp` which eval
+        workers must reproduce. """
+        return dict(
+            precision=self.precision,
+            make_policy=self.make_policy if self.traced_policy else None,
+            seed=self.eval_seed)
+
+    def _submit_async_eval(self, eval_streams):
+        """
+        Start the evaluation of a snapshot of the current weights on all
+        `eval_streams` without waiting for results. If `max_inflight_evals`
+        evaluations are already running, wait for the oldest one first.
+        """
+        while len(self._inflight_evals) >= self.max_inflight_evals:
+            self._collect_async_evals(wait=True, max_evals=1)
+
+        streams = [[exp] if isinstance(exp, RLExperience) else list(exp)
+                   for exp in eval_streams]
+        futures = self.eval_executor.submit(
+            self.model, [exp for stream in streams for exp in stream],
+            self.eval_episodes, **self._executor_eval_kwargs())
+        self._eval_version += 1
+        self._inflight_evals.append(
+            (self._eval_version, self.total_steps + self.rollout_steps,
+             streams, futures))
+
+    def _collect_async_evals(self, wait: bool = False, max_evals: int = -1):
+        """
+        Report results of asynchronous evaluations in submission order,
+        stopping at the first one which is still running unless `wait` is
+        set.
+        """
+        n_collected = 0
+        while len(self._inflight_evals) and n_collected != max_evals:
+            version, train_step, streams, futures = self._inflight_evals[0]
+            if not wait and not all(f.done() for f in futures):
+                break
+            self._inflight_evals.popleft()
+            results = iter([f.result() for f in futures])
+            self.eval_train_step = train_step
+            for stream in streams:
+                self._record_eval_results(
+                    stream, [next(results) for _ in stream])
+            self.eval_train_step = None
+            n_collected += 1
+
+    def _record_eval_results(self, exp_list: Sequence[RLExperience],
+                             results: Sequence[EpisodesResult], **kwargs):
+        """
+        Trigger eval callbacks for `exp_list` using episode returns and
+        lengths computed outside of `evaluate_exp`.
+        """
+        self.is_training = False
+        self.model.eval()
+
+        self._before_eval(**kwargs)
+        for self.experience, (returns, lengths) in zip(exp_list, results):
+            self.environment = self.experience.environment
+            self.n_envs = self.experience.n_envs
+            self._replay_eval_exp(returns, lengths, **kwargs)
+
+        self._after_eval(**kwargs)
+
+        return self.evaluator.get_last_metrics()
+
+    def _replay_eval_exp(self, returns: List[float], lengths: List[int],
+                         **kwargs):
+        """
+        Trigger eval callbacks of current experience from episode returns and
+        lengths, without running the policy.
+        """
+        self._before_eval_exp(**kwargs)
+        for _ in range(len(returns)):
+            self._before_eval_iteration(**kwargs)
+            self._after_eval_iteration(**kwargs)
+        self.eval_rewards = {'past_returns': list(returns)}
+        self.eval_ep_lengths = {0: list(lengths)}
+        self._after_eval_exp(**kwargs)
+
+    def _eval_cache_key(self) -> Optional[Tuple]:
+        """ Key of current experience in the eval cache, None if caching is
+        disabled. Weights fingerprint is checked once per `eval` call. """
+        if self.eval_cache is None:
+            return None
+        env = self.experience.environment
+        env_id = env.spec.id if getattr(env, 'spec', None) is not None \
+            else id(env)
+        return (self.experience.current_experience, env_id,
+                self.experience.task_label, self.eval_episodes,
+                self.eval_seed, self.eval_n_envs, self.precision,
+                self.traced_policy)
+
+    def invalidate_eval_cache(self):
+        """ Drop all cached evaluation results. """
+        self._eval_cache = {}
+        self._eval_cache_fingerprint = None
+
     def evaluate_exp(self, **kwargs):
+        if isinstance(self.environment.env, VectorizedEnvironment):
+            return self.evaluate_exp_parallel(**kwargs)
+
         # rewards per episode
         self.eval_rewards = {'past_returns': [
             0. for _ in range(self.eval_episodes)]}
         # single env only here
         self.eval_ep_lengths = {0: []}
-        # TODO: evaluate on self.eval_episodes parallel environments at once
-        # (evaluate_exp_parallel function)
         for ep_no in range(self.eval_episodes):
             self._before_eval_iteration(**kwargs)
             obs = self.environment.reset()
@@ -483,9 +1205,7 @@ class RLBaseStrategy(BaseTemplate):
                 # deterministic dqn if we let no op action be selected
                 # indefinitely
                 self._before_eval_forward(**kwargs) 
-                action = self.model.get_action(
-                    obs.unsqueeze(0).to(self.device),
-                    task_label=self.experience.task_label)
+                action = self._eval_actions(obs.unsqueeze(0))
                 self._after_eval_forward(**kwargs)
                 obs, reward, done, info = self.environment.step(action.item())
                 # TODO: use info
@@ -500,6 +1220,74 @@ class RLBaseStrategy(BaseTemplate):
         self.environment.reset()
         self.environment.close()
 
+    def evaluate_exp_parallel(self, **kwargs):
+        """
+        Run `eval_episodes` episodes on a vectorized environment, batching the
+        policy forward over the envs whose episode is still running and
+        masking out finished ones. Envs are reset to start a new episode
+        as long as there are episodes left to run.
+        Records the same `eval_rewards` and `eval_ep_lengths` as
+        `evaluate_exp`, ordered by episode.
+        """
+        n_envs = self.environment.n_envs
+        returns = np.zeros((self.eval_episodes,), dtype=np.float32)
+        lengths = np.zeros((self.eval_episodes,), dtype=np.int64)
+        # episode run by each env
+        env_episode = np.arange(n_envs)
+        active = np.ones((n_envs,), dtype=bool)
+        next_episode = n_envs
+
+        for _ in range(n_envs):
+            self._before_eval_iteration(**kwargs)
+        obs = self.environment.reset()
+        while active.any():
+            active_ids = active.nonzero()[0]
+            self._before_eval_forward(**kwargs)
+            actions = self._eval_actions(obs[torch.from_numpy(active_ids)])
+            self._after_eval_forward(**kwargs)
+
+            self.environment.step_async(actions, active_ids)
+            next_obs, rewards, dones, _ = self.environment.step_wait(
+                active_ids)
+            obs[torch.from_numpy(active_ids)] = next_obs
+            episodes = env_episode[active_ids]
+            returns[episodes] += rewards
+            lengths[episodes] += 1
+
+            done_ids = active_ids[dones.astype(bool)]
+            for _ in done_ids:
+                self._after_eval_iteration(**kwargs)
+            # start remaining episodes on envs which are done
+            n_restart = min(len(done_ids), self.eval_episodes - next_episode)
+            restart_ids, stop_ids = done_ids[:n_restart], done_ids[n_restart:]
+            active[stop_ids] = False
+            if n_restart:
+                env_episode[restart_ids] = np.arange(
+                    next_episode, next_episode + n_restart)
+                next_episode += n_restart
+                for _ in restart_ids:
+                    self._before_eval_iteration(**kwargs)
+                obs[torch.from_numpy(restart_ids)] = self.environment.reset(
+                    env_ids=restart_ids)
+
+        self.eval_rewards = {'past_returns': returns.tolist()}
+        self.eval_ep_lengths = {0: lengths.tolist()}
+        self.environment.close()
+
+    def _eval_actions(self, observations: torch.Tensor) -> np.ndarray:
+        """ Evaluation actions for a batch of observations, from the traced
+        policy if `traced_policy` is set or `model.get_action` otherwise. """
+        observations = observations.to(self.device)
+        if self.traced_policy:
+            actions = self._policy_actions(observations)
+        else:
+            with self._autocast():
+                actions = self.model.get_action(
+                    observations, task_label=self.experience.task_label)
+        if isinstance(actions, torch.Tensor):
+            actions = actions.cpu().numpy()
+        return actions
+
     def _model_forward(self, model: nn.Module, observations: torch.Tensor,
                        *args, **kwargs):
         """
@@ -520,12 +1308,28 @@ class RLBaseStrategy(BaseTemplate):
         if exp is not None:
             task_label = exp.task_label
 
+        # raw observations (see `obs_staging`) are only converted right
+        # before the forward
+        observations = _to_model_dtype(model, observations)
+
         self._before_forward(**kwargs)
-        output = model(observations, *args, **kwargs, task_label=task_label)
+        with self._autocast():
+            output = model(
+                observations, *args, **kwargs, task_label=task_label)
+        if self.precision != 'fp32':
+            output = _to_float32(output)
         self._after_forward(**kwargs)
 
         return output
     
+    def _autocast(self) -> torch.autocast:
+        """ Autocast context for model forwards, according to
+        `self.precision`. """
+        dtype = torch.float16 if self.precision == 'fp16' else torch.bfloat16
+        return torch.autocast(
+            torch.device(self.device).type, dtype=dtype,
+            enabled=self.precision != 'fp32')
+
     def make_optimizer(self):
         # we reset the optimizer's state after each experience.
         # This allows to add new parameters (new heads) and
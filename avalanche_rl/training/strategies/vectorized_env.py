@@ -3,9 +3,11 @@ import gym
 import numpy as np
 import multiprocessing
 import types
+import torch
+import torch.nn as nn
 from gym.core import Wrapper
 from gym.spaces import Space
-from typing import Callable, List, Union, Dict, Any
+from typing import Callable, List, Union, Dict, Any, Tuple
 from copy import deepcopy
 from ale_py._ale_py import ALEState
 
@@ -15,8 +17,8 @@ from ale_py._ale_py import ALEState
 
 @ray.remote
 class Actor:
-    # we can implement a3c version by having each actor own a copy of the
-    # network
+    # actors can own a copy of the policy network to step their env
+    # locally, see `rollout`
     def __init__(
             self, env: Union[gym.Env, Callable],
             actor_id: int, env_kwargs=dict(),
@@ -31,6 +33,11 @@ class Actor:
         # allows you to have batches of fixed size independently of episode
         # termination
         self.auto_reset = auto_reset
+        # last observation, from which local rollouts continue
+        self._obs: np.ndarray = None
+        # local policy copy used by `rollout` and version of its weights
+        self.policy: nn.Module = None
+        self.policy_version: int = None
 
     def step(self, action: Union[float, int, np.ndarray]):
         """ Actions are computed in batch by the policy network on main process, 
@@ -52,10 +59,78 @@ class Actor:
         if self.auto_reset and done:
             info['terminal_observation'] = next_obs.copy()
             next_obs = self.env.reset()
+        self._obs = next_obs
         return next_obs, reward, done, info
 
     def reset(self):
-        return self.env.reset()
+        self._obs = self.env.reset()
+        return self._obs
+
+    def set_policy(self, policy: nn.Module, version: int):
+        """ Set the local policy copy, mapping a batch of observations to a
+        batch of actions. """
+        # actors share the node cpus, don't oversubscribe them
+        torch.set_num_threads(1)
+        self.policy = policy
+        self.policy.eval()
+        self.policy_version = version
+
+    def load_weights(self, state_dict: Dict[str, np.ndarray], version: int):
+        """ Update the weights of the local policy copy. """
+        # arrays coming from the object store are read-only, copy them
+        self.policy.load_state_dict(
+            {k: torch.tensor(v) for k, v in state_dict.items()})
+        self.policy_version = version
+
+    @torch.no_grad()
+    def rollout(self, n_steps: int) -> Tuple[np.ndarray, ...]:
+        """
+        Step the env `n_steps` times with actions computed by the local
+        policy copy, continuing from the last observation.
+
+        Returns:
+            Tuple[np.ndarray, ...]: observations, actions, rewards, dones
+                and next observations of each step, stacked along the
+                first dimension, and the policy version used.
+        """
+        assert self.policy is not None, "No policy set on actor"
+        if self._obs is None:
+            self.reset()
+        chunk = [[] for _ in range(5)]
+        for _ in range(n_steps):
+            obs = self._obs
+            action = self.policy(
+                torch.as_tensor(obs).float().unsqueeze(0))[0].numpy()
+            next_obs, reward, done, _ = self.step(action)
+            for i, v in enumerate([obs, action, reward, done, next_obs]):
+                chunk[i].append(v)
+        obs, actions, rewards, dones, next_obs = map(np.asarray, chunk)
+        return obs, actions, rewards.astype(np.float32), dones, next_obs, \
+            self.policy_version
+
+    def served_rollout(self, channel, n_steps: int) \
+            -> Tuple[np.ndarray, ...]:
+        """
+        Step the env `n_steps` times continuing from the last observation,
+        submitting each observation to `channel` (an `InferenceChannel`)
+        and waiting for its action.
+
+        Returns:
+            Tuple[np.ndarray, ...]: observations, actions, rewards, dones
+                and next observations of each step, stacked along the
+                first dimension.
+        """
+        if self._obs is None:
+            self.reset()
+        chunk = [[] for _ in range(5)]
+        for _ in range(n_steps):
+            obs = self._obs
+            action = ray.get(channel.submit.remote(obs, self.id))
+            next_obs, reward, done, _ = self.step(action)
+            for i, v in enumerate([obs, action, reward, done, next_obs]):
+                chunk[i].append(v)
+        obs, actions, rewards, dones, next_obs = map(np.asarray, chunk)
+        return obs, actions, rewards.astype(np.float32), dones, next_obs
 
     def render(self, mode='human'):
         """
@@ -108,6 +183,10 @@ class VectorizedEnvironment(object):
     Only supports numpy-based interface to facilitate object passing in
     distributed setting.
     """
+    # number of vectorized envs currently open, ray is shut down when the
+    # last one is closed so that e.g. evaluation envs can be closed while
+    # training envs are still running
+    _n_open: int = 0
 
     def __init__(
             self, envs: Union[Callable[[Dict[Any, Any]], gym.Env],
@@ -122,6 +201,8 @@ class VectorizedEnvironment(object):
             "Cannot initialize a VectorizedEnv with a non-positive number of \
                 environments"
         ray.init(ignore_reinit_error=True, **ray_kwargs)
+        VectorizedEnvironment._n_open += 1
+        self._closed = False
         self.n_envs = n_envs
         if isinstance(envs, types.FunctionType):
             # each env will be copied over to shared memory if the object
@@ -176,6 +257,8 @@ class VectorizedEnvironment(object):
         self.actors = [
             Actor.remote(envs[i], i, env_kwargs, auto_reset=auto_reset)
             for i in range(n_envs)]
+        # steps in flight issued with `step_async`, one per actor
+        self._pending_steps: Dict[int, ray.ObjectRef] = {}
 
     def _remote_vec_calls(self, fname: str, *args, **kwargs) \
             -> Union[np.ndarray, List[Any]]:
@@ -193,8 +276,39 @@ class VectorizedEnvironment(object):
     def step(self, actions: np.ndarray):
         assert actions.shape[0] == self.n_envs, \
             'First dimension must be equal to number of envs'
-        promises = [actor.step.remote(actions[i])
-                    for i, actor in enumerate(self.actors)]
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions: np.ndarray,
+                   env_ids: Union[slice, np.ndarray] = slice(None)):
+        """
+        Send actions to the actors selected by `env_ids` without waiting for
+        the step results, which must be later collected with `step_wait`.
+        This allows to overlap env stepping with other computation on the
+        main process (e.g. inference for a different group of envs).
+
+        Args:
+            actions (np.ndarray): actions to perform, one per selected actor.
+            env_ids (Union[slice, np.ndarray], optional): actors to step,
+                    either a slice or an array of indices. Defaults to all
+                    actors.
+        """
+        actor_ids = np.arange(self.n_envs)[env_ids]
+        assert actions.shape[0] == len(actor_ids), \
+            'First dimension must be equal to number of stepped envs'
+        for i, actor_id in enumerate(actor_ids):
+            assert actor_id not in self._pending_steps, \
+                f'Actor {actor_id} is already stepping'
+            self._pending_steps[actor_id] = \
+                self.actors[actor_id].step.remote(actions[i])
+
+    def step_wait(self, env_ids: Union[slice, np.ndarray] = slice(None)):
+        """
+        Wait for the steps issued with `step_async` to the actors selected by
+        `env_ids` and return their results stacked in actor order.
+        """
+        promises = [self._pending_steps.pop(actor_id)
+                    for actor_id in np.arange(self.n_envs)[env_ids]]
         # here we assume Env step computation is approximately the same for 
         # all envs. If that wasnt' the case, we should use:
         # https://docs.ray.io/en/latest/package-ref.html#ray.wait
@@ -209,17 +323,103 @@ class VectorizedEnvironment(object):
 
         return actor_steps
 
-    def reset(self) -> np.ndarray:
-        return self._remote_vec_calls('reset')
+    def set_policy(self, policy: nn.Module, version: int = 0):
+        """
+        Send a copy of `policy` to every actor, to be used for local
+        rollouts (see `rollout`). Weights are then kept up to date with
+        `broadcast_weights`.
+        """
+        ref = ray.put(deepcopy(policy).cpu())
+        ray.get([actor.set_policy.remote(ref, version)
+                 for actor in self.actors])
+
+    def broadcast_weights(self, state_dict: Dict[str, torch.Tensor],
+                          version: int):
+        """
+        Update the weights of the actors policy copies with `state_dict`,
+        tagged with `version`. Weights are put once in the object store and
+        read by all actors, without waiting for them to be loaded: calls
+        to the same actor run in submission order, so following rollouts
+        use the new weights.
+        """
+        ref = ray.put(
+            {k: v.detach().cpu().numpy() for k, v in state_dict.items()})
+        for actor in self.actors:
+            actor.load_weights.remote(ref, version)
+
+    def rollout(self, n_steps: int) -> Tuple[np.ndarray, ...]:
+        """
+        Let every actor step its env `n_steps` times with its local policy
+        copy and collect the transition chunks, with one round-trip per
+        chunk instead of one per step.
+
+        Returns:
+            Tuple[np.ndarray, ...]: observations, actions, rewards, dones
+                and next observations, of shape `n_steps` x `n_envs` x D,
+                and the policy version used by each actor.
+        """
+        assert not len(self._pending_steps), \
+            'Cannot run local rollouts while steps are in flight'
+        chunks = ray.get(
+            [actor.rollout.remote(n_steps) for actor in self.actors])
+        # stack actors along the second (env) dimension
+        return tuple(np.stack(field, axis=1) for field in
+                     list(zip(*chunks))[:5]) + \
+            (np.asarray([chunk[5] for chunk in chunks]),)
+
+    def served_rollout(self, server, n_steps: int) \
+            -> Tuple[np.ndarray, ...]:
+        """
+        Let every actor step its env `n_steps` times, continuing from its
+        last observation, with actions served by `server` (a
+        `RemoteInferenceServer`). Actors submit their observations to the
+        server channel themselves, so that envs don't wait for each other
+        and the main process isn't involved in single env steps.
+
+        Returns:
+            Tuple[np.ndarray, ...]: observations, actions, rewards, dones
+                and next observations, of shape `n_steps` x `n_envs` x D.
+        """
+        assert not len(self._pending_steps), \
+            'Cannot run served rollouts while steps are in flight'
+        chunks = ray.get([actor.served_rollout.remote(server.channel, n_steps)
+                          for actor in self.actors])
+        # stack actors along the second (env) dimension
+        return tuple(np.stack(field, axis=1) for field in zip(*chunks))
+
+    def reset(self, env_ids: Union[slice, np.ndarray] = slice(None)) \
+            -> np.ndarray:
+        promises = [self.actors[actor_id].reset.remote()
+                    for actor_id in np.arange(self.n_envs)[env_ids]]
+        return np.asarray(ray.get(promises))
 
     def render(self, mode='human') -> np.ndarray:
         return self._remote_vec_calls('render', mode=mode)
 
-    def seed(self, seed: int):
-        promises = [actor.seed.remote(seed) for actor in self.actors]
+    def seed(self, seed: Union[int, List[int]]):
+        """
+        Seed all actors envs, either with the same seed or with one seed
+        per actor.
+        """
+        seeds = seed if isinstance(seed, (list, tuple, np.ndarray)) \
+            else [seed] * self.n_envs
+        assert len(seeds) == self.n_envs, 'Expected one seed per env'
+        promises = [actor.seed.remote(s)
+                    for actor, s in zip(self.actors, seeds)]
         return ray.get(promises)
 
     def close(self):
+        # make sure no step is left in flight
+        if len(self._pending_steps):
+            ray.get(list(self._pending_steps.values()))
+            self._pending_steps = {}
+        if self._closed:
+            return
         promises = [actor.close.remote() for actor in self.actors]
-        ray.wait(promises)
-        ray.shutdown()
+        ray.get(promises)
+        for actor in self.actors:
+            ray.kill(actor)
+        self._closed = True
+        VectorizedEnvironment._n_open -= 1
+        if VectorizedEnvironment._n_open == 0:
+            ray.shutdown()
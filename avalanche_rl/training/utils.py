@@ -13,10 +13,12 @@
 General utility functions for pytorch.
 """
 
+import hashlib
 import torch
 from avalanche.models.batch_renorm import BatchRenorm2D
 from collections import defaultdict
 from torch import Tensor
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 from torch.nn import Module, Linear
 from torch.utils.data import Dataset, DataLoader
 from typing import NamedTuple, List, Optional, Tuple, Callable
@@ -72,6 +74,125 @@ def zerolike_params_dict(model):
             for k, p in model.named_parameters()]
 
 
+def model_fingerprint(model: Module, mode: str = 'version'):
+    """
+    Cheap fingerprint of the weights of a model, which changes whenever
+    parameters or buffers are updated.
+
+    :param model: a pytorch model
+    :param mode: `version` uses storage pointers and in-place version counters
+        of tensors, which change on every optimizer step or `load_state_dict`
+        but not on updates through `.data`. `content` hashes actual tensor
+        values, which is slower but robust to any kind of update.
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    if mode == 'version':
+        return tuple((t.data_ptr(), t._version) for t in tensors)
+    elif mode == 'content':
+        digest = hashlib.sha1()
+        for t in tensors:
+            digest.update(
+                t.detach().cpu().contiguous().view(-1).view(
+                    torch.uint8).numpy().tobytes())
+        return digest.hexdigest()
+    raise ValueError(f"Unknown fingerprint mode {mode}")
+
+
+def flatten_parameters(model: Module) -> Tensor:
+    """
+    Re-allocate all the parameters of a model into a single contiguous
+    tensor, each parameter becoming a view over it. Operations on all
+    parameters (e.g. polyak updates, serialization) can then be performed
+    with a single vector op on the returned tensor.
+    The model should already be on its final device, as moving it
+    re-allocates each parameter separately.
+
+    :param model: a pytorch model with parameters of the same dtype.
+    :return: the flat tensor backing all parameters, in `model.parameters()`
+        order.
+    """
+    params = list(model.parameters())
+    assert len(set(p.dtype for p in params)) == 1, \
+        "Parameters must share the same dtype to be flattened"
+    flat = torch.empty(sum(p.numel() for p in params),
+                       dtype=params[0].dtype, device=params[0].device)
+    offset = 0
+    for p in params:
+        n = p.numel()
+        flat[offset:offset+n].copy_(p.data.view(-1))
+        p.data = flat[offset:offset+n].view_as(p)
+        offset += n
+    model._flat_parameters = flat
+    return flat
+
+
+def flat_parameters(model: Module) -> Optional[Tensor]:
+    """
+    Return the flat tensor backing all the parameters of a model (see
+    `flatten_parameters`), or None if the model hasn't been flattened or its
+    parameters have been re-allocated since (e.g. by `model.to`).
+
+    :param model: a pytorch model
+    """
+    flat: Tensor = getattr(model, '_flat_parameters', None)
+    if flat is None:
+        return None
+    offset = 0
+    for p in model.parameters():
+        if p.data_ptr() != flat.data_ptr() + offset * flat.element_size() \
+                or not p.is_contiguous():
+            return None
+        offset += p.numel()
+    return flat if offset == flat.numel() else None
+
+
+def broadcast_parameters(model: Module, src: int = 0):
+    """
+    Broadcast parameters and buffers of a model from process `src` to all
+    processes of the default `torch.distributed` group, in a single
+    collective, so that data-parallel replicas start from the same weights.
+
+    :param model: a pytorch model, with tensors of the same dtype.
+    :param src: rank of the process holding the weights to broadcast.
+    """
+    tensors = [t.data for t in model.parameters()] + \
+        [b for b in model.buffers() if b.is_floating_point()]
+    flat = _flatten_dense_tensors(tensors)
+    torch.distributed.broadcast(flat, src)
+    for t, synced in zip(tensors, _unflatten_dense_tensors(flat, tensors)):
+        t.copy_(synced)
+
+
+def average_gradients(model: Module):
+    """
+    Average gradients of a model across all processes of the default
+    `torch.distributed` group, with a single all-reduce on the
+    concatenated gradients. Parameters without gradient on some processes
+    contribute zeros there and get the averaged gradient, so that every
+    replica steps the same parameters, while parameters without gradient
+    on all processes keep none, so that optimizers still skip them.
+
+    :param model: a pytorch model, with parameters of the same dtype.
+    """
+    params = [p for p in model.parameters() if p.requires_grad]
+    # number of processes with a gradient for each parameter
+    present = torch.tensor([p.grad is not None for p in params],
+                           dtype=torch.float32, device=params[0].device)
+    torch.distributed.all_reduce(present)
+    params = [p for p, n in zip(params, present.tolist()) if n > 0]
+    if not params:
+        return
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+    grads = [p.grad for p in params]
+    flat = _flatten_dense_tensors(grads)
+    torch.distributed.all_reduce(flat)
+    flat /= torch.distributed.get_world_size()
+    for g, averaged in zip(grads, _unflatten_dense_tensors(flat, grads)):
+        g.copy_(averaged)
+
+
 def copy_params_dict(model, copy_grad=False):
     """
     Create a list of (name, parameter), where parameter is copied from model.
@@ -279,6 +400,11 @@ def examples_per_class(targets):
 __all__ = [
     'load_all_dataset',
     'zerolike_params_dict',
+    'model_fingerprint',
+    'flatten_parameters',
+    'flat_parameters',
+    'broadcast_parameters',
+    'average_gradients',
     'copy_params_dict',
     'LayerAndParameter',
     'get_layers_and_params',
@@ -0,0 +1,47 @@
+"""
+    Scaling benchmark of A3C Hogwild training on cpu: the same number of
+    updates is performed with 1, 4, 8 and 16 worker processes on
+    CCartPole-v1 (MLP policy) and Pong (convolutional policy), reporting
+    updates/sec, env steps/sec and speedup over a single worker.
+"""
+import time
+import torch
+from avalanche_rl.training.strategies import A3CStrategy
+from avalanche_rl.models.actor_critic import ActorCriticMLP, \
+    ConvActorCritic
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator, atari_benchmark_generator
+from torch.optim import Adam
+
+N_WORKERS = [1, 4, 8, 16]
+
+
+def throughput(env_name: str, n_workers: int, n_updates: int):
+    torch.manual_seed(0)
+    if env_name == 'CCartPole-v1':
+        scenario = gym_benchmark_generator([env_name], n_parallel_envs=1)
+        model = ActorCriticMLP(4, 2, 64, 64)
+    else:
+        scenario = atari_benchmark_generator([env_name], n_parallel_envs=1)
+        model = ConvActorCritic(4, (84, 84), 6)
+    strategy = A3CStrategy(
+        model, Adam(model.parameters(), lr=1e-4), n_updates,
+        n_workers=n_workers, max_steps_per_rollout=20)
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    elapsed = time.perf_counter() - start
+    return n_updates / elapsed, strategy.total_steps / elapsed
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    for env_name, n_updates in [('CCartPole-v1', 2000),
+                                ('PongNoFrameskip-v4', 400)]:
+        print(f"A3C on {env_name}, {n_updates} updates:")
+        base = None
+        for n_workers in N_WORKERS:
+            ups, sps = throughput(env_name, n_workers, n_updates)
+            base = base or ups
+            print(f"\t{n_workers:2d} workers: {ups:7.1f} updates/sec, "
+                  f"{sps:8.1f} env steps/sec ({ups / base:.2f}x)")
@@ -0,0 +1,42 @@
+"""
+    Rollout throughput of A2C on CartPole-v1 with actions computed centrally
+    and sent to env actors at every step, against actors stepping their env
+    locally with a copy of the policy (`actor_inference`), whose weights are
+    broadcast every `weights_broadcast_interval` updates.
+"""
+import time
+import torch
+from avalanche_rl.training.strategies import A2CStrategy
+from avalanche_rl.models.actor_critic import ActorCriticMLP
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.optim import Adam
+
+N_ENVS = 8
+ROLLOUT_STEPS = 20
+N_STEPS = 200
+
+
+def env_steps_per_sec(**kwargs):
+    torch.manual_seed(0)
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=N_ENVS)
+    model = ActorCriticMLP(4, 2, 64, 64)
+    strategy = A2CStrategy(
+        model, Adam(model.parameters(), lr=1e-4), N_STEPS,
+        max_steps_per_rollout=ROLLOUT_STEPS, **kwargs)
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    return strategy.total_steps * N_ENVS / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(f"A2C training env steps/sec, {N_ENVS} envs, rollouts of "
+          f"{ROLLOUT_STEPS} steps:")
+    print(f"\tcentral inference: {env_steps_per_sec():.0f}")
+    for interval in [1, 4, 16]:
+        sps = env_steps_per_sec(
+            actor_inference=True, weights_broadcast_interval=interval)
+        print(f"\tactor inference, broadcast every {interval} updates: "
+              f"{sps:.0f}")
@@ -0,0 +1,57 @@
+"""
+    Data-parallel DQN learner on cpu with `torch.distributed` (gloo): each
+    process collects its own experience and samples its own replay memory,
+    gradients are averaged across processes at every update. Training
+    throughput of ConvDeepQN with large batches on Pong is reported for
+    several numbers of processes, only rank 0 logs metrics.
+"""
+import os
+import tempfile
+import time
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.models.dqn import ConvDeepQN
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import atari_benchmark_generator
+from torch.optim import Adam
+
+BATCH_SIZE = 256
+N_STEPS = 200
+
+
+def train(rank: int, world_size: int, init_file: str):
+    dist.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=world_size)
+    # processes share the node cores
+    torch.set_num_threads(max(os.cpu_count() // world_size, 1))
+    torch.manual_seed(rank)
+    scenario = atari_benchmark_generator(
+        ['PongNoFrameskip-v4'], n_parallel_envs=1)
+    model = ConvDeepQN(4, (84, 84), 6)
+    # each process samples its own batch, global batch is
+    # `world_size` * `BATCH_SIZE`
+    strategy = DQNStrategy(
+        model, Adam(model.parameters(), lr=1e-4), N_STEPS,
+        batch_size=BATCH_SIZE, replay_memory_size=10000,
+        replay_memory_init_size=2 * BATCH_SIZE, distributed=True)
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    elapsed = time.perf_counter() - start
+    if strategy.is_main_process:
+        samples = strategy.total_updates * BATCH_SIZE * world_size
+        print(f"\t{world_size} processes: {samples / elapsed:.0f} "
+              "samples/sec")
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    print(f"ConvDeepQN data-parallel training on Pong, batch of {BATCH_SIZE} "
+          "per process:")
+    for world_size in [1, 2, 4]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mp.spawn(train, args=(world_size, os.path.join(tmp_dir, 'init')),
+                     nprocs=world_size)
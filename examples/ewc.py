@@ -51,7 +51,10 @@ if __name__ == "__main__":
     memory_size = 10000
     memory = ReplayMemory(size=memory_size, n_envs=n_envs)
     ewc_plugin = EWCRL(400., memory, mode='separate',
-                       start_ewc_after_experience=1)
+                       start_ewc_after_experience=1,
+                       keep_importance_data=True,
+                       storage_dtype=torch.bfloat16,
+                       max_in_memory_experiences=2)
 
     # log to tensorboard
     # tb_logger = TensorboardLogger("/tmp/tb_data")
@@ -119,6 +122,9 @@ if __name__ == "__main__":
             {'model': model.state_dict(),
              'optim': optimizer.state_dict()},
             'pong-breakout.pt')
+        print("EWC storage", ewc_plugin.storage_report())
+    # delete importances spilled to disk
+    ewc_plugin.close()
 
     # store metrics
     metrics = strategy.evaluator.get_all_metrics()
@@ -0,0 +1,43 @@
+"""
+    Timing comparison of EWC importance computation: `batch` squares the
+    gradient of each sampled batch through separate update/backward passes,
+    `per_sample` computes the empirical Fisher from per-sample gradients with
+    `torch.func`, in a few vectorized calls.
+    A DQN agent is first trained on CartPole-v1 to fill the replay memory.
+"""
+import time
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.training.strategies.buffers import ReplayMemory
+from avalanche_rl.training.plugins.ewc import EWCRL
+from avalanche_rl.models.dqn import MLPDeepQN
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.optim import Adam
+
+if __name__ == "__main__":
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=128, n_actions=2,
+                      hidden_layers=2)
+    memory = ReplayMemory(size=10000, n_envs=1)
+    optimizer = Adam(model.parameters(), lr=1e-3)
+    strategy = DQNStrategy(
+        model, optimizer, 1000, batch_size=32, replay_memory_init_size=2000,
+        initial_replay_memory=memory, evaluator=None)
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+
+    print(f"Importances of {sum(p.numel() for p in model.parameters())} "
+          "parameters (seconds)")
+    for fisher_update_steps, batch_size in [(10, 32), (32, 64)]:
+        times = {}
+        for fisher in ['batch', 'per_sample']:
+            ewc = EWCRL(1., memory, fisher_update_steps=fisher_update_steps,
+                        batch_size=batch_size, fisher=fisher,
+                        fisher_chunk_size=512)
+            # warmup
+            ewc.compute_importances(model, strategy, optimizer)
+            start = time.perf_counter()
+            ewc.compute_importances(model, strategy, optimizer)
+            times[fisher] = time.perf_counter() - start
+        print(f"\t{fisher_update_steps * batch_size} samples: " + ", ".join(
+            f"{fisher} {t:.3f}" for fisher, t in times.items()))
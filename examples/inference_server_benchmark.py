@@ -0,0 +1,55 @@
+"""
+    Rollout throughput of DQN with a convolutional policy on Pong, with
+    actions computed centrally for all envs in lockstep against env actors
+    stepping on their own and submitting observations to a batching
+    `RemoteInferenceServer`, for several max batch sizes. Batch size and
+    latency histograms of the server are reported.
+"""
+import time
+import torch
+import numpy as np
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.models.dqn import ConvDeepQN
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import atari_benchmark_generator
+from torch.optim import Adam
+
+N_ENVS = 16
+ROLLOUT_STEPS = 32
+N_STEPS = 20
+
+
+def run(**kwargs):
+    torch.manual_seed(0)
+    scenario = atari_benchmark_generator(
+        ['PongNoFrameskip-v4'], n_parallel_envs=N_ENVS)
+    model = ConvDeepQN(4, (84, 84), 6)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters(), lr=1e-4), N_STEPS, batch_size=32,
+        max_steps_per_rollout=ROLLOUT_STEPS, replay_memory_size=10000,
+        replay_memory_init_size=N_ENVS * ROLLOUT_STEPS, **kwargs)
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    sps = strategy.total_steps * N_ENVS / (time.perf_counter() - start)
+    return sps, strategy.inference_server
+
+
+if __name__ == "__main__":
+    print(f"DQN training env steps/sec on Pong, {N_ENVS} envs:")
+    sps, _ = run()
+    print(f"\tlockstep central inference: {sps:.0f}")
+    for max_batch in [4, 8, 16]:
+        sps, server = run(inference_server=True,
+                          inference_max_batch=max_batch)
+        print(f"\tinference server, max batch {max_batch}: {sps:.0f}")
+        histograms = server.histograms()
+        counts, sizes = histograms['batch_size']
+        print("\t\tbatch sizes: " + ", ".join(
+            f"{size}: {count}" for size, count in zip(sizes, counts)
+            if count))
+        counts, bins = histograms['latency']
+        edges = np.concatenate([[0.], bins, [np.inf]]) * 1e3
+        print("\t\tlatency (ms): " + ", ".join(
+            f"[{lo:.2f}, {hi:.2f}): {count}"
+            for lo, hi, count in zip(edges, edges[1:], counts) if count))
@@ -0,0 +1,84 @@
+"""
+    Benchmark of bfloat16 mixed precision against float32 on cpu.
+    First, the throughput of forward/backward passes of the convolutional
+    models on Atari-sized batches is compared. Then DQN is trained on
+    CCartPole-v1 with both precisions and learning curves (evaluation returns)
+    are compared as a parity check.
+"""
+import time
+import torch
+import numpy as np
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.models.dqn import MLPDeepQN, ConvDeepQN
+from avalanche_rl.models.actor_critic import ConvActorCritic
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.optim import Adam
+
+
+def time_updates(model, precision: str, batch_size: int = 32,
+                 n_iters: int = 20):
+    x = torch.rand(batch_size, 4, 84, 84)
+    optimizer = Adam(model.parameters(), lr=1e-4)
+    with torch.autocast('cpu', dtype=torch.bfloat16,
+                        enabled=precision == 'bf16'):
+        # warmup
+        model(x)
+    start = time.perf_counter()
+    for _ in range(n_iters):
+        with torch.autocast('cpu', dtype=torch.bfloat16,
+                            enabled=precision == 'bf16'):
+            out = model(x)
+        out = out[1] if isinstance(out, tuple) else out
+        loss = out.float().pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return n_iters * batch_size / (time.perf_counter() - start)
+
+
+def learning_curve(precision: str, seed: int = 0):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    scenario = gym_benchmark_generator(
+        ['CCartPole-v1'], n_parallel_envs=1, eval_envs=['CCartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=128, n_actions=2,
+                      hidden_layers=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters(), lr=1e-3), 5000, batch_size=32,
+        exploration_fraction=.2, rollouts_per_step=10,
+        replay_memory_size=10000, replay_memory_init_size=1000,
+        updates_per_step=1, target_net_update_interval=10, eval_every=500,
+        eval_episodes=5, eval_seed=seed, precision=precision)
+
+    # record mean return of each periodic evaluation
+    curve = []
+    evaluate_exp = strategy.evaluate_exp
+
+    def evaluate_and_record(**kwargs):
+        evaluate_exp(**kwargs)
+        curve.append(np.mean(strategy.eval_rewards['past_returns']))
+    strategy.evaluate_exp = evaluate_and_record
+
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience, [scenario.eval_stream])
+    return curve, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print("Update throughput (samples/sec), batch of 4x84x84 frames")
+    for model_cls in [ConvDeepQN, ConvActorCritic]:
+        for precision in ['fp32', 'bf16']:
+            model = model_cls(4, (84, 84), 6)
+            print(f"\t{model_cls.__name__:16s} {precision}: "
+                  f"{time_updates(model, precision):.1f}")
+
+    print("\nCCartPole-v1 DQN learning curves (mean eval return)")
+    curves = {}
+    for precision in ['fp32', 'bf16']:
+        curves[precision], elapsed = learning_curve(precision)
+        print(f"\t{precision} ({elapsed:.1f}s): "
+              f"{np.round(curves[precision], 1).tolist()}")
+    gap = np.abs(np.asarray(curves['fp32']) - np.asarray(curves['bf16']))
+    print(f"\tmax return gap between precisions: {gap.max():.1f}")
@@ -0,0 +1,45 @@
+"""
+    Per-step policy inference latency of eager models against their traced
+    (TorchScript) policy export, as used in rollouts and evaluation with
+    `traced_policy=True`, for batches of 1 to 64 observations (i.e. number of
+    parallel environments).
+"""
+import time
+import torch
+from avalanche_rl.models.dqn import MLPDeepQN
+from avalanche_rl.models.actor_critic import ActorCriticMLP
+from avalanche_rl.training.strategies.policy_export import GreedyPolicy, \
+    CategoricalPolicy, trace_policy
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+N_STEPS = 2000
+
+
+@torch.no_grad()
+def step_latency(policy, batch_size: int) -> float:
+    """ Mean seconds per policy call on a batch of observations. """
+    observations = torch.randn(batch_size, 4)
+    # warmup
+    for _ in range(100):
+        policy(observations)
+    start = time.perf_counter()
+    for _ in range(N_STEPS):
+        policy(observations)
+    return (time.perf_counter() - start) / N_STEPS
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    policies = {
+        'dqn': GreedyPolicy(MLPDeepQN(
+            input_size=4, hidden_size=64, n_actions=2, hidden_layers=2)),
+        'a2c': CategoricalPolicy(ActorCriticMLP(4, 2, 64, 64))}
+    for name, policy in policies.items():
+        policy.eval()
+        traced = trace_policy(policy, torch.randn(1, 4))
+        print(f"{name} policy latency per step (us), eager/traced:")
+        for batch_size in BATCH_SIZES:
+            eager_t = step_latency(policy, batch_size) * 1e6
+            traced_t = step_latency(traced, batch_size) * 1e6
+            print(f"\tbatch {batch_size:2d}: {eager_t:7.1f} / "
+                  f"{traced_t:7.1f} ({eager_t / traced_t:.2f}x)")
@@ -0,0 +1,71 @@
+"""
+    Benchmark of PPO against A2C on CCartPole-v1: both strategies are trained
+    on the same parallel envs for the same number of environment steps and
+    the wall-clock time (and env steps) needed to reach a mean evaluation
+    return threshold is reported.
+"""
+import time
+import torch
+import numpy as np
+from avalanche_rl.training.strategies import A2CStrategy, PPOStrategy
+from avalanche_rl.models.actor_critic import ActorCriticMLP
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.optim import Adam
+
+N_ENVS = 8
+ENV_STEPS = 200000
+RETURN_THRESHOLD = 195.
+
+
+def time_to_threshold(strategy_name: str, seed: int = 0):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    scenario = gym_benchmark_generator(
+        ['CCartPole-v1'], n_parallel_envs=N_ENVS,
+        eval_envs=['CCartPole-v1'])
+    model = ActorCriticMLP(4, 2, 64, 64)
+    optimizer = Adam(model.parameters(), lr=3e-4)
+    if strategy_name == 'a2c':
+        rollout_steps = 5
+        strategy = A2CStrategy(
+            model, optimizer, ENV_STEPS // (N_ENVS * rollout_steps),
+            max_steps_per_rollout=rollout_steps, gae_lambda=1.,
+            eval_every=100, eval_episodes=5, eval_seed=seed)
+    else:
+        rollout_steps = 128
+        strategy = PPOStrategy(
+            model, optimizer, ENV_STEPS // (N_ENVS * rollout_steps),
+            max_steps_per_rollout=rollout_steps, ppo_epochs=4,
+            n_minibatches=4, eval_every=4, eval_episodes=5, eval_seed=seed)
+
+    # record time and env steps of the first periodic evaluation reaching
+    # the threshold
+    start = time.perf_counter()
+    reached = []
+    evaluate_exp = strategy.evaluate_exp
+
+    def evaluate_and_check(**kwargs):
+        evaluate_exp(**kwargs)
+        if not len(reached) and np.mean(
+                strategy.eval_rewards['past_returns']) >= RETURN_THRESHOLD:
+            env_steps = (strategy.timestep + 1) * N_ENVS * rollout_steps
+            reached.append((time.perf_counter() - start, env_steps))
+    strategy.evaluate_exp = evaluate_and_check
+
+    for experience in scenario.train_stream:
+        strategy.train(experience, [scenario.eval_stream])
+    return reached[0] if len(reached) else None
+
+
+if __name__ == "__main__":
+    print(f"CCartPole-v1, {N_ENVS} envs: time to mean eval return "
+          f">= {RETURN_THRESHOLD}")
+    for strategy_name in ['a2c', 'ppo']:
+        result = time_to_threshold(strategy_name)
+        if result is None:
+            print(f"\t{strategy_name}: threshold not reached in "
+                  f"{ENV_STEPS} env steps")
+        else:
+            print(f"\t{strategy_name}: {result[0]:.1f}s, "
+                  f"{result[1]} env steps")
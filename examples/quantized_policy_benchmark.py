@@ -0,0 +1,99 @@
+"""
+    Benchmark of rollouts acting with a dynamically quantized int8 copy of
+    the policy (`quantized_policy_interval`) against the float model on cpu.
+    First, policy inference throughput (steps/sec) of `ConvDeepQN` and
+    `ActorCriticMLP` is compared on batches of parallel env observations.
+    Then A2C rollouts on CartPole-v1 are timed end to end and, as a parity
+    check, a DQN agent trained on CartPole-v1 is evaluated with both its
+    float policy and its quantized copy on the same seeded episodes.
+"""
+import copy
+import time
+import torch
+import numpy as np
+from avalanche_rl.training.strategies import A2CStrategy, DQNStrategy
+from avalanche_rl.training.strategies.policy_export import quantize_policy
+from avalanche_rl.training.strategies.eval_executor import \
+    evaluate_episodes
+from avalanche_rl.models.dqn import MLPDeepQN, ConvDeepQN
+from avalanche_rl.models.actor_critic import ActorCriticMLP
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.optim import Adam
+
+N_ENVS = 8
+
+
+@torch.no_grad()
+def inference_steps_per_sec(model, input_shape, n_iters: int = 200):
+    x = torch.rand(N_ENVS, *input_shape)
+    # warmup
+    model(x)
+    start = time.perf_counter()
+    for _ in range(n_iters):
+        model(x)
+    return n_iters * N_ENVS / (time.perf_counter() - start)
+
+
+def rollout_steps_per_sec(quantized_policy_interval: int = None,
+                          seed: int = 0):
+    torch.manual_seed(seed)
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=N_ENVS)
+    model = ActorCriticMLP(4, 2, 256, 256)
+    strategy = A2CStrategy(
+        model, Adam(model.parameters(), lr=1e-4), 500,
+        max_steps_per_rollout=5,
+        quantized_policy_interval=quantized_policy_interval)
+    start = time.perf_counter()
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    return strategy.total_steps * N_ENVS / (time.perf_counter() - start)
+
+
+def eval_parity(n_episodes: int = 20, seed: int = 0):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=1, eval_envs=['CartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=128, n_actions=2,
+                      hidden_layers=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters(), lr=1e-3), 5000, batch_size=32,
+        exploration_fraction=.2, rollouts_per_step=10,
+        replay_memory_size=10000, replay_memory_init_size=1000,
+        target_net_update_interval=10, quantized_policy_interval=10)
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+
+    experience = scenario.eval_stream[0]
+    returns = {}
+    for name, policy in [('float', model), ('int8', quantize_policy(model))]:
+        env = copy.deepcopy(experience.environment)
+        env.seed(seed)
+        returns[name], _ = evaluate_episodes(
+            policy, env, experience.task_label, n_episodes)
+    return returns
+
+
+if __name__ == "__main__":
+    print(f"Policy inference steps/sec on {N_ENVS} envs, float / int8:")
+    for name, model, input_shape in [
+            ('ConvDeepQN', ConvDeepQN(4, (84, 84), 6), (4, 84, 84)),
+            ('ActorCriticMLP', ActorCriticMLP(4, 2, 256, 256), (4,))]:
+        model.eval()
+        float_sps = inference_steps_per_sec(model, input_shape)
+        int8_sps = inference_steps_per_sec(
+            quantize_policy(model), input_shape)
+        print(f"\t{name}: {float_sps:.0f} / {int8_sps:.0f} "
+              f"({int8_sps / float_sps:.2f}x)")
+
+    float_sps = rollout_steps_per_sec()
+    int8_sps = rollout_steps_per_sec(quantized_policy_interval=10)
+    print(f"A2C training env steps/sec on CartPole-v1: {float_sps:.0f} "
+          f"float / {int8_sps:.0f} int8 ({int8_sps / float_sps:.2f}x)")
+
+    returns = eval_parity()
+    print("DQN eval return on CartPole-v1 (mean +- std): " + ", ".join(
+        f"{name} {np.mean(r):.1f} +- {np.std(r):.1f}"
+        for name, r in returns.items()))
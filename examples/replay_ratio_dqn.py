@@ -0,0 +1,53 @@
+import torch
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.training.strategies.dqn import default_dqn_logger
+from avalanche_rl.training.plugins.rl_plugins import RLEvaluationPlugin
+from avalanche_rl.training.plugins.replay_ratio import ReplayRatioScheduler
+from avalanche_rl.evaluation.metrics.reward import GenericFloatMetric
+from avalanche_rl.models.dqn import MLPDeepQN
+from torch.optim import Adam
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+
+if __name__ == "__main__":
+    device = torch.device('cuda:0') if torch.cuda.is_available() else 'cpu'
+    n_envs = 4
+
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'],
+        n_parallel_envs=n_envs, eval_envs=['CartPole-v1'], n_experiences=1)
+
+    model = MLPDeepQN(input_size=4, hidden_size=1024,
+                      n_actions=2, hidden_layers=2)
+    optimizer = Adam(model.parameters(), lr=1e-3)
+
+    # instead of hand-tuning `updates_per_step` for this env and host,
+    # target a quarter of an update per env transition; alternatively,
+    # `learning_fraction=.5` splits wall-clock time evenly between
+    # collection and learning
+    scheduler = ReplayRatioScheduler(replay_ratio=.25, max_updates=32)
+
+    # log the number of updates chosen at each iteration
+    evaluator = RLEvaluationPlugin(
+        *default_dqn_logger.metrics,
+        GenericFloatMetric(
+            'updates_per_step', 'Updates per Step',
+            update_on=['after_rollout'], emit_on=['after_rollout']),
+        loggers=default_dqn_logger.loggers)
+
+    strategy = DQNStrategy(model, optimizer, 1000, batch_size=32,
+                           exploration_fraction=.2, max_steps_per_rollout=8,
+                           replay_memory_size=10000,
+                           replay_memory_init_size=1000,
+                           target_net_update_interval=10, eval_every=500,
+                           eval_episodes=10, plugins=[scheduler],
+                           evaluator=evaluator, device=device)
+
+    # TRAINING LOOP
+    print('Starting experiment...')
+    for experience in scenario.train_stream:
+        strategy.train(experience, scenario.eval_stream)
+
+    print('Training completed')
+    print(f"Achieved replay ratio {scheduler.achieved_replay_ratio:.3f}, "
+          f"{strategy.total_updates} updates")
@@ -1,7 +1,10 @@
 import pytest
 import numpy as np
 import torch
-from avalanche_rl.training.strategies.buffers import ReplayMemory, Step, Rollout
+from avalanche_rl.training.strategies.buffers import ReplayMemory, Step, \
+    Rollout, EpisodeRecords
+from avalanche_rl.training.strategies.advantages import \
+    generalized_advantages
 from itertools import product
 
 
@@ -181,3 +184,51 @@ def test_replay_mem_sampling(device):
         assert getattr(batch, attr).device == torch.device(device)
     # TODO: this only works if we copy over steps too
     # assert len(batch) == 10
+
+
+def test_episode_records():
+    records = EpisodeRecords(capacity=5)
+    assert len(records) == 0
+    records.add(np.asarray([1., 2.]), np.asarray([10, 20]),
+                np.asarray([0, 1]), step=3)
+    assert len(records) == 2 and records.n_records == 2
+    assert (records.last(2, 'returns') == [1., 2.]).all()
+    assert (records.last(1, 'lengths') == [20]).all()
+    assert (records.last(10, 'steps') == [3, 3]).all()
+
+    # overflow the ring, only the most recent records are kept in order
+    records.add(np.arange(3, 10, dtype=np.float32), np.arange(3, 10),
+                np.zeros(7, dtype=np.int64), step=4)
+    assert len(records) == 5 and records.n_records == 9
+    assert (records.last(5, 'returns') == np.arange(5, 10)).all()
+    assert (records.last(2, 'env_ids') == [0, 0]).all()
+
+
+@pytest.mark.parametrize('gae_lambda', [0., 0.95, 1.])
+def test_generalized_advantages(gae_lambda: float):
+    T, n_envs, gamma = 6, 3, 0.9
+    rewards = torch.rand(T, n_envs, 1)
+    values = torch.rand(T, n_envs, 1)
+    dones = torch.rand(T, n_envs, 1) < 0.3
+    next_values = torch.rand(T, n_envs, 1)
+    next_values[:-1] = values[1:]
+    next_values = next_values.masked_fill(dones, 0.)
+
+    advantages, returns = generalized_advantages(
+        rewards, values, next_values, dones, gamma, gae_lambda)
+    assert advantages.shape == returns.shape == (T, n_envs, 1)
+    assert torch.allclose(returns, advantages + values)
+    if gae_lambda == 0.:
+        assert torch.allclose(returns, rewards + gamma * next_values)
+    elif gae_lambda == 1.:
+        # n-step returns bootstrapped at the end of the rollout
+        for env, t in product(range(n_envs), range(T)):
+            ret, discount = 0., 1.
+            for k in range(t, T):
+                ret += discount * rewards[k, env, 0].item()
+                if dones[k, env, 0]:
+                    break
+                discount *= gamma
+            else:
+                ret += discount * next_values[-1, env, 0].item()
+            assert abs(ret - returns[t, env, 0].item()) < 1e-5
@@ -0,0 +1,125 @@
+import pytest
+import torch
+import numpy as np
+from avalanche_rl.training.plugins.ewc import EWCRL
+from avalanche_rl.training.strategies import DQNStrategy
+from avalanche_rl.training.strategies.buffers import ReplayMemory
+from avalanche_rl.models.dqn import MLPDeepQN
+from avalanche_rl.benchmarks.rl_benchmark_generators \
+    import gym_benchmark_generator
+from torch.nn.utils import parameters_to_vector
+from torch.optim import Adam
+
+
+def test_folded_penalty():
+    ewc = EWCRL(1., ReplayMemory(size=10, n_envs=1), mode='separate')
+    importances, params = [], []
+    for _ in range(3):
+        importances.append(torch.rand(100) * (torch.rand(100) > 0.3))
+        params.append(torch.randn(100))
+        ewc._fold_penalty(importances[-1], params[-1])
+
+    theta = torch.randn(100)
+    penalty = sum((f * (theta - p).pow(2)).sum()
+                  for f, p in zip(importances, params))
+    folded_penalty = torch.dot(
+        ewc._fisher_sum, (theta - ewc._fisher_mean).pow(2)) + \
+        ewc._penalty_offset
+    assert torch.isclose(folded_penalty, penalty, rtol=1e-4)
+
+
+def test_per_sample_importances():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    memory = ReplayMemory(size=1000, n_envs=1)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=100,
+        batch_size=8, initial_replay_memory=memory)
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+
+    ewc = EWCRL(1., memory, fisher_update_steps=2, batch_size=5,
+                fisher='per_sample', fisher_chunk_size=3)
+    np.random.seed(0)
+    importances = ewc.compute_importances(
+        model, strategy, strategy.optimizer)
+
+    # same samples, one backward per sample
+    np.random.seed(0)
+    batch = memory.sample_batch(10, strategy.device)
+    expected = torch.zeros_like(importances)
+    for i in range(10):
+        sample = batch[i:i+1]
+        model.zero_grad()
+        strategy.batch_loss(sample).backward()
+        expected += parameters_to_vector(
+            p.grad for p in model.parameters()).pow(2)
+    assert torch.allclose(importances, expected / 10, atol=1e-6)
+
+
+@pytest.mark.parametrize('barrier', ['wait', 'skip'])
+def test_async_importances(barrier: str):
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    memory = ReplayMemory(size=1000, n_envs=1)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=100,
+        batch_size=8, initial_replay_memory=memory)
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+
+    importances = []
+    for async_importances in [False, True]:
+        ewc = EWCRL(1., memory, fisher_update_steps=2, batch_size=5,
+                    fisher='per_sample', async_importances=async_importances,
+                    importances_barrier=barrier)
+        np.random.seed(0)
+        ewc.after_training_exp(strategy)
+        if async_importances:
+            assert ewc._pending_importances is not None
+            # importances of the last experience are installed at the end
+            ewc.after_training(strategy)
+            assert ewc._pending_importances is None
+            assert ewc._importances_executor is None
+        importances.append(ewc.importances[strategy.training_exp_counter])
+    assert torch.allclose(*importances)
+
+
+def test_compact_storage(tmp_path):
+    ewc = EWCRL(1., ReplayMemory(size=10, n_envs=1), mode='separate',
+                keep_importance_data=True,
+                storage_dtype=torch.float16, importances_topk=0.1,
+                max_in_memory_experiences=1, spill_dir=str(tmp_path))
+    params = []
+    for exp in range(3):
+        params.append(torch.randn(1000))
+        ewc._store_importances(exp, torch.rand(1000), params[-1])
+
+    report = ewc.storage_report()
+    assert set(report['experiences']) == {0, 1, 2}
+    for exp in [0, 1]:
+        assert report['experiences'][exp]['memory_bytes'] == 0
+        assert report['experiences'][exp]['disk_bytes'] > 0
+    # float16 parameters, 100 importances with their int32 indices
+    assert report['experiences'][2]['memory_bytes'] == 2000 + 100 * 6
+    assert report['penalty_bytes'] == 2 * 4000
+
+    for exp in range(3):
+        assert (ewc.importances[exp] > 0).sum() == 100
+        assert ewc.saved_params[exp].dtype == torch.float32
+        assert torch.allclose(
+            ewc.saved_params[exp], params[exp], rtol=1e-3, atol=1e-3)
+
+    # spilled entries are deleted on close
+    assert any(tmp_path.iterdir())
+    ewc.close()
+    assert not any(tmp_path.iterdir())
+
+
+def test_importance_data():
+    ewc = EWCRL(1., ReplayMemory(size=10, n_envs=1), mode='separate')
+    for exp in range(3):
+        ewc._store_importances(exp, torch.rand(100), torch.randn(100))
+    # past penalties are folded, only the last experience data is kept
+    assert list(ewc.importances.keys()) == [2]
+    assert list(ewc.saved_params.keys()) == [2]
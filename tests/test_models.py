@@ -0,0 +1,38 @@
+import torch
+from avalanche_rl.models.dqn import EWCConvDeepQN
+
+
+def test_ewc_dqn_mixed_task_forward():
+    model = EWCConvDeepQN(4, (84, 84), 3, n_tasks=2, bias=True)
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(torch.randn_like(p) * 0.1)
+    x = torch.rand(6, 4, 84, 84)
+    task_labels = torch.tensor([0, 1, 0, 1, 1, 0])
+
+    # single forward over a batch mixing tasks
+    q_values = model(x, task_label=task_labels)
+    for task in range(2):
+        mask = task_labels == task
+        assert torch.allclose(
+            q_values[mask], model(x[mask], task_label=task), atol=1e-5)
+
+
+def test_ewc_dqn_other_tasks_untouched():
+    model = EWCConvDeepQN(4, (84, 84), 3, n_tasks=3)
+    optimizer = torch.optim.AdamW(model.parameters(), weight_decay=0.1)
+    other_tasks = {k: p.detach().clone()
+                   for k, p in model.named_parameters()
+                   if k.endswith('_2')}
+    x = torch.rand(4, 4, 84, 84)
+
+    for task_label in [1, torch.tensor([0, 1, 1, 0])]:
+        optimizer.zero_grad()
+        model(x, task_label=task_label).sum().backward()
+        optimizer.step()
+    # parameters of tasks not in the batch have no gradient and aren't
+    # decayed by the optimizer
+    for k, p in model.named_parameters():
+        if k in other_tasks:
+            assert p.grad is None
+            assert torch.equal(p, other_tasks[k])
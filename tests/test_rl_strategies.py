@@ -1,11 +1,22 @@
 import pytest
+import threading
+import warnings
 import torch
 import torch.nn as nn
 import numpy as np
 from avalanche_rl.training.strategies import *
 from avalanche.models.simple_mlp import SimpleMLP
+from avalanche_rl.models.dqn import MLPDeepQN
+from avalanche_rl.models.actor_critic import ActorCriticMLP
+from avalanche_rl.training.utils import flat_parameters, \
+    average_gradients
+from avalanche_rl.training.plugins.rl_plugins import RLStrategyPlugin
+from avalanche_rl.training.plugins.replay_ratio import ReplayRatioScheduler
 from avalanche_rl.benchmarks.rl_benchmark_generators \
     import gym_benchmark_generator
+from gym.wrappers import TransformObservation
+from functools import partial
+from tqdm import tqdm
 from torch.optim import Adam
 
 
@@ -15,16 +26,17 @@ class RandomTestStrategy(RLBaseStrategy):
     def __init__(
             self, model, optimizer, per_experience_steps,
             rollouts_per_step: int, max_steps_per_rollout: int,
-            updates_per_step: int, plugins):
+            updates_per_step: int, plugins, **kwargs):
         super().__init__(
             model, optimizer, per_experience_steps, criterion=nn.MSELoss(),
             rollouts_per_step=rollouts_per_step,
             max_steps_per_rollout=max_steps_per_rollout,
-            updates_per_step=updates_per_step, plugins=plugins)
+            updates_per_step=updates_per_step, plugins=plugins, **kwargs)
 
-    def sample_rollout_action(self, observations: torch.Tensor):
+    def sample_rollout_action(self, observations: torch.Tensor,
+                              env_ids=None):
         return np.asarray([self.environment.action_space.sample()
-                           for i in range(self.n_envs)])
+                           for i in range(observations.shape[0])])
 
     def update(self, rollouts):
         # simulate loss implementation
@@ -46,13 +58,14 @@ class RandomTestStrategy(RLBaseStrategy):
 
 def make_random_strategy(
         per_experience_steps: int, rollouts_per_step: int,
-        max_steps_per_rollout: int, updates_per_step: int = 1, plugins=[]):
+        max_steps_per_rollout: int, updates_per_step: int = 1, plugins=[],
+        **kwargs):
     model = SimpleMLP(input_size=10, num_classes=3)
     optim = Adam(model.parameters())
     return RandomTestStrategy(
         model, optim, per_experience_steps, rollouts_per_step=rollouts_per_step,
         max_steps_per_rollout=max_steps_per_rollout,
-        updates_per_step=updates_per_step, plugins=plugins)
+        updates_per_step=updates_per_step, plugins=plugins, **kwargs)
 
 
 @pytest.mark.parametrize('rollouts_per_step, max_steps_per_rollout',
@@ -85,3 +98,537 @@ def test_rollouts_multienv(
 
     for experience in scenario.train_stream:
         test_strategy.train(experience)
+
+
+@pytest.mark.parametrize('pipeline_groups', [2, 3])
+def test_rollouts_pipelined(pipeline_groups: int):
+    test_strategy = make_random_strategy(
+        2, -1, 10, pipeline_groups=pipeline_groups)
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=3)
+
+    for experience in scenario.train_stream:
+        test_strategy.train(experience)
+        # every step of every env is recorded
+        assert test_strategy.rollout_steps == 2 * 10
+        assert test_strategy._inflight_actions is None
+
+
+def test_parallel_evaluation():
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=1, eval_envs=['CartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, eval_episodes=5, eval_n_envs=2)
+
+    strategy.eval(scenario.eval_stream)
+    returns = strategy.eval_rewards['past_returns']
+    lengths = strategy.eval_ep_lengths[0]
+    assert len(returns) == len(lengths) == 5
+    # CartPole gives a reward of 1 at each step
+    assert all(r == ep_len for r, ep_len in zip(returns, lengths))
+
+
+def test_concurrent_evaluation():
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=1,
+        eval_envs=['CartPole-v1', 'CartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, eval_episodes=3, eval_workers=2)
+
+    results = strategy.eval_executor.evaluate(
+        model, scenario.eval_stream, strategy.eval_episodes)
+    assert len(results) == len(scenario.eval_stream)
+    for returns, lengths in results:
+        assert len(returns) == len(lengths) == 3
+
+    metrics = strategy.eval_concurrent([scenario.eval_stream])
+    assert len(metrics)
+    assert len(strategy.eval_rewards['past_returns']) == 3
+    strategy.eval_executor.shutdown()
+
+    # workers act with the traced policy of the strategy
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, eval_episodes=3, eval_workers=2,
+        traced_policy=True)
+    strategy.eval_concurrent([scenario.eval_stream])
+    assert len(strategy.eval_rewards['past_returns']) == 3
+    strategy.eval_executor.shutdown()
+    # seeded workers play the same episodes as the main process
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, eval_episodes=3, eval_workers=1,
+        eval_seed=0)
+    strategy.eval(scenario.eval_stream[0])
+    returns = strategy.eval_rewards['past_returns']
+    strategy.eval_concurrent([scenario.eval_stream[0]])
+    assert strategy.eval_rewards['past_returns'] == returns
+    strategy.eval_executor.shutdown()
+    # workers run episodes one after another
+    with pytest.raises(AssertionError):
+        DQNStrategy(model, Adam(model.parameters()), 10, eval_workers=2,
+                    eval_n_envs=2)
+
+
+def test_async_evaluation():
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=1, eval_envs=['CartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 20, replay_memory_init_size=100,
+        batch_size=8, eval_every=5, eval_episodes=2, async_eval=True,
+        max_inflight_evals=1)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience, [scenario.eval_stream])
+        # all evaluations are reported by the end of training
+        assert not len(strategy._inflight_evals)
+        assert strategy.eval_train_step is None
+    assert len(strategy.eval_rewards['past_returns']) == 2
+
+
+def test_eval_cache():
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=1, eval_envs=['CartPole-v1'])
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, eval_episodes=2,
+        eval_cache='version', eval_seed=0)
+    n_envs_made = []
+    make_eval_env = strategy.make_eval_env
+
+    def counting_make_eval_env(**kwargs):
+        n_envs_made.append(1)
+        return make_eval_env(**kwargs)
+    strategy.make_eval_env = counting_make_eval_env
+
+    strategy.eval(scenario.eval_stream)
+    returns = strategy.eval_rewards['past_returns']
+    # unchanged weights, results come from cache
+    strategy.eval(scenario.eval_stream)
+    assert len(n_envs_made) == 1
+    assert strategy.eval_rewards['past_returns'] == returns
+
+    # weights update invalidates the cache
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(1.)
+    strategy.eval(scenario.eval_stream)
+    assert len(n_envs_made) == 2
+
+    strategy.invalidate_eval_cache()
+    strategy.eval(scenario.eval_stream)
+    assert len(n_envs_made) == 3
+
+    # results of other eval settings aren't reused
+    strategy.eval_n_envs = 2
+    strategy.eval(scenario.eval_stream)
+    assert len(n_envs_made) == 4
+
+
+def test_obs_staging():
+    # float64 observations must be converted before reaching the model
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=2, env_wrappers=[partial(
+            TransformObservation, f=partial(np.asarray, dtype=np.float64))])
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=100,
+        batch_size=8, obs_staging=True)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        staging = strategy._obs_staging_buffer
+        assert staging.shape == (2, 4) and staging.dtype == torch.float32
+        # observations are stored with the dtype returned by the env
+        assert strategy._obs.dtype == torch.float64
+        assert strategy.replay_memory.observations.dtype == torch.float64
+
+
+def test_bf16_precision():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    # no deprecated amp api in use
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        strategy = DQNStrategy(
+            model, Adam(model.parameters()), 10,
+            replay_memory_init_size=100, batch_size=8, precision='bf16')
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        # loss is computed in full precision
+        assert strategy.loss.dtype == torch.float32
+    for p in model.parameters():
+        assert p.dtype == torch.float32
+
+
+def test_flat_params():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=100,
+        batch_size=8, target_net_update_interval=2, polyak_update_tau=.5,
+        flat_params=True)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        flat = flat_parameters(model)
+        target_flat = flat_parameters(strategy.target_net)
+        assert flat is not None and target_flat is not None
+        # parameters are views over the flat buffer and are still updated
+        assert torch.equal(
+            flat, torch.nn.utils.parameters_to_vector(model.parameters()))
+        assert not torch.equal(flat, target_flat)
+
+
+@pytest.mark.parametrize('gae_lambda', [0., 0.9, 1.])
+def test_a2c_advantages(gae_lambda: float):
+    model = ActorCriticMLP(4, 3, 32, 32)
+    strategy = A2CStrategy(
+        model, Adam(model.parameters()), 10, gae_lambda=gae_lambda)
+    gamma, n_envs, lengths = strategy.gamma, 2, [4, 3]
+
+    class FakeRollout:
+        def __init__(self, length):
+            self.length, self.n_envs = length, n_envs
+
+        def __len__(self):
+            return self.length
+
+    # time-major rollouts, row t * n_envs + env
+    n = sum(lengths) * n_envs
+    actions = torch.randint(3, (n, 1))
+    rewards = torch.rand(n, 1)
+    dones = torch.rand(n, 1) < 0.3
+    values, next_values = torch.rand(n, 3), torch.rand(n, 3)
+    next_values = next_values.masked_fill(dones, 0.)
+    next_logits = torch.randn(n, 3)
+    advantages, value_targets = strategy._rollout_advantages(
+        [FakeRollout(length) for length in lengths], actions, rewards,
+        dones, values, next_values, next_logits)
+
+    # hand-computed GAE, chained through the next taken action and
+    # bootstrapped from the expected next state value at rollout end
+    expected_next = (torch.softmax(next_logits, -1) * next_values).sum(-1)
+    offset = 0
+    for length in lengths:
+        for env in range(n_envs):
+            gae = 0.
+            for t in reversed(range(length)):
+                i = offset + t * n_envs + env
+                a = actions[i, 0]
+                if dones[i, 0]:
+                    next_value, gae = 0., 0.
+                elif t == length - 1:
+                    next_value = expected_next[i].item()
+                else:
+                    next_value = values[i + n_envs, actions[i + n_envs, 0]]
+                delta = rewards[i, 0] + gamma * next_value - values[i, a]
+                gae = delta + gamma * gae_lambda * gae
+                assert torch.isclose(advantages[i, 0], gae, atol=1e-5)
+                # lambda-return target only for the taken action
+                targets = rewards[i, 0] + gamma * next_values[i]
+                targets[a] = gae + values[i, a]
+                assert torch.allclose(value_targets[i], targets, atol=1e-5)
+        offset += length * n_envs
+
+
+def test_ppo():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=2)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    strategy = PPOStrategy(
+        model, Adam(model.parameters()), 3, max_steps_per_rollout=16,
+        ppo_epochs=2, n_minibatches=4)
+    assert strategy.updates_per_step == 8
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        # rollout of 16 steps from 2 envs kept in the buffer
+        assert strategy._buffer['observations'].shape == (32, 4)
+        assert strategy._buffer['advantages'].shape == (32,)
+
+
+def test_ppo_single_step_rollout():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    strategy = PPOStrategy(
+        model, Adam(model.parameters()), 3, max_steps_per_rollout=1,
+        ppo_epochs=2, n_minibatches=1, updates_per_step=2)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        # a single advantage isn't normalized
+        assert torch.isfinite(strategy._buffer['advantages']).all()
+    assert all(torch.isfinite(p).all() for p in model.parameters())
+
+
+@pytest.mark.parametrize('strategy_name', ['dqn', 'a2c'])
+def test_traced_policy(strategy_name: str):
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1'], n_parallel_envs=2, eval_envs=['CartPole-v1'])
+    if strategy_name == 'dqn':
+        model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+        strategy = DQNStrategy(
+            model, Adam(model.parameters()), 10, replay_memory_init_size=20,
+            batch_size=8, eval_episodes=2, traced_policy=True)
+    else:
+        model = ActorCriticMLP(4, 2, 32, 32)
+        strategy = A2CStrategy(
+            model, Adam(model.parameters()), 10, max_steps_per_rollout=5,
+            eval_episodes=2, traced_policy=True)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    traced = strategy._traced[1]
+    assert isinstance(traced, torch.jit.ScriptModule)
+
+    # traced module shares weights with the model and any batch size works
+    obs = torch.randn(7, 4)
+    if strategy_name == 'dqn':
+        assert np.array_equal(
+            traced(obs).numpy(), model.get_action(obs).astype(np.int64))
+    else:
+        assert traced(obs).shape == (7,)
+
+    strategy.eval(scenario.eval_stream)
+    assert len(strategy.eval_rewards['past_returns']) == 2
+
+
+def test_quantized_policy():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=2)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    strategy = A2CStrategy(
+        model, Adam(model.parameters()), 10, max_steps_per_rollout=5,
+        quantized_policy_interval=3)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    quantized = strategy.rollout_model
+    assert quantized is not model
+    # actors act with an int8 copy, at most 3 updates old
+    assert isinstance(quantized.actor[0],
+                      torch.ao.nn.quantized.dynamic.Linear)
+    assert isinstance(model.actor[0], nn.Linear)
+    assert strategy.total_updates == 10
+    assert strategy.total_updates - strategy._quantized_at < 3
+
+
+def test_actor_inference():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=2)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    strategy = A2CStrategy(
+        model, Adam(model.parameters()), 10, max_steps_per_rollout=5,
+        actor_inference=True, weights_broadcast_interval=2)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        assert strategy.rollout_steps == 10 * 5
+        # policy is sent on first rollout, then broadcast every 2 updates
+        assert strategy.policy_version == 4
+        assert np.all(strategy.actor_policy_versions == 4)
+    # actors don't act with an int8 copy
+    with pytest.raises(AssertionError):
+        A2CStrategy(model, Adam(model.parameters()), 10,
+                    actor_inference=True, quantized_policy_interval=2)
+
+
+def test_inference_server():
+    scenario = gym_benchmark_generator(
+        ['CartPole-v1', 'CartPole-v1'], n_parallel_envs=4)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    servers = []
+
+    class CountServers(RLStrategyPlugin):
+        def after_training_exp(self, strategy, **kwargs):
+            # server is shut down with the experience env
+            assert not strategy.inference_server.running
+            assert strategy.rollout_steps == 5 * 8
+            servers.append(strategy.inference_server)
+
+    strategy = A2CStrategy(
+        model, Adam(model.parameters()), 5, max_steps_per_rollout=8,
+        inference_server=True, inference_max_batch=2,
+        plugins=[CountServers()])
+
+    # a new server is started for each experience
+    strategy.train(scenario.train_stream)
+    assert len(servers) == 2 and servers[0] is not servers[1]
+    # each step of each env is served exactly once, in batches of at most 2
+    batch_counts, batch_sizes = \
+        strategy.inference_server.histograms()['batch_size']
+    assert len(batch_counts) == 3
+    assert batch_counts.dot(batch_sizes) == 5 * 8 * 4
+    latency_counts, _ = strategy.inference_server.histograms()['latency']
+    assert latency_counts.sum() == 5 * 8 * 4
+
+
+def _a3c(rank: int):
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = ActorCriticMLP(4, 2, 32, 32)
+    rollouts = []
+
+    class CountRollouts(RLStrategyPlugin):
+        def after_rollout(self, strategy, **kwargs):
+            rollouts.append(strategy.episodes.n_records)
+
+    # default evaluator, whose progress bars start the tqdm monitor thread
+    strategy = A3CStrategy(
+        model, Adam(model.parameters()), 20, n_workers=2,
+        max_steps_per_rollout=5, plugins=[CountRollouts()])
+    monitor_interval = tqdm.monitor_interval
+    params = torch.nn.utils.parameters_to_vector(model.parameters()).clone()
+    # shared optimizer state is created without counting an Adam step
+    strategy._share_memory()
+    assert all(state['step'] == 0
+               for state in strategy.optimizer.state.values())
+    assert torch.equal(
+        params, torch.nn.utils.parameters_to_vector(model.parameters()))
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+        assert strategy.total_updates == 20
+        # train metrics see each worker rollout and its episodes
+        assert len(rollouts) == 20
+        assert rollouts[-1] == strategy.episodes.n_records
+        # workers perform rollouts of at most 5 steps
+        assert 20 <= strategy.rollout_steps <= 20 * 5
+        assert tqdm.monitor_interval == monitor_interval
+    # shared parameters were updated by workers
+    assert all(p.is_shared() for p in model.parameters())
+    assert not torch.equal(
+        params, torch.nn.utils.parameters_to_vector(model.parameters()))
+
+    # workers aren't forked while other threads are running
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    with pytest.raises(AssertionError):
+        strategy.train(experience)
+    stop.set()
+    thread.join()
+
+
+def test_a3c():
+    # A3C learner must be single threaded, don't inherit threads (e.g. of
+    # Ray) started by other tests
+    torch.multiprocessing.spawn(_a3c, nprocs=1)
+
+
+def _distributed_dqn(rank: int, world_size: int, init_file: str):
+    torch.distributed.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=world_size)
+    torch.manual_seed(rank)
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=1)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    # number of updates chosen from local timings is the same on all ranks
+    scheduler = ReplayRatioScheduler(learning_fraction=0.5, max_updates=4)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=50,
+        batch_size=8, distributed=True, plugins=[scheduler])
+    assert strategy.is_main_process == (rank == 0)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    # replicas trained on their own data are still in sync
+    params = torch.nn.utils.parameters_to_vector(model.parameters())
+    all_params = [torch.zeros_like(params) for _ in range(world_size)]
+    torch.distributed.all_gather(all_params, params)
+    assert all(torch.equal(params, p) for p in all_params)
+    target_params = torch.nn.utils.parameters_to_vector(
+        strategy.target_net.parameters())
+    torch.distributed.all_gather(all_params, target_params)
+    assert all(torch.equal(target_params, p) for p in all_params)
+    total_updates = torch.tensor([strategy.total_updates])
+    all_updates = [torch.zeros_like(total_updates)
+                   for _ in range(world_size)]
+    torch.distributed.all_gather(all_updates, total_updates)
+    assert all(torch.equal(total_updates, u) for u in all_updates)
+    torch.distributed.destroy_process_group()
+
+
+def test_distributed_learner(tmp_path):
+    torch.multiprocessing.spawn(
+        _distributed_dqn, args=(2, str(tmp_path / 'init')), nprocs=2)
+
+
+def _average_gradients(rank: int, world_size: int, init_file: str):
+    torch.distributed.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=world_size)
+    # gradients for all parameters, the first layer only on rank 0 and no
+    # gradient for the last layer
+    model = nn.Sequential(nn.Linear(2, 2), nn.Linear(2, 2), nn.Linear(2, 2))
+    for i, layer in enumerate(model[:2]):
+        if i > 0 or rank == 0:
+            for p in layer.parameters():
+                p.grad = torch.full_like(p, rank + 1.)
+    average_gradients(model)
+    for p in model[0].parameters():
+        assert torch.equal(p.grad, torch.full_like(p, .5))
+    for p in model[1].parameters():
+        assert torch.equal(p.grad, torch.full_like(p, 1.5))
+    # optimizers still skip parameters without gradient on every rank
+    assert all(p.grad is None for p in model[2].parameters())
+    torch.distributed.destroy_process_group()
+
+
+def test_average_gradients(tmp_path):
+    torch.multiprocessing.spawn(
+        _average_gradients, args=(2, str(tmp_path / 'init')), nprocs=2)
+
+
+def test_vectorized_exploration():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=4)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=40,
+        batch_size=8, epsilon_ladder=(0.4, 7.), exploration_seed=0)
+
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    assert np.allclose(
+        strategy.env_epsilons, 0.4 ** (1 + 7 * np.arange(4) / 3))
+
+    # only observations of exploiting envs are fed to the model
+    batch_sizes = []
+    model.register_forward_hook(
+        lambda m, inputs, out: batch_sizes.append(inputs[0].shape[0]))
+    strategy.env_epsilons = np.asarray([1., 0., 1., 0.])
+    actions = strategy.sample_rollout_action(torch.randn(4, 4))
+    assert actions.shape == (4,) and actions.dtype == np.int64
+    assert batch_sizes == [2]
+    # no forward at all if every env explores
+    strategy.env_epsilons = np.ones((4,))
+    strategy.sample_rollout_action(torch.randn(4, 4))
+    assert batch_sizes == [2]
+
+
+def test_replay_ratio_scheduler():
+    scenario = gym_benchmark_generator(['CartPole-v1'], n_parallel_envs=2)
+    model = MLPDeepQN(input_size=4, hidden_size=32, n_actions=2)
+    # 16 transitions per rollout (8 steps on 2 envs), one update every
+    # other rollout
+    scheduler = ReplayRatioScheduler(replay_ratio=1 / 32)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=40,
+        max_steps_per_rollout=8, batch_size=8, plugins=[scheduler])
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    assert [r['updates'] for r in scheduler.history] == [0, 1] * 5
+    assert strategy.total_updates == 5
+    # configured value is restored after the experience
+    assert strategy.updates_per_step == 1
+    assert scheduler.achieved_replay_ratio == pytest.approx(1 / 32)
+
+    scheduler = ReplayRatioScheduler(learning_fraction=0.5, max_updates=3)
+    strategy = DQNStrategy(
+        model, Adam(model.parameters()), 10, replay_memory_init_size=40,
+        max_steps_per_rollout=8, batch_size=8, plugins=[scheduler])
+    for experience in scenario.train_stream:
+        strategy.train(experience)
+    updates = [r['updates'] for r in scheduler.history]
+    # configured number of updates until timings are measured
+    assert updates[0] == 1
+    assert all(0 <= n <= 3 for n in updates)
+    assert strategy.total_updates == sum(updates)